@@ -5,16 +5,22 @@
     "depends": [
         "point_of_sale",
         "account",
+        "l10n_do_ncf",
     ],
     "data": [
+        "security/ir.model.access.csv",
         "data/ir_cron.xml",
 	"data/partner_data.xml",
+        "views/pos_invoice_queue_views.xml",
+        "views/res_company_views.xml",
+        "views/pos_payment_method_views.xml",
     ],
     "assets": {
         "point_of_sale._assets_pos": [        
 	    "lms_pos_fiscal_print/static/src/js/pos_block_odoo_pdf.js",
 	    "lms_pos_fiscal_print/static/lib/qz-tray/qz-tray.js",
             "lms_pos_fiscal_print/static/src/js/fiscal_print_qz.js",
+            "lms_pos_fiscal_print/static/src/js/fiscal_print_spool.js",
             "lms_pos_fiscal_print/static/src/js/pos_auto_print.js",
 	    "lms_pos_fiscal_print/static/src/js/ncf_indicator.js",
             "lms_pos_fiscal_print/static/src/xml/ncf_indicator.xml",
@@ -1,11 +1,32 @@
-from odoo import http, _
+import base64
+import gzip
+import json
+import logging
+
+from odoo import fields, http
 from odoo.http import request
 
+from ..models.ncf_block import (
+    DEFAULT_NCF_QUOTA_WATERMARK,
+    NCF_QUOTA_WATERMARK_PARAM,
+)
+from ..services import fiscal_metrics, invoice_payload
+
+_logger = logging.getLogger(__name__)
+
+# Reimpresión por lote: tope de facturas y tamaño de cada lectura
+REPRINT_MAX_INVOICES = 500
+REPRINT_CHUNK_SIZE = 100
+
+# Protocolo compacto: por debajo de esto gzip no compensa
+COMPACT_GZIP_MIN_BYTES = 1024
+
 
 class FiscalPrintController(http.Controller):
 
     # =========================================================
-    # ENDPOINT EXISTENTE – NO TOCADO
+    # ENDPOINT EXISTENTE – MISMA FIRMA, IMPLEMENTACIÓN NUEVA
+    # (payload del serializador compartido)
     # =========================================================
 
     @http.route(
@@ -35,68 +56,14 @@ class FiscalPrintController(http.Controller):
             return {"error": "No hay factura POS aún"}
 
         invoice = order.account_move
-        company = invoice.company_id
-        partner = invoice.partner_id
-        currency = invoice.currency_id
-
-        valid_until = ""
-        if invoice.ncf_range_id and invoice.ncf_range_id.date_end:
-            try:
-                valid_until = invoice.ncf_range_id.date_end.strftime("%d/%m/%Y")
-            except Exception:
-                valid_until = ""
-
-        payments = []
-        total_paid = 0.0
-        for payment in order.payment_ids:
-            payments.append({
-                "method": payment.payment_method_id.name,
-                "amount": payment.amount,
-            })
-            total_paid += payment.amount
 
-        change = max(total_paid - invoice.amount_total, 0)
-
-        return {
-            "company": {
-                "name": company.name,
-                "rnc": company.vat,
-                "phone": company.phone,
-                "city": company.city,
-                "address": company.street,
-            },
-            "invoice_id": invoice.id,
-            "invoice_number": invoice.name,
-            "ncf": invoice.ncf_number,
-            "date": invoice.invoice_date.strftime("%d/%m/%Y") if invoice.invoice_date else "",
-            "valid_until": valid_until,
-            "currency": {
-                "symbol": currency.symbol,
-                "position": currency.position,
-            },
-            "cashier": order.user_id.name,
-            "partner": {
-                "name": partner.name or "CONSUMIDOR FINAL",
-                "rnc": partner.vat,
-            },
-            "subtotal": invoice.amount_untaxed,
-            "tax": invoice.amount_tax,
-            "total": invoice.amount_total,
-            "payments": payments,
-            "amount_paid": total_paid,
-            "change": change,
-            "lines": [
-                {
-                    "name": line.name,
-                    "qty": line.quantity,
-                    "price": line.price_unit,
-                }
-                for line in invoice.invoice_line_ids
-            ],
-        }
+        return request.env["lms.fiscal.invoice.payload"]._lms_get_payloads(
+            invoice
+        )[invoice.id]
 
     # =========================================================
-    # ENDPOINT EXISTENTE – NO TOCADO
+    # ENDPOINT EXISTENTE – MISMA FIRMA, IMPLEMENTACIÓN NUEVA
+    # (payload del serializador compartido)
     # =========================================================
 
     @http.route(
@@ -123,69 +90,17 @@ class FiscalPrintController(http.Controller):
             return {"ready": False}
 
         invoice = order.account_move
-        company = invoice.company_id
-        partner = invoice.partner_id
-        currency = invoice.currency_id
 
-        valid_until = ""
-        if invoice.ncf_range_id and invoice.ncf_range_id.date_end:
-            try:
-                valid_until = invoice.ncf_range_id.date_end.strftime("%d/%m/%Y")
-            except Exception:
-                valid_until = ""
-
-        payments = []
-        total_paid = 0.0
-        for payment in order.payment_ids:
-            payments.append({
-                "method": payment.payment_method_id.name,
-                "amount": payment.amount,
-            })
-            total_paid += payment.amount
+        payload = request.env["lms.fiscal.invoice.payload"].sudo()._lms_get_payloads(
+            invoice
+        )[invoice.id]
+        payload["ready"] = True
 
-        change = max(total_paid - invoice.amount_total, 0)
-
-        return {
-            "ready": True,
-            "company": {
-                "name": company.name,
-                "rnc": company.vat,
-                "phone": company.phone,
-                "city": company.city,
-                "address": company.street,
-            },
-            "invoice_id": invoice.id,
-            "invoice_number": invoice.name,
-            "ncf": invoice.ncf_number,
-            "date": invoice.invoice_date.strftime("%d/%m/%Y") if invoice.invoice_date else "",
-            "valid_until": valid_until,
-            "currency": {
-                "symbol": currency.symbol,
-                "position": currency.position,
-            },
-            "cashier": order.user_id.name,
-            "partner": {
-                "name": partner.name or "CONSUMIDOR FINAL",
-                "rnc": partner.vat,
-            },
-            "subtotal": invoice.amount_untaxed,
-            "tax": invoice.amount_tax,
-            "total": invoice.amount_total,
-            "payments": payments,
-            "amount_paid": total_paid,
-            "change": change,
-            "lines": [
-                {
-                    "name": line.name,
-                    "qty": line.quantity,
-                    "price": line.price_unit,
-                }
-                for line in invoice.invoice_line_ids
-            ],
-        }
+        return payload
 
     # =========================================================
-    # ENDPOINT EXISTENTE – NO TOCADO
+    # ENDPOINT EXISTENTE – FIRMA COMPATIBLE, IMPLEMENTACIÓN NUEVA
+    # (reclama un trabajo de la cola de impresión)
     # =========================================================
 
     @http.route(
@@ -194,33 +109,346 @@ class FiscalPrintController(http.Controller):
         auth="user",
         csrf=False
     )
-    def next_fiscal_invoice(self):
+    def next_fiscal_invoice(self, config_id=None):
+        """
+        Compatibilidad: reclama UN trabajo de la cola de impresión
+        de la caja y devuelve su factura.
+        """
 
-        user = request.env.user
+        result = self.claim_fiscal_print_jobs(config_id=config_id, limit=1)
+        if not result["jobs"]:
+            return {"ready": False}
 
-        order = request.env["pos.order"].sudo().search(
+        return result["jobs"][0]
+
+    # =========================================================
+    # 🔁 REIMPRESIÓN POR LOTE
+    # =========================================================
+
+    @http.route(
+        "/lms/pos/reprint_fiscal_batch",
+        type="http",
+        auth="user",
+        methods=["POST"],
+        csrf=False,
+    )
+    def reprint_fiscal_batch(self):
+        """
+        Reimpresión / vista previa de muchas facturas en una respuesta.
+        Cuerpo JSON con UNO de:
+        - `references`: referencias POS
+        - `id_from` / `id_to`: rango de ids de factura
+        - `session_id`: todas las facturas de la sesión
+        y `format`: "ndjson" (un payload por línea) o "escpos" (tickets
+        concatenados, listos para enviarse como un solo trabajo).
+
+        Respuesta en búfer, no en streaming: el cuerpo se arma completo
+        con el cursor de la petición (que se cierra antes de que la capa
+        WSGI itere la respuesta), acotado por REPRINT_MAX_INVOICES y
+        leído en bloques de REPRINT_CHUNK_SIZE.
+        """
+
+        params = request.get_json_data() or {}
+        invoices = self._reprint_invoices(params)
+        fmt = params.get("format") or "ndjson"
+
+        if fmt == "escpos":
+            body = self._reprint_escpos_body(invoices)
+            content_type = "application/octet-stream"
+        else:
+            body = self._reprint_ndjson_body(invoices)
+            content_type = "application/x-ndjson; charset=utf-8"
+
+        return request.make_response(
+            body,
+            headers=[
+                ("Content-Type", content_type),
+                ("X-LMS-Invoice-Count", str(len(invoices))),
+            ],
+        )
+
+    def _reprint_invoices(self, params):
+        """
+        Facturas pedidas, con las reglas de acceso del usuario, por id.
+        Un filtro por referencia o sesión que no encuentra nada devuelve
+        vacío (nunca cae al rango de ids).
+        """
+
+        AccountMove = request.env["account.move"]
+        invoice_ids = []
+
+        if params.get("references"):
+            orders = request.env["pos.order"].search_read(
+                [
+                    ("pos_reference", "in", list(params["references"])),
+                    ("account_move", "!=", False),
+                ],
+                ["account_move"],
+            )
+            invoice_ids = [order["account_move"][0] for order in orders]
+        elif params.get("session_id"):
+            orders = request.env["pos.order"].search_read(
+                [
+                    ("session_id", "=", int(params["session_id"])),
+                    ("account_move", "!=", False),
+                ],
+                ["account_move"],
+            )
+            invoice_ids = [order["account_move"][0] for order in orders]
+
+        domain = [("move_type", "=", "out_invoice"), ("state", "=", "posted")]
+        if params.get("references") or params.get("session_id"):
+            if not invoice_ids:
+                return AccountMove
+            domain.append(("id", "in", invoice_ids))
+        elif params.get("id_from") and params.get("id_to"):
+            domain += [
+                ("id", ">=", int(params["id_from"])),
+                ("id", "<=", int(params["id_to"])),
+                ("ncf_number", "!=", False),
+            ]
+        else:
+            return AccountMove
+
+        return AccountMove.search(
+            domain, order="id", limit=REPRINT_MAX_INVOICES
+        )
+
+    def _reprint_ndjson_body(self, invoices):
+        Payload = request.env["lms.fiscal.invoice.payload"].sudo()
+        chunks = []
+        for start in range(0, len(invoices), REPRINT_CHUNK_SIZE):
+            batch = invoices[start:start + REPRINT_CHUNK_SIZE].sudo()
+            payloads = Payload._lms_get_payloads(batch)
+            chunks.append("".join(
+                json.dumps(payloads[invoice_id], ensure_ascii=False, separators=(",", ":")) + "\n"
+                for invoice_id in batch.ids
+                if invoice_id in payloads
+            ).encode("utf-8"))
+        return b"".join(chunks)
+
+    def _reprint_escpos_body(self, invoices):
+        AccountMove = request.env["account.move"].sudo()
+        Printer = request.env["lms.fiscal.printer"].sudo()
+        chunks = []
+        for start in range(0, len(invoices), REPRINT_CHUNK_SIZE):
+            batch = invoices[start:start + REPRINT_CHUNK_SIZE].sudo()
+            receipts = AccountMove._lms_read_receipts(batch.ids)
+
+            # Facturas sin ticket pre-renderizado → se renderizan ahora
+            missing = batch.filtered(lambda i: i.id not in receipts)
+            rendered = Printer._lms_render_invoices(missing) if missing else {}
+
+            for invoice_id in batch.ids:
+                if invoice_id in receipts:
+                    chunks.append(base64.b64decode(receipts[invoice_id]))
+                elif invoice_id in rendered:
+                    chunks.append(rendered[invoice_id])
+        return b"".join(chunks)
+
+    # =========================================================
+    # 🆕 COLA DE IMPRESIÓN (lms.fiscal.print.job)
+    # =========================================================
+
+    def _current_config_id(self):
+        session = request.env["pos.session"].sudo().search(
             [
-                ("user_id", "=", user.id),
-                ("state", "=", "paid"),
-                ("account_move", "!=", False),
+                ("user_id", "=", request.env.user.id),
+                ("state", "=", "opened"),
             ],
             order="id desc",
             limit=1,
         )
+        return session.config_id.id
 
-        if not order:
-            return {"ready": False}
+    def _resolve_config_id(self, config_id=None):
+        """
+        Caja de la sesión abierta del usuario. Un `config_id` de otra
+        caja (u otra compañía) se rechaza: los trabajos se reclaman
+        con sudo y traen la factura completa.
+        """
 
-        invoice = order.account_move
+        current = self._current_config_id()
+        if config_id and int(config_id) != current:
+            _logger.warning(
+                "[POS FISCAL PRINT] Usuario %s pidió trabajos de la caja %s (su caja: %s)",
+                request.env.user.id,
+                config_id,
+                current,
+            )
+            return False
+        return current
+
+    @http.route(
+        "/lms/pos/claim_fiscal_print_jobs",
+        type="json",
+        auth="user",
+        csrf=False
+    )
+    def claim_fiscal_print_jobs(self, config_id=None, limit=10):
+        """
+        Reclama en bloque los trabajos pendientes de la caja,
+        en orden de llegada, con la factura lista para imprimir.
+        """
+
+        config_id = self._resolve_config_id(config_id)
+        if not config_id:
+            return {"jobs": [], "claim_token": False}
+
+        jobs, token, invoice_payloads, receipts = self._claim_print_jobs(config_id, limit)
+
+        payloads = []
+        for job in jobs:
+            payload = invoice_payloads[job.invoice_id.id]
+            payload.update({
+                "ready": True,
+                "job_id": job.id,
+                "trace_id": job.trace_id or False,
+                "claim_token": token,
+                "escpos": receipts.get(job.invoice_id.id, False),
+            })
+            payloads.append(payload)
+
+        return {"jobs": payloads, "claim_token": token}
+
+    def _claim_print_jobs(self, config_id, limit):
+        jobs, token = request.env["lms.fiscal.print.job"].sudo()._lms_claim(
+            config_id, limit=min(int(limit or 1), 50)
+        )
+
+        invoice_payloads = request.env["lms.fiscal.invoice.payload"].sudo()._lms_get_payloads(
+            jobs.invoice_id
+        )
+
+        receipts = request.env["account.move"].sudo()._lms_read_receipts(
+            jobs.invoice_id.ids
+        )
+
+        return jobs, token, invoice_payloads, receipts
+
+    # =========================================================
+    # 🆕 PROTOCOLO COMPACTO v2 (enlaces móviles lentos)
+    # =========================================================
+
+    @http.route(
+        "/lms/pos/v2/fiscal_static",
+        type="json",
+        auth="user",
+        csrf=False
+    )
+    def fiscal_static(self, config_id=None):
+        """
+        Datos que no cambian entre recibos (compañía, moneda, vigencia
+        de rangos NCF). El POS los pide una vez por sesión y vuelve a
+        pedirlos si un trabajo referencia un id que no conoce.
+        """
+
+        config = request.env["pos.config"].browse(
+            self._resolve_config_id(config_id) or []
+        ).exists()
+        company = config.company_id or request.env.company
+
+        return request.env["lms.fiscal.invoice.payload"]._lms_static_data(company)
 
+    @http.route(
+        "/lms/pos/v2/claim_fiscal_print_jobs",
+        type="http",
+        auth="user",
+        methods=["POST"],
+        csrf=False,
+    )
+    def claim_fiscal_print_jobs_compact(self):
+        """
+        Igual que /lms/pos/claim_fiscal_print_jobs pero en forma
+        compacta: compañía/moneda/rango por id, líneas en columnas con
+        tabla de nombres compartida, y gzip si el cliente lo acepta.
+        Cuerpo JSON: `config_id`, `limit`.
+        """
+
+        params = request.get_json_data() or {}
+        config_id = self._resolve_config_id(params.get("config_id"))
+
+        names = {}
+        jobs_data = []
+        token = False
+        if config_id:
+            jobs, token, invoice_payloads, receipts = self._claim_print_jobs(
+                config_id, params.get("limit") or 10
+            )
+            for job in jobs:
+                data = invoice_payload.compact_payload(invoice_payloads[job.invoice_id.id], names)
+                data.update({
+                    "job_id": job.id,
+                    "trace_id": job.trace_id or False,
+                    "escpos": receipts.get(job.invoice_id.id, False),
+                })
+                jobs_data.append(data)
+
+        body = json.dumps(
+            {
+                "v": invoice_payload.PROTOCOL_VERSION,
+                "claim_token": token,
+                "names": sorted(names, key=names.get),
+                "jobs": jobs_data,
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+        headers = [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Vary", "Accept-Encoding"),
+        ]
         if (
-            not invoice
-            or not invoice.lms_fiscal_pending_print
-            or invoice.lms_fiscal_printed
+            len(body) >= COMPACT_GZIP_MIN_BYTES
+            and "gzip" in request.httprequest.headers.get("Accept-Encoding", "")
         ):
-            return {"ready": False}
+            body = gzip.compress(body, compresslevel=6)
+            headers.append(("Content-Encoding", "gzip"))
+
+        return request.make_response(body, headers=headers)
+
+    @http.route(
+        "/lms/pos/fiscal_receipt_escpos/<int:invoice_id>",
+        type="http",
+        auth="user",
+        methods=["GET"],
+    )
+    def fiscal_receipt_escpos(self, invoice_id):
+        """Ticket pre-renderizado en crudo (application/octet-stream)."""
+
+        # Reglas de acceso del usuario (compañías permitidas) antes del sudo
+        invoice = request.env["account.move"].browse(invoice_id).exists()
+        if not invoice:
+            return request.not_found()
+        invoice.check_access("read")
+
+        data = invoice.sudo()._lms_read_receipts([invoice.id])
+        if invoice_id not in data:
+            return request.not_found()
+
+        return request.make_response(
+            base64.b64decode(data[invoice_id]),
+            headers=[("Content-Type", "application/octet-stream")],
+        )
+
+    @http.route(
+        "/lms/pos/fail_fiscal_print_jobs",
+        type="json",
+        auth="user",
+        csrf=False
+    )
+    def fail_fiscal_print_jobs(self, job_ids, claim_token=None, error=None):
+
+        # Solo trabajos de ESTE reclamo: (id, claim_token)
+        if not claim_token:
+            return {"ok": False}
+
+        jobs = request.env["lms.fiscal.print.job"].sudo().browse(job_ids or []).exists()
+        jobs = jobs.filtered(lambda j: j.state == "claimed" and j.claim_token == claim_token)
+        jobs._lms_fail(error)
 
-        return self.fiscal_invoice_by_reference(order.pos_reference)
+        return {"ok": True, "job_ids": jobs.ids}
 
     # =========================================================
     # 🆕 DISPARO INMEDIATO (ANTI-CRON)
@@ -232,7 +460,12 @@ class FiscalPrintController(http.Controller):
         auth="user",
         csrf=False
     )
-    def trigger_fiscal_invoice(self, pos_reference):
+    def trigger_fiscal_invoice(self, pos_reference, trace_id=None):
+        """
+        Encola la orden y vuelve de inmediato; la factura la crea el
+        worker de la cola (`lms.pos.invoice.queue`). `trace_id` lo
+        genera el POS al validar y acompaña a la venta hasta imprimir.
+        """
 
         if not pos_reference:
             return {"ok": False}
@@ -242,6 +475,7 @@ class FiscalPrintController(http.Controller):
                 ("pos_reference", "=", pos_reference),
                 ("state", "=", "paid"),
                 ("account_move", "=", False),
+                ("amount_total", ">", 0),
             ],
             limit=1,
         )
@@ -249,12 +483,15 @@ class FiscalPrintController(http.Controller):
         if not order:
             return {"ok": False}
 
-        order._lms_create_fiscal_invoice_from_pos()
+        request.env["lms.pos.invoice.queue"].sudo()._lms_enqueue(
+            order, {order.id: trace_id} if trace_id else None
+        )
 
-        return {"ok": True}
+        return {"ok": True, "queued": True}
 
     # =========================================================
-    # ENDPOINT EXISTENTE – NO TOCADO
+    # ENDPOINT EXISTENTE – FIRMA COMPATIBLE, IMPLEMENTACIÓN NUEVA
+    # (confirma trabajos de la cola por claim_token)
     # =========================================================
 
     @http.route(
@@ -263,21 +500,150 @@ class FiscalPrintController(http.Controller):
         auth="user",
         csrf=False
     )
-    def mark_fiscal_printed(self, invoice_id):
+    def mark_fiscal_printed(self, invoice_id=None, job_ids=None, claim_token=None, print_ms=None):
+        """
+        Confirma impresión. Acepta trabajos de la cola (`job_ids`)
+        o, por compatibilidad, una factura (`invoice_id`).
+        `print_ms`: lo que tardó el envío a la impresora en el POS.
+        """
 
-        if not invoice_id:
+        with fiscal_metrics.measure(request.env, "mark_printed"):
+            return self._mark_fiscal_printed(invoice_id, job_ids, claim_token, print_ms)
+
+    def _mark_fiscal_printed(self, invoice_id, job_ids, claim_token, print_ms):
+
+        Job = request.env["lms.fiscal.print.job"].sudo()
+        dbname = request.env.cr.dbname
+
+        if print_ms:
+            fiscal_metrics.record(dbname, "print_dispatch", float(print_ms) / 1000.0)
+
+        if job_ids:
+            jobs = Job.browse(job_ids).exists()
+        elif invoice_id:
+            invoice = request.env["account.move"].browse(invoice_id).exists()
+            if not invoice:
+                return {"ok": False}
+            invoice.check_access("read")
+            jobs = Job.search([("invoice_id", "=", invoice.id)])
+            if not jobs:
+                invoice.sudo().write({
+                    "lms_fiscal_printed": True,
+                    "lms_fiscal_pending_print": False,
+                })
+                return {"ok": True}
+        else:
             return {"ok": False}
 
-        invoice = request.env["account.move"].sudo().browse(invoice_id)
-        if not invoice.exists():
+        # Solo trabajos de ESTE reclamo: (id, claim_token)
+        if not jobs or not claim_token:
             return {"ok": False}
 
-        invoice.write({
-            "lms_fiscal_printed": True,
-            "lms_fiscal_pending_print": False,
-        })
+        acked = jobs._lms_ack(claim_token)
+
+        # ⏱️ De la venta a la impresión, con la traza del POS
+        now = fields.Datetime.now()
+        for job in acked.filtered("pos_order_id"):
+            elapsed = (now - job.pos_order_id.date_order).total_seconds()
+            fiscal_metrics.record(dbname, "end_to_end", elapsed)
+            if job.trace_id:
+                _logger.info(
+                    "[POS FISCAL TRACE] %s orden %s impresa en %.1fs",
+                    job.trace_id,
+                    job.pos_order_id.name,
+                    elapsed,
+                )
 
-        return {"ok": True}
+        return {"ok": True, "job_ids": acked.ids}
+
+    @http.route(
+        "/lms/pos/ack_fiscal_print_jobs",
+        type="json",
+        auth="user",
+        csrf=False
+    )
+    def ack_fiscal_print_jobs(self, acks):
+        """
+        Confirmación en bloque desde el spool del POS: `acks` es una
+        lista de {job_id, claim_token, print_ms} ya impresos, quizá
+        acumulados durante un corte de red.
+
+        Devuelve los confirmados (`job_ids`), los que ya no hay nada
+        que confirmar (`closed_ids`: borrados, impresos o fallidos) y
+        las entradas mal formadas (`rejected`, sin `job_id` válido):
+        el spool solo descarta esos. Uno reclamado de nuevo con otro
+        token queda en el spool hasta que su token se actualice.
+        """
+
+        by_token = {}
+        rejected = []
+        for ack in acks or []:
+            try:
+                job_id = int(ack["job_id"])
+            except (KeyError, TypeError, ValueError):
+                # Una entrada rota no bloquea el bloque entero
+                rejected.append(ack.get("job_id") if isinstance(ack, dict) else ack)
+                continue
+            try:
+                print_ms = float(ack.get("print_ms") or 0)
+            except (TypeError, ValueError):
+                print_ms = 0.0
+            by_token.setdefault(ack.get("claim_token") or None, []).append(
+                (job_id, print_ms)
+            )
+
+        if rejected:
+            _logger.warning(
+                "[POS FISCAL PRINT] Confirmaciones mal formadas descartadas: %s", rejected
+            )
+
+        acked_ids = []
+        requested = set()
+        with fiscal_metrics.measure(request.env, "mark_printed", items=len(acks or [])):
+            dbname = request.env.cr.dbname
+            for token, token_acks in by_token.items():
+                for job_id, print_ms in token_acks:
+                    requested.add(job_id)
+                    if print_ms:
+                        fiscal_metrics.record(dbname, "print_dispatch", print_ms / 1000.0)
+                res = self._mark_fiscal_printed(
+                    None, [job_id for job_id, _ms in token_acks], token, None
+                )
+                acked_ids.extend(res.get("job_ids", []))
+
+        # Sin reclamo vivo → el spool ya no tiene nada que confirmar
+        rest = requested - set(acked_ids)
+        open_jobs = request.env["lms.fiscal.print.job"].sudo().browse(
+            list(rest)
+        ).exists().filtered(lambda j: j.state in ("pending", "claimed"))
+
+        return {
+            "ok": True,
+            "job_ids": acked_ids,
+            "closed_ids": sorted(rest - set(open_jobs.ids)),
+            "rejected": rejected,
+        }
+
+    # =========================================================
+    # 📈 MÉTRICAS (texto Prometheus)
+    # =========================================================
+
+    @http.route(
+        "/lms/pos/metrics",
+        type="http",
+        auth="user",
+        methods=["GET"],
+    )
+    def metrics(self):
+        """Métricas por etapa del proceso que atiende la petición."""
+
+        if not request.env.user.has_group("point_of_sale.group_pos_manager"):
+            return request.not_found()
+
+        return request.make_response(
+            fiscal_metrics.render_prometheus(request.env.cr.dbname),
+            headers=[("Content-Type", "text/plain; version=0.0.4; charset=utf-8")],
+        )
 
     # =========================================================
     # 🆕 VALIDACIÓN NCF + ALERTA POR UMBRAL (SIN ROMPER POS)
@@ -304,36 +670,67 @@ class FiscalPrintController(http.Controller):
         # Cliente con RNC → B01 | Consumidor final → B02
         ncf_type = "01" if (partner and partner.vat) else "02"
 
-        ncf_range = request.env["l10n_do.ncf.range"].sudo().search([
-            ("company_id", "=", company.id),
-            ("ncf_type", "=", ncf_type),
-            ("active", "=", True),
-        ], limit=1)
+        status = request.env["lms.ncf.availability"]._lms_get_status(company)[ncf_type]
 
         # 🔴 SIN NCF → BLOQUEO POS
-        if not ncf_range or ncf_range.available_numbers <= 0:
-            return {
-                "ok": False,
-                "message": _(
-                    "No hay NCF disponible para este tipo de cliente.\n"
-                    f"(Tipo requerido: B{ncf_type})\n"
-                    "Contacte al administrador."
-                )
-            }
-
         # ⚠️ ALERTA PREVENTIVA (NO BLOQUEA)
-        if ncf_range.is_low_ncf:
-            return {
-                "ok": True,
-                "warning": True,
-                "available": ncf_range.available_numbers,
-                "threshold": company.ncf_low_threshold,
-                "message": _(
-                    f"Quedan {ncf_range.available_numbers} NCF disponibles "
-                    f"para este tipo de cliente (B{ncf_type}). "
-                    "Contacte al administrador."
-                )
-            }
+        if not status["ok"] or status.get("warning"):
+            return status
 
         # 🟢 TODO OK
         return {"ok": True}
+
+    @http.route(
+        "/lms/pos/ncf_availability",
+        type="json",
+        auth="user",
+        csrf=False
+    )
+    def ncf_availability(self):
+        """
+        Estado de TODOS los tipos de NCF de la compañía en una llamada.
+        El POS lo carga al abrir y luego lo recibe por bus.
+        """
+
+        return request.env["lms.ncf.availability"]._lms_get_status(request.env.company)
+
+    @http.route(
+        "/lms/pos/ncf_quota",
+        type="json",
+        auth="user",
+        csrf=False
+    )
+    def ncf_quota(self, session_id=None):
+        """
+        Cupo de NCF pre-asignado a la sesión, por tipo. El POS valida
+        contra este cupo local y lo refresca en segundo plano cuando
+        baja de `watermark`. Solo la sesión abierta del propio cajero:
+        reservar bloques para otra sesión agotaría su secuencia.
+        """
+
+        session = request.env["pos.session"].sudo().search(
+            [
+                ("user_id", "=", request.env.user.id),
+                ("state", "=", "opened"),
+            ],
+            order="id desc",
+            limit=1,
+        )
+        if not session or (session_id and int(session_id) != session.id):
+            return {"quota": False}
+
+        watermark = int(
+            request.env["ir.config_parameter"].sudo().get_param(
+                NCF_QUOTA_WATERMARK_PARAM, DEFAULT_NCF_QUOTA_WATERMARK
+            )
+        )
+
+        Block = request.env["lms.ncf.block"].sudo()
+
+        return {
+            "watermark": watermark,
+            "quota": {
+                ncf_type: Block._lms_session_quota(session, ncf_type, minimum=watermark * 2)
+                for ncf_type in ("01", "02")
+            },
+        }
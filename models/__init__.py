@@ -1,6 +1,12 @@
+from . import res_company
 from . import pos_order
 from . import account_move
 from . import pos_reconcile_cron
 from . import pos_session
+from . import ncf_block
+from . import fiscal_print_job
+from . import payment_ncf
+from . import pos_invoice_queue
+from . import pos_payment_method
 
 
@@ -1,4 +1,12 @@
-from odoo import models, fields
+import base64
+import logging
+
+from odoo import models, fields, api
+from odoo.tools.sql import column_exists, create_index
+
+from ..services import invoice_payload
+
+_logger = logging.getLogger(__name__)
 
 
 class AccountMove(models.Model):
@@ -10,6 +18,115 @@ class AccountMove(models.Model):
     lms_fiscal_pending_print = fields.Boolean(default=False)
     lms_fiscal_printed = fields.Boolean(default=False)
 
+    # Ticket ESC/POS pre-renderizado al publicar (base64, columna propia)
+    lms_receipt_escpos = fields.Binary(attachment=False, copy=False)
+
+    def init(self):
+        super().init()
+        cr = self.env.cr
+
+        # Facturas por imprimir (cola de impresión / reimpresión)
+        create_index(
+            cr,
+            "lms_account_move_pending_print_idx",
+            self._table,
+            ["company_id", "id"],
+            where="lms_fiscal_pending_print",
+        )
+
+        # CRON de conciliación: facturas POS con NCF aún por cobrar.
+        # `ncf_number` lo aporta el módulo de NCF, puede no existir aún.
+        if column_exists(cr, self._table, "ncf_number"):
+            create_index(
+                cr,
+                "lms_account_move_ncf_open_idx",
+                self._table,
+                ["company_id", "invoice_date", "id"],
+                where=(
+                    "move_type = 'out_invoice' AND state = 'posted' "
+                    "AND payment_state IN ('not_paid', 'partial') "
+                    "AND ncf_number IS NOT NULL AND invoice_origin IS NOT NULL"
+                ),
+            )
+            # Exportador DGII 607: paginación por (invoice_date, id)
+            create_index(
+                cr,
+                "lms_account_move_ncf_posted_idx",
+                self._table,
+                ["company_id", "invoice_date", "id"],
+                where=(
+                    "move_type IN ('out_invoice', 'out_refund') "
+                    "AND state = 'posted' AND ncf_number IS NOT NULL"
+                ),
+            )
+
+    def write(self, vals):
+        # 🔄 Payload de impresión cacheado → se descarta al modificar
+        invoice_payload.invalidate(self.env.cr.dbname, self.ids)
+        return super().write(vals)
+
+    # =========================================
+    # PRE-RENDER DEL TICKET
+    # =========================================
+    def _lms_store_receipts(self):
+        """
+        Renderiza el ticket ESC/POS de todo el lote y lo guarda
+        con un UPDATE por bloque, sin pasar por `write` (no altera
+        `write_date` ni invalida el payload recién cacheado).
+        Si el render falla, la impresión sigue por el payload JSON.
+        """
+
+        if not self:
+            return True
+
+        try:
+            receipts = self.env["lms.fiscal.printer"]._lms_render_invoices(self)
+        except Exception:
+            _logger.exception(
+                "[POS FISCAL PRINT] No se pudo pre-renderizar tickets %s", self.ids
+            )
+            return False
+
+        rows = [
+            (invoice_id, base64.b64encode(data))
+            for invoice_id, data in receipts.items()
+        ]
+
+        for start in range(0, len(rows), 500):
+            chunk = rows[start:start + 500]
+            self.env.cr.execute(
+                """
+                UPDATE account_move m
+                   SET lms_receipt_escpos = v.data
+                  FROM (VALUES %s) AS v(id, data)
+                 WHERE m.id = v.id
+                """ % ", ".join(["(%s, %s::bytea)"] * len(chunk)),
+                [value for row in chunk for value in row],
+            )
+
+        self.invalidate_recordset(["lms_receipt_escpos"])
+
+        return True
+
+    @api.model
+    def _lms_read_receipts(self, invoice_ids):
+        """Camino de impresión: una sola lectura → {invoice_id: base64}."""
+
+        if not invoice_ids:
+            return {}
+
+        self.env.cr.execute(
+            """
+            SELECT id, lms_receipt_escpos FROM account_move
+             WHERE id IN %s AND lms_receipt_escpos IS NOT NULL
+            """,
+            (tuple(invoice_ids),),
+        )
+        return {
+            invoice_id: bytes(data).decode("ascii")
+            for invoice_id, data in self.env.cr.fetchall()
+        }
+
     # =========================================
     # BLOQUEO SECUNDARIO (MANUAL)
     # =========================================
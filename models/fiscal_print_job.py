@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import logging
+import uuid
+from datetime import timedelta
+
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+
+_logger = logging.getLogger(__name__)
+
+# Un trabajo reclamado que no se confirma en este tiempo vuelve a la cola
+CLAIM_TIMEOUT = timedelta(minutes=2)
+MAX_ATTEMPTS = 10
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 300
+
+
+class FiscalPrintJob(models.Model):
+    """
+    Cola persistente de impresión fiscal.
+
+    Un trabajo por factura (clave de idempotencia), ordenado por id
+    dentro de cada caja (`config_id`). La caja reclama en bloque con
+    FOR UPDATE SKIP LOCKED, imprime en orden y confirma o reporta fallo.
+    """
+
+    _name = "lms.fiscal.print.job"
+    _description = "Trabajo de impresión fiscal POS"
+    _order = "id"
+
+    invoice_id = fields.Many2one(
+        "account.move", required=True, index=True, ondelete="cascade"
+    )
+    pos_order_id = fields.Many2one("pos.order", ondelete="set null")
+    session_id = fields.Many2one("pos.session", index=True, ondelete="set null")
+    config_id = fields.Many2one("pos.config", required=True, ondelete="cascade")
+    company_id = fields.Many2one("res.company", required=True)
+    idempotency_key = fields.Char(required=True)
+    state = fields.Selection(
+        [
+            ("pending", "Pendiente"),
+            ("claimed", "Reclamado"),
+            ("done", "Impreso"),
+            ("failed", "Fallido"),
+        ],
+        default="pending",
+        required=True,
+    )
+    attempts = fields.Integer(default=0)
+    next_attempt_at = fields.Datetime(default=fields.Datetime.now, required=True)
+    claimed_at = fields.Datetime()
+    claim_token = fields.Char()
+    printed_at = fields.Datetime()
+    last_error = fields.Char()
+    trace_id = fields.Char()
+
+    _sql_constraints = [
+        (
+            "idempotency_key_uniq",
+            "unique(idempotency_key)",
+            "Ya existe un trabajo de impresión con esta clave.",
+        ),
+    ]
+
+    def init(self):
+        # Cola viva por caja, en orden de llegada
+        create_index(
+            self.env.cr,
+            "lms_fiscal_print_job_queue_idx",
+            self._table,
+            ["config_id", "next_attempt_at", "id"],
+            where="state IN ('pending', 'claimed')",
+        )
+
+    # =========================================================
+    # ENCOLAR
+    # =========================================================
+    @api.model
+    def _lms_idempotency_key(self, invoice):
+        return "invoice:%s" % invoice.id
+
+    @api.model
+    def _lms_enqueue_orders(self, orders):
+        """Crea (una sola vez) el trabajo de impresión de cada orden facturada."""
+
+        orders = orders.filtered(lambda o: o.account_move)
+        if not orders:
+            return self.browse()
+
+        keys = {
+            order.id: self._lms_idempotency_key(order.account_move)
+            for order in orders
+        }
+        existing = set(
+            self.search([("idempotency_key", "in", list(keys.values()))])
+            .mapped("idempotency_key")
+        )
+
+        # Traza de la venta (si llegó por la cola de facturación)
+        trace_ids = {
+            row["order_id"][0]: row["trace_id"]
+            for row in self.env["lms.pos.invoice.queue"].sudo().search_read(
+                [("order_id", "in", orders.ids), ("trace_id", "!=", False)],
+                ["order_id", "trace_id"],
+            )
+        }
+
+        return self.create([
+            {
+                "trace_id": trace_ids.get(order.id),
+                "invoice_id": order.account_move.id,
+                "pos_order_id": order.id,
+                "session_id": order.session_id.id,
+                "config_id": order.config_id.id,
+                "company_id": order.company_id.id,
+                "idempotency_key": keys[order.id],
+            }
+            for order in orders
+            if keys[order.id] not in existing
+        ])
+
+    # =========================================================
+    # RECLAMAR / CONFIRMAR / FALLAR
+    # =========================================================
+    @api.model
+    def _lms_claim(self, config_id, limit=10):
+        """
+        Reclama hasta `limit` trabajos vencidos de la caja, en orden.
+        Devuelve (trabajos, token). Dos pestañas de la misma caja
+        nunca reciben el mismo trabajo.
+        """
+
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        token = uuid.uuid4().hex
+
+        self.flush_model()
+
+        # Reclamos abandonados (pestaña cerrada, red caída) vuelven a la cola
+        cr.execute(
+            """
+            UPDATE lms_fiscal_print_job
+               SET state = 'pending', claim_token = NULL
+             WHERE config_id = %s AND state = 'claimed' AND claimed_at < %s
+            """,
+            (config_id, now - CLAIM_TIMEOUT),
+        )
+
+        cr.execute(
+            """
+            UPDATE lms_fiscal_print_job
+               SET state = 'claimed', claimed_at = %s, claim_token = %s
+             WHERE id IN (
+                    SELECT id FROM lms_fiscal_print_job
+                     WHERE config_id = %s
+                       AND state = 'pending'
+                       AND next_attempt_at <= %s
+                  ORDER BY id
+                     LIMIT %s
+                       FOR UPDATE SKIP LOCKED
+                   )
+         RETURNING id
+            """,
+            (now, token, config_id, now, limit),
+        )
+        ids = sorted(row[0] for row in cr.fetchall())
+
+        self.invalidate_model(["state", "claimed_at", "claim_token"])
+
+        return self.browse(ids), token
+
+    def _lms_ack(self, claim_token):
+        """
+        Marca impresos los trabajos reclamados con `claim_token` y
+        sincroniza los flags de la factura. Un trabajo que otra caja
+        (re)clamó, o sin reclamo vigente, no se toca.
+        """
+
+        jobs = self.filtered(
+            lambda j: j.state == "claimed" and claim_token and j.claim_token == claim_token
+        )
+        if not jobs:
+            return jobs
+
+        jobs.write({
+            "state": "done",
+            "printed_at": fields.Datetime.now(),
+            "claim_token": False,
+        })
+        jobs.invoice_id.write({
+            "lms_fiscal_printed": True,
+            "lms_fiscal_pending_print": False,
+        })
+
+        return jobs
+
+    def _lms_fail(self, error=None):
+        """Reintento con backoff exponencial; tras MAX_ATTEMPTS queda fallido."""
+
+        now = fields.Datetime.now()
+
+        for job in self.filtered(lambda j: j.state in ("pending", "claimed")):
+            attempts = job.attempts + 1
+            delay = min(BACKOFF_BASE_SECONDS * 2 ** attempts, BACKOFF_MAX_SECONDS)
+
+            job.write({
+                "attempts": attempts,
+                "state": "failed" if attempts >= MAX_ATTEMPTS else "pending",
+                "next_attempt_at": now + timedelta(seconds=delay),
+                "claim_token": False,
+                "last_error": (error or "")[:255],
+            })
+
+            if attempts >= MAX_ATTEMPTS:
+                _logger.warning(
+                    "[POS FISCAL PRINT] Trabajo %s (factura %s) fallido tras %s intentos: %s",
+                    job.id,
+                    job.invoice_id.name,
+                    attempts,
+                    error,
+                )
+
+        return True
+
+    def action_retry(self):
+        """Reencola manualmente trabajos fallidos."""
+        self.filtered(lambda j: j.state == "failed").write({
+            "state": "pending",
+            "attempts": 0,
+            "next_attempt_at": fields.Datetime.now(),
+        })
+        return True
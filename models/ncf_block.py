@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# Tamaño del bloque de NCF que se reserva por sesión (ir.config_parameter)
+NCF_BLOCK_SIZE_PARAM = "lms_pos_fiscal_print.ncf_block_size"
+DEFAULT_NCF_BLOCK_SIZE = 50
+
+# Secuencia del rango en el módulo NCF (`l10n_do_ncf`): siguiente
+# número libre y último número autorizado por la DGII
+RANGE_COUNTER_FIELD = "next_number"
+RANGE_END_FIELD = "end_number"
+
+# Cupo mínimo que la caja intenta tener siempre a mano
+NCF_QUOTA_WATERMARK_PARAM = "lms_pos_fiscal_print.ncf_quota_watermark"
+DEFAULT_NCF_QUOTA_WATERMARK = 10
+
+
+class NcfBlock(models.Model):
+    """
+    Bloque de NCF reservado para una sesión POS.
+
+    El rango `l10n_do.ncf.range` solo se bloquea (FOR UPDATE) al reservar
+    un bloque; la asignación posterior sale de la fila del bloque, que es
+    exclusiva de la sesión, por lo que las cajas ya no compiten por la
+    misma fila del rango.
+    """
+
+    _name = "lms.ncf.block"
+    _description = "Bloque de NCF reservado por sesión POS"
+    _order = "id"
+
+    company_id = fields.Many2one("res.company", required=True, index=True)
+    range_id = fields.Many2one(
+        "l10n_do.ncf.range", required=True, index=True, ondelete="restrict"
+    )
+    session_id = fields.Many2one("pos.session", index=True, ondelete="set null")
+    ncf_type = fields.Char(size=2, required=True)
+    prefix = fields.Char(required=True)
+    number_start = fields.Integer(required=True)
+    number_end = fields.Integer(required=True)
+    number_next = fields.Integer(required=True)
+    state = fields.Selection(
+        [
+            ("open", "Abierto"),
+            ("exhausted", "Agotado"),
+            ("released", "Liberado"),
+        ],
+        default="open",
+        required=True,
+        index=True,
+    )
+    remaining = fields.Integer(compute="_compute_remaining")
+
+    @api.depends("number_next", "number_end", "state")
+    def _compute_remaining(self):
+        for block in self:
+            if block.state == "open":
+                block.remaining = max(block.number_end - block.number_next + 1, 0)
+            else:
+                block.remaining = 0
+
+    def init(self):
+        super().init()
+        # Sin la secuencia del rango no hay reserva posible: mejor
+        # fallar al instalar que degradar en silencio en producción
+        self._lms_check_range_layout()
+
+    # =========================================================
+    # RANGO NCF
+    # =========================================================
+    @api.model
+    def _lms_check_range_layout(self):
+        fields_map = self.env["l10n_do.ncf.range"]._fields
+        missing = [
+            name for name in (RANGE_COUNTER_FIELD, RANGE_END_FIELD, "date_end")
+            if name not in fields_map
+        ]
+        if missing:
+            raise UserError(
+                _(
+                    "El modelo l10n_do.ncf.range no expone los campos %s; "
+                    "no se pueden reservar bloques de NCF."
+                ) % ", ".join(missing)
+            )
+        return True
+
+    @api.model
+    def _lms_valid_range_domain(self, company, ncf_type):
+        """Rangos activos y vigentes (date_end no vencida) del tipo."""
+
+        today = fields.Date.context_today(self)
+        return [
+            ("company_id", "=", company.id),
+            ("ncf_type", "=", ncf_type),
+            ("active", "=", True),
+            "|", ("date_end", "=", False), ("date_end", ">=", today),
+        ]
+
+    @api.model
+    def _lms_range_valid(self, ncf_range):
+        if not ncf_range.active:
+            return False
+        return not ncf_range.date_end or ncf_range.date_end >= fields.Date.context_today(self)
+
+    @api.model
+    def _lms_format_ncf(self, prefix, number):
+        return "%s%08d" % (prefix, number)
+
+    # =========================================================
+    # RESERVA
+    # =========================================================
+    @api.model
+    def _lms_reserve_block(self, session, company, ncf_type):
+        """
+        Reserva un bloque nuevo para la sesión:
+        1) reutiliza un hueco liberado del mismo tipo (SKIP LOCKED)
+        2) si no hay, avanza el contador del rango en una sola transacción
+        """
+
+        Gap = self.env["lms.ncf.gap"]
+
+        gap = Gap._lms_claim(company, ncf_type)
+        if gap:
+            block = self.create({
+                "company_id": company.id,
+                "range_id": gap.range_id.id,
+                "session_id": session.id,
+                "ncf_type": ncf_type,
+                "prefix": gap.prefix,
+                "number_start": gap.number_start,
+                "number_end": gap.number_end,
+                "number_next": gap.number_start,
+            })
+            gap.write({"state": "reused", "reused_block_id": block.id})
+            return block
+
+        ncf_range = self.env["l10n_do.ncf.range"].sudo().search(
+            self._lms_valid_range_domain(company, ncf_type) + [("available_numbers", ">", 0)],
+            order="id",
+            limit=1,
+        )
+
+        if not ncf_range:
+            return self.browse()
+
+        self._lms_check_range_layout()
+        prefix = "B%s" % ncf_type
+
+        # 🔒 Único punto de contención: una vez por bloque, no por factura
+        self.env.cr.execute(
+            "SELECT id FROM l10n_do_ncf_range WHERE id = %s FOR UPDATE",
+            (ncf_range.id,),
+        )
+        ncf_range.invalidate_recordset([RANGE_COUNTER_FIELD, RANGE_END_FIELD])
+
+        size = int(
+            self.env["ir.config_parameter"].sudo().get_param(
+                NCF_BLOCK_SIZE_PARAM, DEFAULT_NCF_BLOCK_SIZE
+            )
+        )
+
+        start = ncf_range[RANGE_COUNTER_FIELD]
+        end = min(start + max(size, 1) - 1, ncf_range[RANGE_END_FIELD])
+        if end < start:
+            return self.browse()
+
+        ncf_range.write({RANGE_COUNTER_FIELD: end + 1})
+
+        _logger.info(
+            "[POS NCF BLOCK] Sesión %s reserva %s..%s (%s números) del rango %s",
+            session.name,
+            self._lms_format_ncf(prefix, start),
+            self._lms_format_ncf(prefix, end),
+            end - start + 1,
+            ncf_range.id,
+        )
+
+        return self.create({
+            "company_id": company.id,
+            "range_id": ncf_range.id,
+            "session_id": session.id,
+            "ncf_type": ncf_type,
+            "prefix": prefix,
+            "number_start": start,
+            "number_end": end,
+            "number_next": start,
+        })
+
+    @api.model
+    def _lms_take_numbers(self, session, company, ncf_type, count):
+        """
+        Entrega hasta `count` NCF del bloque de la sesión como
+        lista de (range_id, ncf). Si no quedan rangos vigentes la
+        lista puede quedar corta y el llamador usa el flujo estándar.
+        Los bloques de un rango ya inactivo o vencido se anulan.
+        """
+
+        taken = []
+        cr = self.env.cr
+
+        while len(taken) < count:
+
+            block = self.search([
+                ("session_id", "=", session.id),
+                ("company_id", "=", company.id),
+                ("ncf_type", "=", ncf_type),
+                ("state", "=", "open"),
+            ], order="id", limit=1)
+
+            if block and not self._lms_range_valid(block.range_id):
+                block._lms_release(reason="void")
+                continue
+
+            if not block:
+                block = self._lms_reserve_block(session, company, ncf_type)
+                if not block:
+                    break
+
+            wanted = count - len(taken)
+            block.flush_recordset()
+            cr.execute(
+                """
+                UPDATE lms_ncf_block b
+                   SET number_next = LEAST(b.number_next + %s, b.number_end + 1),
+                       state = CASE WHEN b.number_next + %s > b.number_end
+                                    THEN 'exhausted' ELSE b.state END
+                  FROM (
+                        SELECT id, number_next AS old_next
+                          FROM lms_ncf_block
+                         WHERE id = %s
+                           FOR UPDATE
+                       ) old
+                 WHERE b.id = old.id AND b.state = 'open'
+             RETURNING old.old_next, b.number_next
+                """,
+                (wanted, wanted, block.id),
+            )
+            row = cr.fetchone()
+            block.invalidate_recordset(["number_next", "state"])
+            if not row:
+                continue
+
+            first, new_next = row
+
+            taken.extend(
+                (block.range_id.id, self._lms_format_ncf(block.prefix, number))
+                for number in range(first, new_next)
+            )
+
+        return taken
+
+    # =========================================================
+    # CUPO LOCAL DE LA CAJA (VALIDACIÓN OPTIMISTA)
+    # =========================================================
+    @api.model
+    def _lms_pending_orders(self, session, ncf_type):
+        """Ventas de la sesión ya cobradas que aún no tienen NCF."""
+
+        domain = [
+            ("session_id", "=", session.id),
+            ("state", "=", "paid"),
+            ("account_move", "=", False),
+            ("amount_total", ">", 0),
+        ]
+        if ncf_type == "01":
+            domain.append(("partner_id.vat", "!=", False))
+        else:
+            domain += ["|", ("partner_id", "=", False), ("partner_id.vat", "=", False)]
+
+        return self.env["pos.order"].sudo().search_count(domain)
+
+    @api.model
+    def _lms_session_quota(self, session, ncf_type, minimum=0):
+        """
+        NCF que la caja puede vender sin consultar al servidor:
+        lo que queda en sus bloques menos lo vendido y aún sin facturar.
+        Si queda por debajo de `minimum`, reserva otro bloque.
+        """
+
+        company = session.company_id
+        quota = 0
+
+        for _attempt in range(2):
+            remaining = sum(self.search([
+                ("session_id", "=", session.id),
+                ("ncf_type", "=", ncf_type),
+                ("state", "=", "open"),
+            ]).mapped("remaining"))
+
+            quota = remaining - self._lms_pending_orders(session, ncf_type)
+            if quota >= minimum:
+                break
+
+            if not self._lms_reserve_block(session, company, ncf_type):
+                break
+
+        return max(quota, 0)
+
+    # =========================================================
+    # LIBERACIÓN (CIERRE DE SESIÓN)
+    # =========================================================
+    def _lms_release(self, reason="session_close"):
+        """
+        Devuelve los números no usados como huecos reutilizables
+        y deja constancia para auditoría.
+        """
+
+        Gap = self.env["lms.ncf.gap"]
+
+        for block in self.filtered(lambda b: b.state == "open"):
+            if block.number_next <= block.number_end:
+                Gap.create({
+                    # Rango vencido/inactivo: solo auditoría, no se reutiliza
+                    "state": "void" if reason == "void" else "open",
+                    "company_id": block.company_id.id,
+                    "range_id": block.range_id.id,
+                    "block_id": block.id,
+                    "ncf_type": block.ncf_type,
+                    "prefix": block.prefix,
+                    "number_start": block.number_next,
+                    "number_end": block.number_end,
+                    "reason": reason,
+                })
+            block.state = "released"
+
+        return True
+
+    @api.model
+    def _lms_release_session_blocks(self, sessions):
+        blocks = self.search([
+            ("session_id", "in", sessions.ids),
+            ("state", "=", "open"),
+        ])
+        return blocks._lms_release()
+
+
+class NcfGap(models.Model):
+    """
+    Números NCF reservados que no llegaron a usarse.
+    Quedan abiertos para reutilizarse y trazados para auditoría.
+    """
+
+    _name = "lms.ncf.gap"
+    _description = "Hueco de NCF liberado"
+    _order = "number_start"
+
+    company_id = fields.Many2one("res.company", required=True, index=True)
+    range_id = fields.Many2one(
+        "l10n_do.ncf.range", required=True, index=True, ondelete="restrict"
+    )
+    block_id = fields.Many2one("lms.ncf.block", ondelete="set null")
+    reused_block_id = fields.Many2one("lms.ncf.block", ondelete="set null")
+    ncf_type = fields.Char(size=2, required=True)
+    prefix = fields.Char(required=True)
+    number_start = fields.Integer(required=True)
+    number_end = fields.Integer(required=True)
+    reason = fields.Selection(
+        [
+            ("session_close", "Cierre de sesión"),
+            ("void", "Anulado"),
+        ],
+        required=True,
+    )
+    state = fields.Selection(
+        [
+            ("open", "Disponible"),
+            ("reused", "Reutilizado"),
+            ("void", "Anulado"),
+        ],
+        default="open",
+        required=True,
+        index=True,
+    )
+
+    @api.model
+    def _lms_claim(self, company, ncf_type):
+        """
+        Toma el hueco abierto más antiguo sin esperar por otras cajas,
+        solo de rangos todavía activos y vigentes.
+        """
+
+        self.flush_model()
+        self.env["l10n_do.ncf.range"].flush_model(["active", "date_end"])
+        self.env.cr.execute(
+            """
+            SELECT g.id FROM lms_ncf_gap g
+              JOIN l10n_do_ncf_range r ON r.id = g.range_id
+             WHERE g.company_id = %s AND g.ncf_type = %s AND g.state = 'open'
+               AND r.active
+               AND (r.date_end IS NULL OR r.date_end >= %s)
+          ORDER BY g.number_start
+             LIMIT 1
+               FOR UPDATE OF g SKIP LOCKED
+            """,
+            (company.id, ncf_type, fields.Date.context_today(self)),
+        )
+        row = self.env.cr.fetchone()
+        return self.browse(row[0]) if row else self.browse()
+
+    def action_void(self):
+        """Anula huecos que ya no se usarán (rango vencido, auditoría)."""
+        self.filtered(lambda g: g.state == "open").write({"state": "void"})
+        return True
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import re
+
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+
+NCF_RE = re.compile(r"B\d{2}\d{8,}")
+
+
+class PaymentNcf(models.Model):
+    """
+    Índice NCF → asiento de pago.
+
+    Una fila por NCF mencionado en `ref`/`narration` de un asiento que
+    no es factura (pagos manuales). Se extrae una sola vez al escribir
+    el asiento; la conciliación hace un join directo por `ncf_number`.
+    """
+
+    _name = "lms.payment.ncf"
+    _description = "NCF referenciado en pago"
+    _rec_name = "ncf_number"
+
+    move_id = fields.Many2one(
+        "account.move", required=True, index=True, ondelete="cascade"
+    )
+    company_id = fields.Many2one("res.company", required=True)
+    ncf_number = fields.Char(required=True)
+
+    _sql_constraints = [
+        (
+            "move_ncf_uniq",
+            "unique(move_id, ncf_number)",
+            "El NCF ya está indexado para este asiento.",
+        ),
+    ]
+
+    def init(self):
+        create_index(
+            self.env.cr,
+            "lms_payment_ncf_company_ncf_idx",
+            self._table,
+            ["company_id", "ncf_number"],
+        )
+
+        # Carga inicial (solo si el índice está vacío)
+        self.env.cr.execute("SELECT 1 FROM lms_payment_ncf LIMIT 1")
+        if self.env.cr.fetchone():
+            return
+
+        self.env.cr.execute(
+            """
+            INSERT INTO lms_payment_ncf (move_id, company_id, ncf_number,
+                                         create_uid, create_date, write_uid, write_date)
+            SELECT DISTINCT m.id, m.company_id, ncf.match[1],
+                   1, now() AT TIME ZONE 'UTC', 1, now() AT TIME ZONE 'UTC'
+              FROM account_move m,
+                   LATERAL regexp_matches(
+                       COALESCE(m.ref, '') || ' ' || COALESCE(m.narration::text, ''),
+                       '(B\\d{2}\\d{8,})', 'g'
+                   ) AS ncf(match)
+             WHERE m.move_type = 'entry'
+               AND (m.ref IS NOT NULL OR m.narration IS NOT NULL)
+            ON CONFLICT DO NOTHING
+            """
+        )
+
+
+class AccountMove(models.Model):
+    _inherit = "account.move"
+
+    lms_payment_ncf_ids = fields.One2many(
+        "lms.payment.ncf", "move_id", string="NCF referenciados", readonly=True
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super().create(vals_list)
+        moves.filtered(lambda m: m.ref or m.narration)._lms_sync_payment_ncf()
+        return moves
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "ref" in vals or "narration" in vals:
+            self._lms_sync_payment_ncf()
+        return res
+
+    def _lms_sync_payment_ncf(self):
+        """Re-extrae los NCF del texto de los asientos de pago."""
+
+        moves = self.filtered(lambda m: m.move_type == "entry")
+        if not moves:
+            return True
+
+        PaymentNcf = self.env["lms.payment.ncf"].sudo()
+        PaymentNcf.search([("move_id", "in", moves.ids)]).unlink()
+
+        vals_list = []
+        for move in moves:
+            text = " ".join(filter(None, [move.ref, str(move.narration or "")]))
+            for ncf in dict.fromkeys(NCF_RE.findall(text)):
+                vals_list.append({
+                    "move_id": move.id,
+                    "company_id": move.company_id.id,
+                    "ncf_number": ncf,
+                })
+
+        PaymentNcf.create(vals_list)
+
+        # 🔔 Facturas en espera con esos NCF → el CRON las toma ya
+        if vals_list:
+            self.env["account.move"].flush_model(["lms_reconcile_state", "lms_reconcile_next_try"])
+            self.env.cr.execute(
+                """
+                UPDATE account_move
+                   SET lms_reconcile_next_try = %s
+                 WHERE ncf_number IN %s
+                   AND lms_reconcile_state = 'retry'
+                """,
+                (
+                    fields.Datetime.now(),
+                    tuple({vals["ncf_number"] for vals in vals_list}),
+                ),
+            )
+            self.env["account.move"].invalidate_model(["lms_reconcile_next_try"])
+
+        return True
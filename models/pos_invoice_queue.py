@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+from ..services import fiscal_metrics
+from .pos_order import DEFAULT_INVOICE_BATCH_SIZE, INVOICE_BATCH_SIZE_PARAM
+
+_logger = logging.getLogger(__name__)
+
+# Micro-lote por vuelta del worker y tope de vueltas por ejecución
+INVOICE_QUEUE_MICRO_BATCH_PARAM = "lms_pos_fiscal_print.invoice_queue_micro_batch"
+DEFAULT_INVOICE_QUEUE_MICRO_BATCH = 25
+INVOICE_QUEUE_MAX_BATCHES = 200
+INVOICE_QUEUE_MAX_ATTEMPTS = 5
+# Filas fallidas se reencolan solas pasado este tiempo (o a mano)
+INVOICE_QUEUE_REQUEUE_AFTER = timedelta(hours=1)
+
+# Workers (ir.cron) que drenan la cola en paralelo; cada uno reserva
+# una partición (compañía, caja) libre con un advisory lock
+INVOICE_QUEUE_WORKER_CRONS = (
+    "lms_pos_fiscal_print.ir_cron_lms_pos_invoice_queue",
+    "lms_pos_fiscal_print.ir_cron_lms_pos_invoice_queue_2",
+    "lms_pos_fiscal_print.ir_cron_lms_pos_invoice_queue_3",
+    "lms_pos_fiscal_print.ir_cron_lms_pos_invoice_queue_4",
+)
+
+
+class PosInvoiceQueue(models.Model):
+    """
+    Cola de facturación fiscal POS.
+
+    El POS encola la orden al cobrar y vuelve de inmediato; los
+    workers (CRON disparado) la drenan en micro-lotes reclamando filas
+    con FOR UPDATE SKIP LOCKED. Una fila por orden: encolar dos veces
+    (POS + CRON) no duplica trabajo.
+    """
+
+    _name = "lms.pos.invoice.queue"
+    _description = "Cola de facturación fiscal POS"
+    _order = "id"
+
+    order_id = fields.Many2one("pos.order", required=True, ondelete="cascade")
+    company_id = fields.Many2one("res.company", required=True, index=True)
+    config_id = fields.Many2one("pos.config", index=True, ondelete="set null")
+    state = fields.Selection(
+        [
+            ("pending", "Pendiente"),
+            ("done", "Facturada"),
+            ("failed", "Fallida"),
+            ("skipped", "No facturable"),
+        ],
+        default="pending",
+        required=True,
+        index=True,
+    )
+    enqueued_at = fields.Datetime(default=fields.Datetime.now, required=True)
+    posted_at = fields.Datetime()
+    attempts = fields.Integer(default=0)
+    last_error = fields.Char()
+    trace_id = fields.Char(help="Traza de la venta, generada por el POS al validar.")
+
+    _sql_constraints = [
+        ("order_uniq", "unique(order_id)", "La orden ya está en la cola de facturación."),
+    ]
+
+    # =========================================================
+    # ENCOLAR
+    # =========================================================
+    @api.model
+    def _lms_enqueue(self, orders, trace_ids=None):
+        """
+        Encola órdenes (idempotente) y despierta al worker.
+        `trace_ids`: {order_id: trace_id} enviado por el POS.
+        """
+
+        # 🔒 Solo ventas facturables: pagadas, con monto > 0 y sin factura
+        orders = orders.filtered(
+            lambda o: not o.account_move and o.state == "paid" and o.amount_total > 0
+        )
+        if not orders:
+            return False
+
+        now = fields.Datetime.now()
+        uid = self.env.uid
+        trace_ids = trace_ids or {}
+
+        self.env.cr.execute(
+            """
+            INSERT INTO lms_pos_invoice_queue
+                   (order_id, company_id, config_id, state, enqueued_at, attempts,
+                    trace_id, create_uid, create_date, write_uid, write_date)
+            VALUES %s
+            ON CONFLICT (order_id) DO NOTHING
+            """ % ", ".join(["(%s, %s, %s, 'pending', %s, 0, %s, %s, %s, %s, %s)"] * len(orders)),
+            [
+                value
+                for order in orders
+                for value in (
+                    order.id, order.company_id.id, order.config_id.id or None,
+                    now, trace_ids.get(order.id), uid, now, uid, now,
+                )
+            ],
+        )
+
+        self._lms_wake_workers()
+
+        return True
+
+    @api.model
+    def _lms_wake_workers(self):
+        for xmlid in INVOICE_QUEUE_WORKER_CRONS:
+            cron = self.env.ref(xmlid, raise_if_not_found=False)
+            if cron and cron.active:
+                cron._trigger()
+
+    @api.model
+    def _cron_lms_enqueue_pending_orders(self, batch_size=None):
+        """
+        CRON de respaldo: encola las órdenes pagadas sin factura de
+        TODAS las compañías que no estén ya en la cola (ventas cuyo
+        disparo desde el POS no llegó).
+        """
+
+        if batch_size is None:
+            batch_size = int(
+                self.env["ir.config_parameter"].sudo().get_param(
+                    INVOICE_BATCH_SIZE_PARAM, DEFAULT_INVOICE_BATCH_SIZE
+                )
+            )
+
+        self._lms_requeue_failed()
+
+        self.flush_model()
+        self.env.cr.execute(
+            """
+            SELECT o.id FROM pos_order o
+             WHERE o.state = 'paid'
+               AND o.account_move IS NULL
+               AND o.amount_total > 0
+               AND NOT EXISTS (
+                    SELECT 1 FROM lms_pos_invoice_queue q WHERE q.order_id = o.id
+               )
+          ORDER BY o.date_order
+             LIMIT %s
+            """,
+            (batch_size,),
+        )
+        orders = self.env["pos.order"].sudo().browse(
+            [row[0] for row in self.env.cr.fetchall()]
+        )
+
+        if orders:
+            _logger.info(
+                "[POS FISCAL QUEUE] %s órdenes pendientes encoladas (%s compañías)",
+                len(orders),
+                len(orders.company_id),
+            )
+            self._lms_enqueue(orders)
+
+        return len(orders)
+
+    @api.model
+    def _lms_requeue_failed(self):
+        """Fallidas hace más de INVOICE_QUEUE_REQUEUE_AFTER → otra ronda."""
+
+        rows = self.search([
+            ("state", "=", "failed"),
+            ("write_date", "<", fields.Datetime.now() - INVOICE_QUEUE_REQUEUE_AFTER),
+        ])
+        return rows.action_requeue()
+
+    def action_requeue(self):
+        """Reencola filas fallidas cuya orden sigue sin facturar."""
+
+        rows = self.filtered(
+            lambda r: r.state == "failed"
+            and not r.order_id.account_move
+            and r.order_id.state == "paid"
+            and r.order_id.amount_total > 0
+        )
+        if rows:
+            rows.write({"state": "pending", "attempts": 0})
+            _logger.info("[POS FISCAL QUEUE] %s filas fallidas reencoladas", len(rows))
+            self._lms_wake_workers()
+        return True
+
+    # =========================================================
+    # WORKER
+    # =========================================================
+    @api.model
+    def _lms_claim(self, limit, exclude_ids=()):
+        """
+        Reclama un micro-lote de UNA partición (compañía, caja). La
+        partición se reserva con un advisory lock de transacción hasta
+        el commit del micro-lote: dos workers nunca facturan a la vez
+        la misma partición. `exclude_ids`: filas ya intentadas en esta
+        ejecución (esperan a la siguiente).
+        """
+
+        cr = self.env.cr
+        exclude = list(exclude_ids) or [0]
+
+        self.flush_model()
+        cr.execute(
+            """
+            SELECT company_id, config_id FROM lms_pos_invoice_queue
+             WHERE state = 'pending' AND id != ALL(%s)
+          GROUP BY company_id, config_id
+          ORDER BY min(id)
+            """,
+            (exclude,),
+        )
+        for company_id, config_id in cr.fetchall():
+            cr.execute(
+                "SELECT pg_try_advisory_xact_lock(hashtext(%s), hashtext(%s))",
+                (self._table, "%s:%s" % (company_id, config_id or 0)),
+            )
+            if not cr.fetchone()[0]:
+                continue
+
+            cr.execute(
+                """
+                SELECT id FROM lms_pos_invoice_queue
+                 WHERE state = 'pending'
+                   AND company_id = %s
+                   AND config_id IS NOT DISTINCT FROM %s
+                   AND id != ALL(%s)
+              ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+                """,
+                (company_id, config_id, exclude, limit),
+            )
+            ids = [row[0] for row in cr.fetchall()]
+            if ids:
+                return self.browse(ids)
+
+        return self.browse()
+
+    @api.model
+    def _cron_lms_drain_invoice_queue(self, micro_batch=None):
+        """
+        Drena la cola en micro-lotes: reclama, factura con el motor por
+        lotes de `pos.order` y hace commit por micro-lote.
+        """
+
+        if micro_batch is None:
+            micro_batch = int(
+                self.env["ir.config_parameter"].sudo().get_param(
+                    INVOICE_QUEUE_MICRO_BATCH_PARAM, DEFAULT_INVOICE_QUEUE_MICRO_BATCH
+                )
+            )
+
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        processed = 0
+
+        seen = set()
+
+        for _batch in range(INVOICE_QUEUE_MAX_BATCHES):
+            # Lo que ya se intentó en esta ejecución espera a la siguiente;
+            # una fila problemática no frena al resto de particiones
+            rows = self._lms_claim(micro_batch, seen)
+            if not rows:
+                break
+            seen.update(rows.ids)
+
+            rows._lms_process()
+            processed += len(rows)
+
+            if auto_commit:
+                self.env.cr.commit()
+
+        if processed:
+            stats = self._lms_queue_stats()
+            _logger.info(
+                "[POS FISCAL QUEUE] %s órdenes procesadas | en cola: %s | "
+                "encolado→publicado p50 %.1fs p95 %.1fs",
+                processed,
+                stats["depth"],
+                stats["latency_p50"],
+                stats["latency_p95"],
+            )
+
+        return processed
+
+    def _lms_process(self):
+        """
+        Factura las órdenes de las filas reclamadas: el micro-lote
+        completo bajo un savepoint y, si falla, orden por orden, para
+        que una sola (p.ej. rango B01 agotado) no tumbe a las demás.
+        """
+
+        now = fields.Datetime.now()
+        for row in self:
+            fiscal_metrics.record(
+                self.env.cr.dbname,
+                "queue_wait",
+                (now - row.enqueued_at).total_seconds(),
+            )
+
+        # 🔒 Devoluciones, monto 0, anuladas: nunca consumen un NCF
+        invoiceable = self.filtered(
+            lambda r: not r.order_id.account_move
+            and r.order_id.state == "paid"
+            and r.order_id.amount_total > 0
+        )
+        (self - invoiceable).filtered(lambda r: not r.order_id.account_move).write({
+            "state": "skipped",
+            "last_error": "Orden no facturable",
+        })
+
+        errors = {}
+        if invoiceable:
+            try:
+                with self.env.cr.savepoint():
+                    invoiceable._lms_invoice_orders()
+            except Exception as e:
+                _logger.warning(
+                    "[POS FISCAL QUEUE] Lote %s falló (%s); se factura orden por orden",
+                    invoiceable.order_id.ids,
+                    e,
+                )
+                for row in invoiceable:
+                    try:
+                        with self.env.cr.savepoint():
+                            row._lms_invoice_orders()
+                    except Exception as e:
+                        _logger.exception(
+                            "[POS FISCAL QUEUE] Error facturando orden %s: %s",
+                            row.order_id.name,
+                            e,
+                        )
+                        errors[row.id] = e
+
+        for row in invoiceable.filtered(lambda r: r.id in errors):
+            attempts = row.attempts + 1
+            row.write({
+                "attempts": attempts,
+                "state": "failed" if attempts >= INVOICE_QUEUE_MAX_ATTEMPTS else "pending",
+                "last_error": str(errors[row.id])[:255],
+            })
+            if attempts >= INVOICE_QUEUE_MAX_ATTEMPTS:
+                _logger.warning(
+                    "[POS FISCAL QUEUE] Orden %s fallida tras %s intentos: %s",
+                    row.order_id.name,
+                    attempts,
+                    errors[row.id],
+                )
+
+        now = fields.Datetime.now()
+        done = self.filtered(lambda r: r.order_id.account_move)
+        for row in done.filtered("trace_id"):
+            _logger.debug(
+                "[POS FISCAL TRACE] %s orden %s facturada (%s)",
+                row.trace_id,
+                row.order_id.name,
+                row.order_id.account_move.name,
+            )
+        done.write({
+            "state": "done",
+            "posted_at": now,
+        })
+
+        # Bloqueadas por otra transacción en este momento: contención,
+        # no error → se liberan sin contar intento
+        (invoiceable - done - self.browse(list(errors))).write({
+            "state": "pending",
+            "last_error": "Orden bloqueada por otra transacción",
+        })
+
+        return not errors
+
+    def _lms_invoice_orders(self):
+        # Cualquier compañía: el worker no depende de la compañía del usuario
+        orders = self.order_id.sudo()
+        for company in orders.company_id:
+            orders.filtered(
+                lambda o: o.company_id == company
+            ).with_company(company)._lms_invoice_batch()
+
+    # =========================================================
+    # MÉTRICAS
+    # =========================================================
+    @api.model
+    def _lms_queue_stats(self, window=1000):
+        """Profundidad de la cola y latencia encolado → publicado (s)."""
+
+        cr = self.env.cr
+        self.flush_model()
+
+        cr.execute(
+            """
+            SELECT count(*),
+                   EXTRACT(EPOCH FROM (now() AT TIME ZONE 'UTC') - min(enqueued_at))
+              FROM lms_pos_invoice_queue
+             WHERE state = 'pending'
+            """
+        )
+        depth, oldest = cr.fetchone()
+
+        cr.execute(
+            """
+            SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY lat),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY lat)
+              FROM (
+                    SELECT EXTRACT(EPOCH FROM posted_at - enqueued_at) AS lat
+                      FROM lms_pos_invoice_queue
+                     WHERE state = 'done'
+                  ORDER BY id DESC
+                     LIMIT %s
+                   ) recent
+            """,
+            (window,),
+        )
+        p50, p95 = cr.fetchone()
+
+        return {
+            "depth": depth,
+            "oldest_pending_age": float(oldest or 0.0),
+            "latency_p50": float(p50 or 0.0),
+            "latency_p95": float(p95 or 0.0),
+        }
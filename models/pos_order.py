@@ -1,10 +1,55 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+
+from ..services import fiscal_metrics
+
+_logger = logging.getLogger(__name__)
+
+# Parámetros del motor de facturación por lotes (ir.config_parameter)
+INVOICE_BATCH_SIZE_PARAM = "lms_pos_fiscal_print.invoice_batch_size"
+INVOICE_COMMIT_CHUNK_PARAM = "lms_pos_fiscal_print.invoice_commit_chunk"
+DEFAULT_INVOICE_BATCH_SIZE = 500
+DEFAULT_INVOICE_COMMIT_CHUNK = 50
 
 
 class PosOrder(models.Model):
     _inherit = "pos.order"
 
+    def init(self):
+        super().init()
+        cr = self.env.cr
+
+        # CRON de facturación: órdenes pagadas sin factura, por antigüedad
+        create_index(
+            cr,
+            "lms_pos_order_to_invoice_idx",
+            self._table,
+            ["company_id", "date_order"],
+            where="state = 'paid' AND account_move IS NULL",
+        )
+        # last_fiscal_invoice: última orden facturada del cajero
+        create_index(
+            cr,
+            "lms_pos_order_user_invoiced_idx",
+            self._table,
+            ["user_id", "id DESC"],
+            where="account_move IS NOT NULL",
+        )
+        # trigger_fiscal_invoice / fiscal_invoice_by_reference
+        create_index(
+            cr,
+            "lms_pos_order_reference_idx",
+            self._table,
+            ["pos_reference", "id DESC"],
+            where="pos_reference IS NOT NULL",
+        )
+
     # =========================================================
     # 🔹 LEGACY / FALLBACK
     # =========================================================
@@ -15,14 +60,7 @@ class PosOrder(models.Model):
         """
 
         if not move_vals.get("partner_id"):
-            partner = self.env["res.partner"].search(
-                [
-                    ("name", "=", "Cliente Consumidor Final"),
-                    ("company_id", "in", [False, self.env.company.id]),
-                ],
-                order="company_id desc",
-                limit=1,
-            )
+            partner = self.env.company._lms_consumidor_final()
             if partner:
                 move_vals["partner_id"] = partner.id
 
@@ -33,6 +71,14 @@ class PosOrder(models.Model):
                 "lms_fiscal_pending_print": True,
                 "lms_fiscal_printed": False,
             })
+            # Como el motor por lotes: la concilia el cierre de sesión
+            move.filtered(lambda m: m.move_type == "out_invoice").write({
+                "lms_reconcile_state": (
+                    "pending"
+                    if all(s.state == "closed" for s in self.session_id)
+                    else "waiting"
+                ),
+            })
 
         move = move.with_context(no_report=True)
 
@@ -65,13 +111,86 @@ class PosOrder(models.Model):
 
         return True
 
+    def _lms_check_ncf_batch(self, company_id, ncf_type, needed):
+        """
+        Igual que `_lms_check_ncf_available`, pero para un lote:
+        valida UNA sola vez que los rangos activos del tipo
+        cubran todas las facturas que se van a emitir.
+        """
+
+        ncf_ranges = self.env["l10n_do.ncf.range"].search(
+            self.env["lms.ncf.block"]._lms_valid_range_domain(
+                self.env["res.company"].browse(company_id), ncf_type
+            ) + [("available_numbers", ">", 0)]
+        )
+
+        available = sum(ncf_ranges.mapped("available_numbers"))
+
+        # Números ya reservados en bloques de sesión también cuentan
+        available += sum(
+            self.env["lms.ncf.block"].sudo().search([
+                ("company_id", "=", company_id),
+                ("ncf_type", "=", ncf_type),
+                ("state", "=", "open"),
+            ]).mapped("remaining")
+        )
+
+        if available < needed:
+            raise UserError(
+                _(
+                    "No hay NCF suficientes para facturar las ventas pendientes.\n\n"
+                    "Tipo requerido: %(type)s\n"
+                    "Disponibles: %(available)s | Requeridos: %(needed)s\n"
+                    "Solución: cargue un nuevo rango de NCF antes de continuar."
+                ) % {
+                    "type": "B01" if ncf_type == "01" else "B02",
+                    "available": available,
+                    "needed": needed,
+                }
+            )
+
+        return True
+
+    def _lms_get_consumidor_final(self, company):
+
+        partner = company._lms_consumidor_final()
+        if not partner:
+            raise UserError(
+                _("No existe el cliente 'Cliente Consumidor Final'.")
+            )
+
+        return partner
+
     # =========================================================
     # ✅ FACTURACIÓN FISCAL
     # Compatible con CRON y Controller
     # =========================================================
-    def _lms_create_fiscal_invoice_from_pos(self):
+    def _lms_create_fiscal_invoice_from_pos(self, batch_size=None, commit_chunk=None):
+        """
+        Motor de facturación fiscal por lotes.
+
+        - Controller (recordset) → factura las órdenes recibidas,
+          sin commits intermedios.
+        - CRON (model-level) → toma hasta `batch_size` órdenes
+          pendientes y hace commit cada `commit_chunk` facturas.
+
+        Ambos tamaños se configuran con los parámetros de sistema
+        `lms_pos_fiscal_print.invoice_batch_size` y
+        `lms_pos_fiscal_print.invoice_commit_chunk`.
+        """
 
         company = self.env.company
+        ICP = self.env["ir.config_parameter"].sudo()
+
+        if batch_size is None:
+            batch_size = int(ICP.get_param(
+                INVOICE_BATCH_SIZE_PARAM, DEFAULT_INVOICE_BATCH_SIZE
+            ))
+        if commit_chunk is None:
+            commit_chunk = int(ICP.get_param(
+                INVOICE_COMMIT_CHUNK_PARAM, DEFAULT_INVOICE_COMMIT_CHUNK
+            ))
+        commit_chunk = max(commit_chunk, 1)
 
         # 🔹 Si se llama desde controller → usar self
         if self:
@@ -81,6 +200,7 @@ class PosOrder(models.Model):
                 and o.amount_total > 0
                 and o.company_id.id == company.id
             )
+            auto_commit = False
         else:
             # 🔹 Si lo llama CRON (model-level)
             orders = self.search(
@@ -91,37 +211,101 @@ class PosOrder(models.Model):
                     ("amount_total", ">", 0),
                 ],
                 order="date_order asc",
-                limit=10,
+                limit=batch_size,
             )
+            auto_commit = not getattr(threading.current_thread(), "testing", False)
 
         if not orders:
             return True
 
-        for order in orders:
+        started = time.perf_counter()
+        created = 0
 
-            if order.account_move:
-                continue
-
-            partner = order.partner_id
-            if not partner:
-                partner = self.env["res.partner"].search(
-                    [
-                        ("name", "=", "Cliente Consumidor Final"),
-                        ("company_id", "in", [False, company.id]),
-                    ],
-                    order="company_id desc",
-                    limit=1,
-                )
-                if not partner:
-                    raise UserError(
-                        _("No existe el cliente 'Cliente Consumidor Final'.")
-                    )
+        for start in range(0, len(orders), commit_chunk):
+            chunk = orders[start:start + commit_chunk]
+            created += len(chunk._lms_invoice_batch())
+
+            if auto_commit:
+                self.env.cr.commit()
+
+        elapsed = time.perf_counter() - started
+        _logger.info(
+            "[POS FISCAL BATCH] %s facturas creadas en %.2fs (%.1f órdenes/s)",
+            created,
+            elapsed,
+            created / elapsed if elapsed else 0.0,
+        )
+
+        return True
+
+    def _lms_invoice_batch(self):
+        """
+        Factura un lote de órdenes:
+        - Cliente consumidor final y rangos NCF resueltos UNA vez
+        - Un solo `create` multi-registro
+        - Un solo `action_post` para todo el lote
+        """
+
+        AccountMove = self.env["account.move"]
+
+        # 🔒 Devoluciones y ventas en 0 no consumen NCF
+        orders = self.filtered(
+            lambda o: not o.account_move and o.state == "paid" and o.amount_total > 0
+        )
+        if not orders:
+            return AccountMove
+
+        # 🔒 Reclamar las órdenes: si otro worker (cola o CRON) ya las
+        # tiene bloqueadas se saltan, nunca se facturan dos veces
+        orders.flush_recordset(["account_move"])
+        self.env.cr.execute(
+            """
+            SELECT id FROM pos_order
+             WHERE id IN %s AND account_move IS NULL
+               FOR UPDATE SKIP LOCKED
+            """,
+            (tuple(orders.ids),),
+        )
+        claimed = {row[0] for row in self.env.cr.fetchall()}
+        orders = orders.filtered(lambda o: o.id in claimed)
+        if not orders:
+            return AccountMove
+
+        # 🔹 Cliente consumidor final por compañía (una búsqueda por lote)
+        default_partners = {}
+        for company in orders.company_id:
+            if orders.filtered(lambda o: o.company_id == company and not o.partner_id):
+                default_partners[company.id] = self._lms_get_consumidor_final(company)
+
+        # 🔹 Demanda de NCF por (compañía, tipo) → una validación por tipo
+        partners = {}
+        ncf_types = {}
+        demand = defaultdict(int)
+        for order in orders:
+            partner = order.partner_id or default_partners[order.company_id.id]
+            partners[order.id] = partner
+            ncf_types[order.id] = "01" if partner.vat else "02"
+            demand[(order.company_id.id, ncf_types[order.id])] += 1
 
-            order._lms_check_ncf_available(partner)
+        for (company_id, ncf_type), needed in demand.items():
+            self._lms_check_ncf_batch(company_id, ncf_type, needed)
 
-            invoice_lines = []
-            for line in order.lines:
-                invoice_lines.append(
+        vals_list = []
+        for order in orders:
+            vals_list.append({
+                "move_type": "out_invoice",
+                "partner_id": partners[order.id].id,
+                "invoice_date": fields.Date.context_today(order),
+                "invoice_origin": order.name,
+                "company_id": order.company_id.id,
+                "lms_fiscal_pending_print": True,
+                "lms_fiscal_printed": False,
+                # La concilia el cierre de su sesión, no el CRON barredor;
+                # rezagada de una sesión ya cerrada → directo al barredor
+                "lms_reconcile_state": (
+                    "pending" if order.session_id.state == "closed" else "waiting"
+                ),
+                "invoice_line_ids": [
                     (0, 0, {
                         "product_id": line.product_id.id,
                         "name": line.product_id.display_name,
@@ -129,32 +313,126 @@ class PosOrder(models.Model):
                         "price_unit": line.price_unit,
                         "tax_ids": [(6, 0, line.tax_ids.ids)],
                     })
-                )
+                    for line in order.lines
+                ],
+            })
 
-            move_vals = {
-                "move_type": "out_invoice",
-                "partner_id": partner.id,
-                "invoice_date": fields.Date.context_today(order),
-                "invoice_origin": order.name,
-                "company_id": order.company_id.id,
-                "invoice_line_ids": invoice_lines,
-            }
+        with fiscal_metrics.measure(self.env, "invoice_create", len(orders)):
+            invoices = AccountMove.create(vals_list)
+
+            for order, invoice in zip(orders, invoices):
+                order.account_move = invoice
+
+        with fiscal_metrics.measure(self.env, "ncf_assign", len(orders)):
+            orders._lms_assign_ncf_batch(invoices, ncf_types)
+
+        with fiscal_metrics.measure(self.env, "post", len(orders)):
+            invoices.action_post()
+
+        # 🖨️ Tickets listos antes de que el POS los pida
+        with fiscal_metrics.measure(self.env, "receipt_render", len(orders)):
+            invoices._lms_store_receipts()
 
-            invoice = self.env["account.move"].create(move_vals)
+        orders._lms_notify_fiscal_print_ready()
 
-            order.write({"account_move": invoice.id})
+        return invoices
+
+    def _lms_notify_fiscal_print_ready(self):
+        """
+        Encola los trabajos de impresión y avisa por bus a cada caja.
+        El aviso sale al hacer commit de la transacción.
+        """
+
+        jobs = self.env["lms.fiscal.print.job"].sudo()._lms_enqueue_orders(self)
+
+        for config in jobs.config_id:
+            config_jobs = jobs.filtered(lambda j: j.config_id == config)
+            config._notify("LMS_FISCAL_PRINT_READY", {
+                "config_id": config.id,
+                "invoice_ids": config_jobs.invoice_id.ids,
+            })
 
-            if hasattr(invoice, "lms_assign_ncf"):
+        return True
+
+    def _lms_assign_ncf_batch(self, invoices, ncf_types):
+        """
+        Asigna NCF desde el bloque reservado de cada sesión
+        (`lms.ncf.block`). Lo que el bloque no cubra sigue
+        por el flujo estándar `lms_assign_ncf`. Los números del bloque
+        pasan las mismas validaciones que `lms_assign_ncf`.
+        """
+
+        Block = self.env["lms.ncf.block"].sudo()
+        Range = self.env["l10n_do.ncf.range"].sudo()
+
+        groups = defaultdict(list)
+        for order, invoice in zip(self, invoices):
+            key = (order.session_id, order.company_id, ncf_types[order.id])
+            groups[key].append(invoice)
+
+        for (session, company, ncf_type), group in groups.items():
+
+            numbers = []
+            if session:
+                numbers = Block._lms_take_numbers(session, company, ncf_type, len(group))
+
+            assigned = list(zip(group, numbers))
+            self._lms_check_block_ncf(Range, company, ncf_type, assigned)
+
+            for invoice, (range_id, ncf) in assigned:
+                invoice.write({
+                    "ncf_number": ncf,
+                    "ncf_range_id": range_id,
+                })
+
+            for invoice in group[len(numbers):]:
                 invoice.lms_assign_ncf()
 
-            vals = {}
-            if "lms_fiscal_pending_print" in invoice._fields:
-                vals["lms_fiscal_pending_print"] = True
-            if "lms_fiscal_printed" in invoice._fields:
-                vals["lms_fiscal_printed"] = False
-            if vals:
-                invoice.write(vals)
+        # 🔔 Disponibilidad actualizada para las cajas abiertas
+        self.env["lms.ncf.availability"]._lms_refresh(self.company_id)
+
+        return True
+
+    def _lms_check_block_ncf(self, Range, company, ncf_type, assigned):
+        """
+        Validaciones de `lms_assign_ncf` para NCF tomados de un bloque:
+        rango de la compañía y del tipo, activo y vigente a la fecha de
+        la factura, factura sin NCF previo y número no usado.
+        """
+
+        if not assigned:
+            return True
 
-            invoice.action_post()
+        ranges = {r.id: r for r in Range.browse(list({range_id for _inv, (range_id, _ncf) in assigned}))}
+
+        for invoice, (range_id, ncf) in assigned:
+            ncf_range = ranges[range_id]
+            invoice_date = invoice.invoice_date or fields.Date.context_today(self)
+            if (
+                ncf_range.company_id != company
+                or ncf_range.ncf_type != ncf_type
+                or not ncf_range.active
+                or (ncf_range.date_end and ncf_range.date_end < invoice_date)
+            ):
+                raise UserError(
+                    _("El rango NCF de %(ncf)s no es válido para la factura %(invoice)s.")
+                    % {"ncf": ncf, "invoice": invoice.display_name}
+                )
+            if invoice.ncf_number:
+                raise UserError(
+                    _("La factura %s ya tiene NCF asignado.") % invoice.display_name
+                )
+
+        used = self.env["account.move"].sudo().search_read(
+            [
+                ("company_id", "=", company.id),
+                ("ncf_number", "in", [ncf for _inv, (_range, ncf) in assigned]),
+            ],
+            ["ncf_number"],
+        )
+        if used:
+            raise UserError(
+                _("NCF ya utilizados: %s") % ", ".join(u["ncf_number"] for u in used)
+            )
 
         return True
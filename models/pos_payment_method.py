@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class PosPaymentMethod(models.Model):
+    _inherit = "pos.payment.method"
+
+    lms_dgii_607_method = fields.Selection(
+        [
+            ("cash", "Efectivo"),
+            ("transfer", "Cheque / transferencia / depósito"),
+            ("card", "Tarjeta débito / crédito"),
+            ("credit", "Venta a crédito"),
+        ],
+        string="Forma de pago DGII 607",
+        compute="_compute_lms_dgii_607_method",
+        store=True,
+        readonly=False,
+        help="Columna del 607 donde se declaran los cobros con este método.",
+    )
+
+    @api.depends("is_cash_count", "split_transactions", "use_payment_terminal")
+    def _compute_lms_dgii_607_method(self):
+        # Sugerencia inicial; se corrige a mano (p. ej. tarjeta sin terminal)
+        for method in self:
+            if method.is_cash_count:
+                method.lms_dgii_607_method = "cash"
+            elif method.split_transactions:
+                method.lms_dgii_607_method = "credit"
+            elif method.use_payment_terminal:
+                method.lms_dgii_607_method = "card"
+            else:
+                method.lms_dgii_607_method = "transfer"
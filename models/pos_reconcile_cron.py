@@ -1,26 +1,163 @@
 # -*- coding: utf-8 -*-
 import logging
-import re
+from collections import defaultdict
+from datetime import timedelta
 
-from odoo import models, api
+from odoo import models, fields, api
+from odoo.tools.sql import column_exists, create_index
 
 _logger = logging.getLogger(__name__)
 
+# Tamaño del lote del CRON y de cada bloque de conciliación (ir.config_parameter)
+RECONCILE_BATCH_SIZE_PARAM = "lms_pos_fiscal_print.reconcile_batch_size"
+DEFAULT_RECONCILE_BATCH_SIZE = 5000
+RECONCILE_CHUNK_SIZE = 200
+
+# Sesiones cerradas cuyas facturas se despiertan por vuelta del CRON
+RECONCILE_WAKE_SESSIONS = 500
+
+# Marca de la migración única del estado de conciliación (sin default)
+RECONCILE_STATE_BACKFILL_PARAM = "lms_pos_fiscal_print.reconcile_state_backfilled"
+
+# Reintentos: 5 min, 10, 20... hasta 1 día
+RECONCILE_RETRY_BASE = timedelta(minutes=5)
+RECONCILE_RETRY_MAX = timedelta(days=1)
+
 
 class AccountMove(models.Model):
     _inherit = "account.move"
 
+    lms_reconcile_state = fields.Selection(
+        [
+            ("waiting", "Espera cierre de sesión"),
+            ("pending", "Pendiente"),
+            ("retry", "Reintentar"),
+            ("done", "Conciliada"),
+        ],
+        string="Conciliación POS",
+        # Sin default: solo las facturas POS/NCF entran al barredor
+        # (las marcan el motor POS y `lms_assign_ncf`)
+        copy=False,
+    )
+    lms_reconcile_next_try = fields.Datetime(copy=False)
+    lms_reconcile_attempts = fields.Integer(default=0, copy=False)
+    lms_reconcile_reason = fields.Selection(
+        [
+            ("no_order", "Sin orden POS"),
+            ("ambiguous_order", "Varias órdenes POS"),
+            ("session_open", "Sesión abierta"),
+            ("no_session_move", "Sesión sin asiento"),
+            ("amount_mismatch", "Monto no coincide"),
+            ("no_receivable", "Sin saldo por cobrar"),
+            ("no_payment", "Sin pago por NCF"),
+            ("error", "Error al conciliar"),
+        ],
+        string="Motivo sin conciliar",
+        copy=False,
+    )
+
+    def init(self):
+        super().init()
+        # Trabajo vencido del CRON: nuevas + reintentos por fecha
+        create_index(
+            self.env.cr,
+            "lms_account_move_reconcile_due_idx",
+            self._table,
+            ["company_id", "lms_reconcile_next_try", "id"],
+            where="lms_reconcile_state IN ('pending', 'retry')",
+        )
+        # Facturas en espera de cierre (pocas): rezagadas tras el cierre
+        create_index(
+            self.env.cr,
+            "lms_account_move_reconcile_waiting_idx",
+            self._table,
+            ["id"],
+            where="lms_reconcile_state = 'waiting'",
+        )
+        self._lms_backfill_reconcile_state()
+
+    def _lms_backfill_reconcile_state(self):
+        """
+        Una sola vez: el campo tuvo default `pending` y todo asiento
+        (compras, pagos, asientos manuales) quedó en el índice de
+        trabajo vencido sin que el barredor lo tome jamás. Se vacía
+        el estado fuera de las facturas POS con NCF por cobrar y se
+        marcan `pending` las que aún no lo tengan.
+        """
+
+        ICP = self.env["ir.config_parameter"].sudo()
+        if ICP.get_param(RECONCILE_STATE_BACKFILL_PARAM):
+            return
+        if not column_exists(self.env.cr, self._table, "ncf_number"):
+            return
+
+        open_ncf = """
+            move_type = 'out_invoice' AND state = 'posted'
+            AND payment_state IN ('not_paid', 'partial')
+            AND ncf_number IS NOT NULL AND invoice_origin IS NOT NULL
+        """
+        self.env.cr.execute(
+            "UPDATE account_move SET lms_reconcile_state = NULL "
+            "WHERE lms_reconcile_state = 'pending' AND NOT (%s)" % open_ncf
+        )
+        cleared = self.env.cr.rowcount
+        self.env.cr.execute(
+            "UPDATE account_move SET lms_reconcile_state = 'pending' "
+            "WHERE lms_reconcile_state IS NULL AND %s" % open_ncf
+        )
+        _logger.info(
+            "[POS NCF CRON] Estado de conciliación migrado: %s asientos fuera, %s pendientes",
+            cleared,
+            self.env.cr.rowcount,
+        )
+        ICP.set_param(RECONCILE_STATE_BACKFILL_PARAM, "1")
+
+    def lms_assign_ncf(self):
+        """
+        NCF asignado por el flujo estándar (facturas manuales o el
+        resto de un lote POS): la factura por cobrar con origen entra
+        al barredor, salvo que el motor POS ya le haya dado estado.
+        """
+
+        res = super().lms_assign_ncf()
+        self.filtered(
+            lambda m: m.move_type == "out_invoice"
+            and m.invoice_origin
+            and not m.lms_reconcile_state
+        ).write({"lms_reconcile_state": "pending"})
+        return res
+
     @api.model
-    def _cron_reconcile_pos_ncf_invoices(self):
+    def _cron_reconcile_pos_ncf_invoices(self, batch_size=None):
         """
-        CRON:
-        - Concilia facturas con NCF creadas desde POS
-        - 1) Solo si la sesión POS está cerrada
-        - 2) Fallback: pagos manuales por NCF en texto (regex)
+        CRON barredor (lo normal lo concilia el cierre de sesión):
+        - Facturas con NCF nuevas o con reintento vencido
+        - 1) Contra la sesión POS, si está cerrada (rezagadas)
+        - 2) Fallback: pagos manuales por NCF (índice lms.payment.ncf)
+        Las facturas POS en espera de cierre (`waiting`) no entran,
+        salvo las de sesiones ya cerradas y conciliadas (rezagadas).
+
+        Todo por lotes: pocas consultas agrupadas, emparejamiento en
+        memoria y conciliación en bloques.
         """
 
         company = self.env.company
 
+        if batch_size is None:
+            batch_size = int(
+                self.env["ir.config_parameter"].sudo().get_param(
+                    RECONCILE_BATCH_SIZE_PARAM, DEFAULT_RECONCILE_BATCH_SIZE
+                )
+            )
+
+        now = fields.Datetime.now()
+
+        # 🔹 Sesiones cerradas desde la última vuelta → sus facturas vencen ya
+        self._lms_wake_closed_sessions()
+        # 🔹 Facturadas por la cola DESPUÉS del cierre → también vencen
+        self._lms_wake_late_invoices()
+
+        # 🔹 Solo trabajo nuevo o vencido; lo que no concilia espera su turno
         invoices = self.search(
             [
                 ("move_type", "=", "out_invoice"),
@@ -29,9 +166,14 @@ class AccountMove(models.Model):
                 ("invoice_origin", "!=", False),
                 ("ncf_number", "!=", False),
                 ("company_id", "=", company.id),
+                "|",
+                ("lms_reconcile_state", "=", "pending"),
+                "&",
+                ("lms_reconcile_state", "=", "retry"),
+                ("lms_reconcile_next_try", "<=", now),
             ],
-            order="invoice_date asc",
-            limit=20,
+            order="id asc",
+            limit=batch_size,
         )
 
         _logger.info(
@@ -39,163 +181,391 @@ class AccountMove(models.Model):
             len(invoices),
         )
 
-        for invoice in invoices:
-            try:
-                reconciled = self._reconcile_by_pos_order(invoice)
-
-                if not reconciled:
-                    self._reconcile_by_manual_ncf(invoice)
-
-            except Exception as e:
-                _logger.exception(
-                    "[POS NCF CRON] Error procesando factura %s (%s): %s",
-                    invoice.name,
-                    invoice.id,
-                    e,
-                )
+        if not invoices:
+            return {"candidates": 0, "pos": 0, "manual": 0}
+
+        reasons = {}
+        by_pos = self._lms_reconcile_by_pos_orders(invoices, reasons)
+        by_manual = self._lms_reconcile_by_manual_ncf(invoices - by_pos, reasons)
+
+        self._lms_mark_reconcile_result(invoices, by_pos | by_manual, reasons)
+
+        _logger.info(
+            "[POS NCF CRON] Conciliadas %s de %s (POS: %s | NCF manual: %s)",
+            len(by_pos) + len(by_manual),
+            len(invoices),
+            len(by_pos),
+            len(by_manual),
+        )
+
+        return {
+            "candidates": len(invoices),
+            "pos": len(by_pos),
+            "manual": len(by_manual),
+        }
 
     # ------------------------------------------------------------------
-    # MÉTODO 1: Conciliación por POS Order (SOLO sesión cerrada)
+    # APOYO: estado incremental (reintentos y sesiones despertadas)
     # ------------------------------------------------------------------
 
-    def _reconcile_by_pos_order(self, invoice):
-        PosOrder = self.env["pos.order"]
+    @api.model
+    def _lms_wake_closed_sessions(self):
+        """
+        Despierta (vence ya) las facturas en espera de las sesiones
+        cerradas que aún no se despertaron. Solo sesiones cuya
+        conciliación de cierre ya corrió: lo que quede de ellas son
+        rezagadas. Por sesión (id + estado), no por fecha de cierre:
+        un cierre que termina tarde no se queda atrás.
+        """
 
-        pos_orders = PosOrder.search(
+        sessions = self.env["pos.session"].sudo().search(
             [
-                ("name", "=", invoice.invoice_origin),
-                ("state", "in", ("paid", "done")),
-                ("company_id", "=", invoice.company_id.id),
+                ("state", "=", "closed"),
+                ("lms_reconcile_pending", "=", False),
+                ("lms_reconcile_woken", "=", False),
             ],
-            limit=2,
+            order="id",
+            limit=RECONCILE_WAKE_SESSIONS,
+        )
+        if not sessions:
+            return 0
+
+        self._lms_wake_session_invoices(sessions.ids)
+        sessions.write({"lms_reconcile_woken": True})
+
+        return len(sessions)
+
+    @api.model
+    def _lms_wake_session_invoices(self, session_ids):
+        """Facturas en espera o reintento de esas sesiones → vencen ahora."""
+
+        self.flush_model(["lms_reconcile_state", "lms_reconcile_next_try"])
+        self.env.cr.execute(
+            """
+            UPDATE account_move m
+               SET lms_reconcile_next_try = %s,
+                   lms_reconcile_state = CASE
+                        WHEN m.lms_reconcile_state = 'waiting' THEN 'pending'
+                        ELSE m.lms_reconcile_state
+                   END
+              FROM pos_order o
+             WHERE o.account_move = m.id
+               AND o.session_id IN %s
+               AND m.lms_reconcile_state IN ('waiting', 'retry')
+            """,
+            (fields.Datetime.now(), tuple(session_ids)),
         )
+        self.invalidate_model(["lms_reconcile_state", "lms_reconcile_next_try"])
 
-        if not pos_orders or len(pos_orders) != 1:
-            return False
+    @api.model
+    def _lms_wake_late_invoices(self):
+        """
+        Facturas que siguen en espera aunque su sesión ya cerró y su
+        conciliación de cierre ya corrió (la cola las facturó tarde):
+        nadie más las despierta → pendientes para esta vuelta.
+        """
 
-        pos_order = pos_orders[0]
+        self.flush_model(["lms_reconcile_state", "lms_reconcile_next_try"])
+        self.env["pos.session"].flush_model(["state", "lms_reconcile_pending"])
+        self.env.cr.execute(
+            """
+            UPDATE account_move m
+               SET lms_reconcile_state = 'pending',
+                   lms_reconcile_next_try = %s
+              FROM pos_order o
+              JOIN pos_session s ON s.id = o.session_id
+             WHERE o.account_move = m.id
+               AND m.lms_reconcile_state = 'waiting'
+               AND s.state = 'closed'
+               AND NOT COALESCE(s.lms_reconcile_pending, FALSE)
+            """,
+            (fields.Datetime.now(),),
+        )
+        woken = self.env.cr.rowcount
+        self.invalidate_model(["lms_reconcile_state", "lms_reconcile_next_try"])
 
-        # 🔒 SOLO conciliar si la sesión está cerrada
-        if pos_order.session_id.state != "closed":
+        if woken:
             _logger.info(
-                "[POS NCF CRON] Sesión abierta (%s). No se concilia factura %s",
-                pos_order.session_id.name,
-                invoice.name,
+                "[POS NCF CRON] Facturas rezagadas tras el cierre despertadas: %s",
+                woken,
             )
-            return False
-
-        # Validación de montos
-        if abs(pos_order.amount_total - invoice.amount_total) > 0.01:
-            _logger.warning(
-                "[POS NCF CRON] Diferencia de monto POS vs Factura. POS %s | Factura %s",
-                pos_order.amount_total,
-                invoice.amount_total,
-            )
-            return False
-
-        # Obtener asiento contable del POS (Community)
-        pos_move = pos_order.account_move
-        if not pos_move:
-            _logger.warning(
-                "[POS NCF CRON] POS Order %s no tiene asiento contable aún",
-                pos_order.name,
-            )
-            return False
 
-        # Línea receivable factura
-        invoice_line = invoice.line_ids.filtered(
-            lambda l: l.account_id.account_type == "asset_receivable" and not l.reconciled
-        )
+        return woken
 
-        if not invoice_line:
-            return False
+    @api.model
+    def _lms_mark_reconcile_result(self, invoices, done, reasons):
+        """
+        Guarda el resultado de la vuelta con un UPDATE por bloque:
+        conciliadas → done; el resto → retry con backoff y motivo.
+        """
 
-        # Línea receivable del asiento POS
-        pos_receivable_lines = pos_move.line_ids.filtered(
-            lambda l: l.account_id.account_type == "asset_receivable" and not l.reconciled
-        )
+        now = fields.Datetime.now()
+        rows = []
+        for invoice in invoices:
+            attempts = invoice.lms_reconcile_attempts + 1
+            if invoice in done:
+                rows.append((invoice.id, "done", None, None, attempts))
+                continue
+            delay = min(RECONCILE_RETRY_BASE * 2 ** (attempts - 1), RECONCILE_RETRY_MAX)
+            rows.append((
+                invoice.id,
+                "retry",
+                reasons.get(invoice.id, "no_payment"),
+                now + delay,
+                attempts,
+            ))
+
+        for start in range(0, len(rows), 1000):
+            chunk = rows[start:start + 1000]
+            self.env.cr.execute(
+                """
+                UPDATE account_move m
+                   SET lms_reconcile_state = v.state,
+                       lms_reconcile_reason = v.reason,
+                       lms_reconcile_next_try = v.next_try,
+                       lms_reconcile_attempts = v.attempts
+                  FROM (VALUES %s) AS v(id, state, reason, next_try, attempts)
+                 WHERE m.id = v.id
+                """ % ", ".join(["(%s, %s, %s, %s::timestamp, %s)"] * len(chunk)),
+                [value for row in chunk for value in row],
+            )
 
-        if not pos_receivable_lines:
-            _logger.warning(
-                "[POS NCF CRON] No hay línea receivable en asiento POS %s",
-                pos_move.name,
+        invoices.invalidate_recordset([
+            "lms_reconcile_state",
+            "lms_reconcile_reason",
+            "lms_reconcile_next_try",
+            "lms_reconcile_attempts",
+        ])
+
+        if reasons:
+            counts = defaultdict(int)
+            for invoice in invoices - done:
+                counts[reasons.get(invoice.id, "no_payment")] += 1
+            _logger.info(
+                "[POS NCF CRON] Sin conciliar por motivo: %s",
+                ", ".join("%s=%s" % item for item in sorted(counts.items())),
             )
-            return False
 
-        (invoice_line + pos_receivable_lines).reconcile()
+    # ------------------------------------------------------------------
+    # APOYO: líneas por cobrar abiertas, agrupadas por asiento
+    # ------------------------------------------------------------------
 
-        _logger.info(
-            "[POS NCF CRON] Factura %s conciliada tras cierre de sesión %s",
-            invoice.name,
-            pos_order.session_id.name,
-        )
+    @api.model
+    def _lms_open_receivable_lines(self, move_ids):
+        lines = self.env["account.move.line"].search([
+            ("move_id", "in", list(move_ids)),
+            ("account_id.account_type", "=", "asset_receivable"),
+            ("reconciled", "=", False),
+        ])
+        grouped = defaultdict(lambda: self.env["account.move.line"])
+        for line in lines:
+            grouped[line.move_id.id] |= line
+        return grouped
+
+    @api.model
+    def _lms_reconcile_grouped(self, groups, label, reasons=None):
+        """
+        Concilia grupos (facturas, líneas factura, contrapartida) en
+        bloques de RECONCILE_CHUNK_SIZE facturas, con savepoint por
+        bloque: uno que falla no tumba el resto. Devuelve lo conciliado
+        POR COMPLETO: una factura que queda con saldo (contrapartida
+        corta) vuelve a reintento como `amount_mismatch`.
+        """
 
-        return True
+        if reasons is None:
+            reasons = {}
+
+        done = self.browse()
+
+        for invoices, invoice_lines, counterpart_lines in groups:
+            for start in range(0, len(invoices), RECONCILE_CHUNK_SIZE):
+                chunk = invoices[start:start + RECONCILE_CHUNK_SIZE]
+
+                counterpart = counterpart_lines.filtered(lambda l: not l.reconciled)
+                if not counterpart:
+                    # Contrapartida agotada: el resto del grupo no tiene con qué
+                    reasons.update(dict.fromkeys(invoices[start:].ids, "no_receivable"))
+                    break
+
+                lines = invoice_lines.filtered(lambda l: l.move_id in chunk)
+                try:
+                    with self.env.cr.savepoint():
+                        (lines + counterpart).reconcile()
+                    chunk.invalidate_recordset(["amount_residual", "payment_state"])
+                    settled = chunk.filtered(
+                        lambda i: i.payment_state in ("paid", "in_payment")
+                        or i.currency_id.is_zero(i.amount_residual)
+                    )
+                    reasons.update(dict.fromkeys((chunk - settled).ids, "amount_mismatch"))
+                    done |= settled
+                except Exception as e:
+                    reasons.update(dict.fromkeys(chunk.ids, "error"))
+                    _logger.exception(
+                        "[POS NCF CRON] Error conciliando (%s) facturas %s: %s",
+                        label,
+                        chunk.mapped("name"),
+                        e,
+                    )
+
+        return done
 
     # ------------------------------------------------------------------
-    # MÉTODO 2: Conciliación manual por NCF en texto (REGEX)
+    # MÉTODO 1: Conciliación por POS Order (SOLO sesión cerrada)
     # ------------------------------------------------------------------
 
-    def _reconcile_by_manual_ncf(self, invoice):
-        Payment = self.env["account.move"]
+    @api.model
+    def _lms_reconcile_by_pos_orders(self, invoices, reasons=None):
 
-        ncf_invoice = invoice.ncf_number
-        if not ncf_invoice:
-            return False
+        if reasons is None:
+            reasons = {}
 
-        payments = Payment.search(
+        # 🔹 Órdenes POS de todo el lote en una sola lectura
+        orders = self.env["pos.order"].search_read(
             [
-                ("move_type", "=", "out_payment"),
-                ("state", "=", "posted"),
-                ("company_id", "=", invoice.company_id.id),
-                ("line_ids.reconciled", "=", False),
-                "|",
-                ("ref", "!=", False),
-                ("narration", "!=", False),
+                ("name", "in", list(set(invoices.mapped("invoice_origin")))),
+                ("state", "in", ("paid", "done")),
+                ("company_id", "in", invoices.company_id.ids),
             ],
-            limit=20,
+            ["name", "company_id", "amount_total", "session_id"],
         )
 
-        for payment in payments:
-            text = " ".join(filter(None, [payment.ref, payment.narration]))
+        orders_by_key = defaultdict(list)
+        for order in orders:
+            orders_by_key[(order["name"], order["company_id"][0])].append(order)
 
-            match = re.search(r"(B\d{2}\d{8,})", text)
-            if not match:
+        sessions = {
+            s["id"]: s
+            for s in self.env["pos.session"].browse(
+                list({o["session_id"][0] for o in orders if o["session_id"]})
+            ).read(["name", "state", "move_id"])
+        }
+
+        # 🔹 Emparejar en memoria: origen + compañía, sesión cerrada, monto
+        matches = []
+        for invoice in invoices:
+            candidates = orders_by_key.get((invoice.invoice_origin, invoice.company_id.id), [])
+            if len(candidates) != 1:
+                reasons[invoice.id] = "ambiguous_order" if candidates else "no_order"
                 continue
 
-            ncf_found = match.group(1)
+            order = candidates[0]
+            session = sessions.get(order["session_id"] and order["session_id"][0])
 
-            if ncf_found != ncf_invoice:
+            # 🔒 SOLO conciliar si la sesión está cerrada
+            if not session or session["state"] != "closed":
+                reasons[invoice.id] = "session_open"
                 continue
 
-            pay_line = payment.line_ids.filtered(
-                lambda l: l.account_id.account_type == "asset_receivable" and not l.reconciled
-            )
+            if abs(order["amount_total"] - invoice.amount_total) > 0.01:
+                _logger.warning(
+                    "[POS NCF CRON] Diferencia de monto POS vs Factura. POS %s | Factura %s",
+                    order["amount_total"],
+                    invoice.amount_total,
+                )
+                reasons[invoice.id] = "amount_mismatch"
+                continue
 
-            inv_line = invoice.line_ids.filtered(
-                lambda l: l.account_id.account_type == "asset_receivable" and not l.reconciled
+            if not session["move_id"]:
+                _logger.warning(
+                    "[POS NCF CRON] Sesión %s no tiene asiento contable aún",
+                    session["name"],
+                )
+                reasons[invoice.id] = "no_session_move"
+                continue
+
+            matches.append((invoice, session["move_id"][0]))
+
+        if not matches:
+            return self.browse()
+
+        # 🔹 Líneas por cobrar de facturas y asientos POS en una consulta
+        receivables = self._lms_open_receivable_lines(
+            {invoice.id for invoice, _ in matches} | {move_id for _, move_id in matches}
+        )
+
+        # 🔹 Un grupo por asiento de sesión: todas sus facturas juntas
+        by_session_move = defaultdict(lambda: self.browse())
+        for invoice, pos_move_id in matches:
+            if receivables.get(invoice.id) and receivables.get(pos_move_id):
+                by_session_move[pos_move_id] |= invoice
+            else:
+                reasons[invoice.id] = "no_receivable"
+
+        groups = []
+        for pos_move_id, session_invoices in by_session_move.items():
+            invoice_lines = self.env["account.move.line"].concat(
+                *(receivables[invoice.id] for invoice in session_invoices)
             )
+            groups.append((session_invoices, invoice_lines, receivables[pos_move_id]))
+
+        return self._lms_reconcile_grouped(groups, "POS", reasons)
+
+    # ------------------------------------------------------------------
+    # MÉTODO 2: Conciliación manual por NCF (índice lms.payment.ncf)
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _lms_reconcile_by_manual_ncf(self, invoices, reasons=None):
+
+        if reasons is None:
+            reasons = {}
+
+        invoices = invoices.filtered("ncf_number")
+        if not invoices:
+            return self.browse()
+
+        # 🔹 Join directo por NCF contra el índice de pagos
+        refs = self.env["lms.payment.ncf"].sudo().search([
+            ("ncf_number", "in", invoices.mapped("ncf_number")),
+            ("company_id", "in", invoices.company_id.ids),
+            ("move_id.state", "=", "posted"),
+        ])
+        if not refs:
+            return self.browse()
+
+        invoice_by_ncf = {
+            (invoice.ncf_number, invoice.company_id.id): invoice
+            for invoice in invoices
+        }
+        payments = refs.move_id.with_env(self.env)
+
+        receivables = self._lms_open_receivable_lines(
+            set(invoices.ids) | set(payments.ids)
+        )
 
-            if not pay_line or not inv_line:
+        # 🔹 Un pago puede cubrir varios NCF → todas sus facturas juntas
+        invoices_by_payment = defaultdict(lambda: self.browse())
+        for ref in refs:
+            invoice = invoice_by_ncf.get((ref.ncf_number, ref.company_id.id))
+            if invoice and receivables.get(invoice.id):
+                invoices_by_payment[ref.move_id.id] |= invoice
+
+        groups = []
+        used = set()
+        for payment_id, payment_invoices in invoices_by_payment.items():
+            pay_line = receivables.get(payment_id)
+            payment_invoices = payment_invoices.filtered(lambda i: i.id not in used)
+            if not pay_line or not payment_invoices:
                 continue
 
-            if abs(payment.amount_total - invoice.amount_residual) > 0.01:
+            paid = abs(sum(pay_line.mapped("amount_residual")))
+            due = sum(payment_invoices.mapped("amount_residual"))
+
+            if abs(paid - due) > 0.01:
                 _logger.warning(
                     "[POS NCF CRON] Monto no coincide para NCF %s. Pago %s | Residual %s",
-                    ncf_invoice,
-                    payment.amount_total,
-                    invoice.amount_residual,
+                    ", ".join(payment_invoices.mapped("ncf_number")),
+                    paid,
+                    due,
                 )
+                for invoice in payment_invoices:
+                    reasons.setdefault(invoice.id, "amount_mismatch")
                 continue
 
-            (pay_line + inv_line).reconcile()
-
-            _logger.info(
-                "[POS NCF CRON] Factura %s conciliada por pago manual NCF %s",
-                invoice.name,
-                ncf_invoice,
+            used.update(payment_invoices.ids)
+            invoice_lines = self.env["account.move.line"].concat(
+                *(receivables[invoice.id] for invoice in payment_invoices)
             )
+            groups.append((payment_invoices, invoice_lines, pay_line))
 
-            return True
-
-        return False
+        return self._lms_reconcile_grouped(groups, "NCF manual", reasons)
@@ -1,13 +1,33 @@
 # -*- coding: utf-8 -*-
-from odoo import models
+from odoo import models, fields, api
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
+# Conciliación al cierre en segundo plano (ir.config_parameter).
+# Por defecto "1" (CRON); "0" concilia en el cierre, para
+# instalaciones sin un runner de CRON fiable.
+SESSION_CLOSE_ASYNC_PARAM = "lms_pos_fiscal_print.session_close_async_reconcile"
+SESSION_RECONCILE_BATCH = 20
+
 
 class PosSession(models.Model):
     _inherit = "pos.session"
 
+    lms_reconcile_pending = fields.Boolean(
+        default=False,
+        copy=False,
+        index=True,
+        help="Conciliación de facturas POS pendiente tras el cierre (segundo plano).",
+    )
+    lms_reconcile_woken = fields.Boolean(
+        default=False,
+        copy=False,
+        index=True,
+        help="El CRON barredor ya despertó las facturas en espera de la sesión.",
+    )
+
     def action_pos_session_close(
         self,
         balancing_account=False,
@@ -21,72 +41,180 @@ class PosSession(models.Model):
             bank_payment_method_diffs,
         )
 
-        for session in self:
+        closed = self.filtered(lambda s: s.state == "closed")
 
-            pos_move = session.move_id
-            if not pos_move:
-                continue
+        # 🔹 Devolver NCF reservados y no usados por la sesión
+        self.env["lms.ncf.block"].sudo()._lms_release_session_blocks(closed)
 
-            # 🔹 Buscar cliente consumidor final
-            partner = self.env["res.partner"].search(
-                [
-                    ("name", "=", "Cliente Consumidor Final"),
-                    ("company_id", "in", [False, session.company_id.id]),
-                ],
-                limit=1,
-            )
+        if not closed:
+            return res
+
+        async_close = self.env["ir.config_parameter"].sudo().get_param(
+            SESSION_CLOSE_ASYNC_PARAM, "1"
+        )
 
+        if async_close.strip().lower() in ("0", "false", ""):
+            # 🔹 Síncrono: se concilia aquí; si falla, queda para el CRON
+            try:
+                with self.env.cr.savepoint():
+                    closed._lms_reconcile_closed_sessions()
+                closed.write({"lms_reconcile_woken": False})
+                return res
+            except Exception as e:
+                _logger.exception(
+                    "[POS NCF CRON] Conciliación al cierre falló (%s), queda en segundo plano: %s",
+                    ", ".join(closed.mapped("name")),
+                    e,
+                )
+
+        # ⏩ El cajero no espera: las facturas de ESTA sesión se concilian
+        # en segundo plano (CRON disparado al cerrar)
+        closed.write({
+            "lms_reconcile_pending": True,
+            "lms_reconcile_woken": False,
+        })
+        self.env.ref(
+            "lms_pos_fiscal_print.ir_cron_lms_pos_session_reconcile"
+        )._trigger()
+
+        return res
+
+    def _lms_reconcile_closed_sessions(self):
+        """
+        Conciliación por lotes de las facturas POS de estas sesiones
+        contra el asiento de cada una (sin revisar estados de sesión:
+        solo se llama con sesiones cerradas):
+        - un solo `write` de partner en las líneas CxC sin cliente
+        - facturas tomadas de las órdenes de las sesiones
+        - un `reconcile()` agrupado por sesión
+        - resultado por factura (conciliada / reintento con motivo)
+        """
+
+        AccountMove = self.env["account.move"].sudo()
+        MoveLine = self.env["account.move.line"].sudo()
+
+        sessions = self.filtered("move_id")
+        if not sessions:
+            return True
+
+        # 🔹 Cliente consumidor final por compañía (resolver en caché)
+        partners = {
+            company.id: company._lms_consumidor_final()
+            for company in sessions.company_id
+        }
+
+        # 🔹 Forzar partner en líneas CxC sin cliente (un write por compañía)
+        for company_id, partner in partners.items():
             if not partner:
                 continue
-
-            # 🔹 Forzar partner en líneas CxC del asiento POS
-            receivable_lines = pos_move.line_ids.filtered(
-                lambda l: l.account_id.account_type == "asset_receivable"
+            lines = MoveLine.search([
+                ("move_id", "in", sessions.filtered(
+                    lambda s: s.company_id.id == company_id
+                ).move_id.ids),
+                ("account_id.account_type", "=", "asset_receivable"),
+                ("partner_id", "=", False),
+            ])
+            if lines:
+                lines.write({"partner_id": partner.id})
+
+        sessions = sessions.filtered(lambda s: partners.get(s.company_id.id))
+
+        # 🔹 Exactamente las facturas de estas sesiones (una lectura)
+        invoice_session = {
+            order["account_move"][0]: order["session_id"][0]
+            for order in self.env["pos.order"].sudo().search_read(
+                [
+                    ("session_id", "in", sessions.ids),
+                    ("account_move", "!=", False),
+                ],
+                ["session_id", "account_move"],
             )
+        }
+        invoices = AccountMove.browse(list(invoice_session)).filtered(
+            lambda i: i.move_type == "out_invoice"
+            and i.state == "posted"
+            and i.lms_reconcile_state != "done"
+        )
+        if not invoices:
+            return True
 
-            for line in receivable_lines:
-                if not line.partner_id:
-                    line.write({"partner_id": partner.id})
+        unpaid = invoices.filtered(lambda i: i.payment_state in ("not_paid", "partial"))
 
-            # 🔹 Ahora sí intentar conciliación
-            invoices = self.env["account.move"].search(
-                [
-                    ("move_type", "=", "out_invoice"),
-                    ("state", "=", "posted"),
-                    ("payment_state", "!=", "paid"),
-                    ("invoice_origin", "in", session.order_ids.mapped("name")),
-                    ("company_id", "=", session.company_id.id),
-                ]
+        receivables = AccountMove._lms_open_receivable_lines(
+            set(unpaid.ids) | set(sessions.move_id.ids)
+        )
+
+        reasons = {}
+        groups = []
+        for session in sessions:
+            session_invoices = unpaid.filtered(
+                lambda i: invoice_session[i.id] == session.id
             )
+            pos_lines = receivables.get(session.move_id.id)
+            ready = session_invoices.filtered(lambda i: receivables.get(i.id))
+            reasons.update(dict.fromkeys((session_invoices - ready).ids, "no_receivable"))
+            if not ready or not pos_lines:
+                reasons.update(dict.fromkeys(ready.ids, "no_receivable"))
+                continue
 
-            for invoice in invoices:
+            invoice_lines = MoveLine.concat(
+                *(receivables[invoice.id] for invoice in ready)
+            )
+            groups.append((ready, invoice_lines, pos_lines))
 
-                invoice_line = invoice.line_ids.filtered(
-                    lambda l: l.account_id.account_type == "asset_receivable"
-                    and not l.reconciled
-                )
+        reconciled = AccountMove._lms_reconcile_grouped(groups, "cierre de sesión", reasons)
 
-                pos_line = pos_move.line_ids.filtered(
-                    lambda l: l.account_id.account_type == "asset_receivable"
-                    and not l.reconciled
-                )
+        # Ya pagadas por otra vía también quedan cerradas
+        AccountMove._lms_mark_reconcile_result(
+            invoices, reconciled | (invoices - unpaid), reasons
+        )
 
-                if not invoice_line or not pos_line:
-                    continue
+        _logger.info(
+            "Cierre de sesión %s: %s de %s facturas conciliadas automáticamente",
+            ", ".join(sessions.mapped("name")),
+            len(reconciled),
+            len(invoices),
+        )
 
-                try:
-                    (invoice_line + pos_line).reconcile()
+        return True
 
-                    _logger.info(
-                        "Factura %s conciliada automáticamente",
-                        invoice.name,
-                    )
+    @api.model
+    def _cron_lms_reconcile_closed_sessions(self):
+        """CRON (disparado al cerrar): conciliación diferida de sesiones."""
 
-                except Exception as e:
-                    _logger.exception(
-                        "Error conciliando factura %s: %s",
-                        invoice.name,
-                        e,
-                    )
+        sessions = self.sudo().search(
+            [("lms_reconcile_pending", "=", True)],
+            # Las que fallaron se tocan al fallar → van al final de la cola
+            order="write_date, id",
+            limit=SESSION_RECONCILE_BATCH,
+        )
 
-        return res
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+
+        failed = self.browse()
+        for session in sessions:
+            # 🔒 Una sesión que falla no tumba las demás: queda marcada
+            # y se reintenta en la próxima vuelta
+            try:
+                with self.env.cr.savepoint():
+                    session.with_company(session.company_id)._lms_reconcile_closed_sessions()
+                    session.lms_reconcile_pending = False
+            except Exception as e:
+                failed |= session
+                _logger.exception(
+                    "[POS NCF CRON] Error conciliando cierre de sesión %s: %s",
+                    session.name,
+                    e,
+                )
+                # Sigue pendiente; al final de la cola para no bloquear
+                session.write({"lms_reconcile_pending": True})
+            if auto_commit:
+                self.env.cr.commit()
+
+        # Solo re-disparar si quedó trabajo nuevo (no las que fallan)
+        if len(sessions) == SESSION_RECONCILE_BATCH and failed != sessions:
+            self.env.ref(
+                "lms_pos_fiscal_print.ir_cron_lms_pos_session_reconcile"
+            )._trigger()
+
+        return True
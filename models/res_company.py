@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools
+
+CONSUMIDOR_FINAL_XMLID = "lms_pos_fiscal_print.partner_consumidor_final"
+
+
+class ResCompany(models.Model):
+    _inherit = "res.company"
+
+    lms_consumidor_final_partner_id = fields.Many2one(
+        "res.partner",
+        string="Cliente consumidor final (POS)",
+        help="Cliente de las ventas POS sin cliente. Vacío: el del módulo.",
+    )
+
+    @api.model
+    @tools.ormcache("company_id", "override_id")
+    def _lms_consumidor_final_id(self, company_id, override_id):
+        # El override va en la clave: cambiarlo no obliga a vaciar
+        # el ormcache del registro (una entrada nueva, la vieja expira)
+        if override_id:
+            return override_id
+        partner = self.env.ref(CONSUMIDOR_FINAL_XMLID, raise_if_not_found=False)
+        return partner.id if partner else False
+
+    def _lms_consumidor_final(self):
+        """Cliente consumidor final de la compañía (sin tocar res_partner)."""
+        self.ensure_one()
+        override = self.sudo().lms_consumidor_final_partner_id
+        return self.env["res.partner"].browse(
+            self._lms_consumidor_final_id(self.id, override.id)
+        )
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark del circuito fiscal POS: facturación, impresión y conciliación.
+
+Por cada tamaño N siembra una compañía sintética (plan contable, rangos
+NCF, caja POS) con N órdenes pagadas de M líneas y mide:
+
+- ``invoice``         `_lms_create_fiscal_invoice_from_pos` por bloques
+- ``print_claim``     reclamar + payload + ESC/POS + ack (claim_fiscal_print_jobs)
+- ``payload``         serialización de una factura (fiscal_invoice_by_reference)
+- ``ncf_availability`` / ``ncf_quota`` / ``trigger``  servicios de los controllers
+- ``session_close``   `action_pos_session_close`
+- ``session_reconcile`` conciliación de las facturas de la sesión cerrada
+- ``reconcile``       `_cron_reconcile_pos_ncf_invoices` (barredor)
+
+Cada etapa reporta tiempo total, consultas SQL, órdenes/s y p50/p99 por
+llamada en un JSON comparable entre corridas (`compare`). Los controllers
+se miden por su servicio en proceso (sin la capa HTTP).
+
+Todo corre dentro de un SAVEPOINT que se revierte: la base queda intacta.
+
+Uso (odoo shell)::
+
+    LMS_BENCH_SIZES=100,1000 LMS_BENCH_LINES=5 LMS_BENCH_OUTPUT=/tmp/bench.json \\
+        odoo shell -d <db> < scripts/bench_fiscal.py
+
+    >>> import sys; sys.path.insert(0, "scripts"); import bench_fiscal
+    >>> bench_fiscal.run(env, sizes=(100, 1000), lines=5)
+    >>> bench_fiscal.compare("/tmp/antes.json", "/tmp/despues.json")
+
+Escalado de la cola de facturación con 1, 2 y 4 workers (HACE COMMIT,
+solo en una base desechable)::
+
+    LMS_BENCH_WORKERS=1,2,4 LMS_BENCH_SIZES=4000 \\
+        odoo shell -d <db_desechable> --max-cron-threads=0 < scripts/bench_fiscal.py
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from odoo import fields
+
+DEFAULT_SIZES = (100, 1000)
+DEFAULT_LINES = 5
+INVOICE_CHUNK = 50
+SERVICE_CALLS = 50
+PRINT_CLAIM_SIZE = 10
+
+# Umbral de regresión para `compare` (20% más lento / más consultas)
+REGRESSION_TOLERANCE = 0.20
+
+
+# =========================================================
+# MEDICIÓN
+# =========================================================
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Stage:
+    """Acumula tiempo, consultas y latencia por llamada de una etapa."""
+
+    def __init__(self, env):
+        self.env = env
+        self.wall = 0.0
+        self.queries = 0
+        self.latencies = []
+
+    @contextmanager
+    def call(self):
+        cr = self.env.cr
+        queries = cr.sql_log_count
+        started = time.perf_counter()
+        yield
+        self.env.flush_all()
+        elapsed = time.perf_counter() - started
+        self.wall += elapsed
+        self.queries += cr.sql_log_count - queries
+        self.latencies.append(elapsed)
+
+    def result(self, orders=None):
+        latencies = sorted(self.latencies)
+        result = {
+            "calls": len(latencies),
+            "wall_s": round(self.wall, 4),
+            "queries": self.queries,
+            "latency_ms_p50": round(percentile(latencies, 50) * 1000, 2),
+            "latency_ms_p99": round(percentile(latencies, 99) * 1000, 2),
+        }
+        if orders:
+            result["orders_per_s"] = round(orders / self.wall, 1) if self.wall else 0.0
+            result["queries_per_order"] = round(self.queries / orders, 2)
+        return result
+
+
+# =========================================================
+# SIEMBRA
+# =========================================================
+def _range_vals(env, company, ncf_type, size):
+    """Valores de `l10n_do.ncf.range` con la secuencia que usa lms.ncf.block."""
+
+    from odoo.addons.lms_pos_fiscal_print.models import ncf_block
+
+    return {
+        "company_id": company.id,
+        "ncf_type": ncf_type,
+        "active": True,
+        ncf_block.RANGE_COUNTER_FIELD: 1,
+        ncf_block.RANGE_END_FIELD: size * 2,
+        "date_end": fields.Date.today() + timedelta(days=365),
+    }
+
+
+def seed(env, size, lines, configs=1):
+    """
+    Compañía sintética con `configs` cajas POS abiertas y `size` órdenes
+    pagadas repartidas entre ellas. Devuelve la sesión de la primera caja.
+    """
+
+    stamp = "%s-%s" % (size, int(time.time() * 1000))
+    company = env["res.company"].create({
+        "name": "LMS Bench %s" % stamp,
+        "currency_id": env.ref("base.DOP").id,
+    })
+    env["account.chart.template"].try_loading("generic_coa", company, install_demo=False)
+    env = env(context=dict(env.context, allowed_company_ids=[company.id]))
+
+    for ncf_type in ("01", "02"):
+        env["l10n_do.ncf.range"].sudo().create(_range_vals(env, company, ncf_type, size))
+
+    bank_journal = env["account.journal"].create({
+        "name": "Banco Bench",
+        "code": "LBBK",
+        "type": "bank",
+        "company_id": company.id,
+    })
+    pos_journal = env["account.journal"].create({
+        "name": "POS Bench",
+        "code": "LBPS",
+        "type": "general",
+        "company_id": company.id,
+    })
+    payment_method = env["pos.payment.method"].create({
+        "name": "Tarjeta Bench",
+        "journal_id": bank_journal.id,
+        "company_id": company.id,
+    })
+    sessions = env["pos.session"]
+    for number in range(configs):
+        config = env["pos.config"].create({
+            "name": "Caja Bench %s/%s" % (stamp, number + 1),
+            "company_id": company.id,
+            "journal_id": pos_journal.id,
+            "payment_method_ids": [(6, 0, payment_method.ids)],
+        })
+        session = env["pos.session"].create({
+            "config_id": config.id,
+            "user_id": env.uid,
+        })
+        session.action_pos_session_open()
+        sessions |= session
+
+    product = env["product.product"].create({
+        "name": "Artículo Bench",
+        "list_price": 100.0,
+        "available_in_pos": True,
+        "taxes_id": [(5, 0, 0)],
+        "company_id": company.id,
+    })
+    customer = env["res.partner"].create({
+        "name": "Cliente Bench RNC",
+        "vat": "101000001",
+        "company_id": company.id,
+    })
+
+    total = 100.0 * lines
+    vals_list = []
+    for number in range(size):
+        vals_list.append({
+            "session_id": sessions[number % configs].id,
+            "company_id": company.id,
+            "partner_id": customer.id if number % 5 == 0 else False,
+            "pos_reference": "Orden BENCH-%s-%06d" % (stamp, number),
+            "state": "paid",
+            "amount_tax": 0.0,
+            "amount_total": total,
+            "amount_paid": total,
+            "amount_return": 0.0,
+            "lines": [
+                (0, 0, {
+                    "product_id": product.id,
+                    "qty": 1,
+                    "price_unit": 100.0,
+                    "price_subtotal": 100.0,
+                    "price_subtotal_incl": 100.0,
+                })
+                for _line in range(lines)
+            ],
+            "payment_ids": [
+                (0, 0, {
+                    "payment_method_id": payment_method.id,
+                    "amount": total,
+                    "payment_date": fields.Datetime.now(),
+                })
+            ],
+        })
+    orders = env["pos.order"].create(vals_list)
+    env.flush_all()
+
+    return env, company, sessions[0], orders
+
+
+# =========================================================
+# ETAPAS
+# =========================================================
+def bench_size(env, size, lines):
+    env, company, session, orders = seed(env, size, lines)
+    stages = {}
+    rng = random.Random(size)
+
+    # 🔹 Facturación (camino del controller/cola, por bloques)
+    stage = Stage(env)
+    for start in range(0, len(orders), INVOICE_CHUNK):
+        with stage.call():
+            orders[start:start + INVOICE_CHUNK]._lms_create_fiscal_invoice_from_pos(
+                commit_chunk=INVOICE_CHUNK
+            )
+    stages["invoice"] = stage.result(orders=len(orders))
+
+    invoices = orders.account_move
+
+    # 🔹 Cola de impresión: reclamar + payload + ESC/POS + ack
+    Job = env["lms.fiscal.print.job"].sudo()
+    stage = Stage(env)
+    printed = 0
+    while True:
+        with stage.call():
+            jobs, token = Job._lms_claim(session.config_id.id, limit=PRINT_CLAIM_SIZE)
+            if jobs:
+                env["lms.fiscal.invoice.payload"].sudo()._lms_get_payloads(jobs.invoice_id)
+                env["account.move"].sudo()._lms_read_receipts(jobs.invoice_id.ids)
+                jobs._lms_ack(token)
+        if not jobs:
+            stage.latencies.pop()
+            break
+        printed += len(jobs)
+    stages["print_claim"] = stage.result(orders=printed)
+
+    # 🔹 Servicios de los controllers (llamada a llamada)
+    Payload = env["lms.fiscal.invoice.payload"].sudo()
+    stage = Stage(env)
+    for invoice in invoices.browse(rng.sample(invoices.ids, min(SERVICE_CALLS, len(invoices)))):
+        invoice.invalidate_recordset()
+        with stage.call():
+            Payload._lms_serialize(invoice.ids)
+    stages["payload"] = stage.result()
+
+    from odoo.addons.lms_pos_fiscal_print.services import ncf_availability
+
+    stage = Stage(env)
+    for _call in range(SERVICE_CALLS):
+        ncf_availability.invalidate(env.cr.dbname, company.ids)
+        with stage.call():
+            env["lms.ncf.availability"].sudo()._lms_get_status(company)
+    stages["ncf_availability"] = stage.result()
+
+    Block = env["lms.ncf.block"].sudo()
+    stage = Stage(env)
+    for _call in range(SERVICE_CALLS):
+        with stage.call():
+            for ncf_type in ("01", "02"):
+                Block._lms_session_quota(session, ncf_type)
+    stages["ncf_quota"] = stage.result()
+
+    # 🔹 Disparo: encolar una orden ya facturada es un no-op idempotente
+    Queue = env["lms.pos.invoice.queue"].sudo()
+    stage = Stage(env)
+    for order in orders.browse(rng.sample(orders.ids, min(SERVICE_CALLS, len(orders)))):
+        with stage.call():
+            Queue._lms_enqueue(order)
+    stages["trigger"] = stage.result()
+
+    # 🔹 Cierre de sesión (encola la conciliación de sus facturas)
+    stage = Stage(env)
+    with stage.call():
+        session.action_pos_session_close()
+    stages["session_close"] = stage.result(orders=len(orders))
+
+    # 🔹 Conciliación de las facturas de la sesión (CRON disparado)
+    stage = Stage(env)
+    with stage.call():
+        env["pos.session"]._cron_lms_reconcile_closed_sessions()
+    stages["session_reconcile"] = stage.result(orders=len(invoices))
+
+    # 🔹 CRON barredor de conciliación
+    stage = Stage(env)
+    with stage.call():
+        counts = env["account.move"].with_company(company)._cron_reconcile_pos_ncf_invoices(
+            batch_size=len(invoices)
+        )
+    stages["reconcile"] = dict(stage.result(orders=len(invoices)), **counts)
+
+    return {"orders": size, "lines": lines, "invoices": len(invoices), "stages": stages}
+
+
+# =========================================================
+# ESCALADO: WORKERS DE LA COLA EN PARALELO
+# =========================================================
+def _drain_worker(registry, results, index):
+    """Un worker con su propio cursor, como un hilo de CRON."""
+
+    from odoo import api, SUPERUSER_ID
+
+    processed = 0
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        Queue = env["lms.pos.invoice.queue"]
+        while True:
+            done = Queue._cron_lms_drain_invoice_queue()
+            cr.commit()
+            if not done:
+                break
+            processed += done
+    results[index] = processed
+
+
+def bench_workers(env, size, lines, worker_counts=(1, 2, 4), configs=8):
+    """
+    Throughput de la cola con 1..N workers sobre `configs` particiones
+    (cajas). HACE COMMIT: cada corrida deja su compañía y sus facturas
+    en la base; usar solo en una base desechable.
+    """
+
+    results = []
+    registry = env.registry
+
+    for workers in worker_counts:
+        with registry.cursor() as cr:
+            seed_env = env(cr=cr)
+            seed_env, company, session, orders = seed(seed_env, size, lines, configs=configs)
+            seed_env["lms.pos.invoice.queue"]._lms_enqueue(orders)
+            cr.commit()
+
+        processed = [0] * workers
+        threads = [
+            threading.Thread(
+                target=_drain_worker,
+                args=(registry, processed, index),
+                name="lms-bench-worker-%s" % index,
+            )
+            for index in range(workers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        results.append({
+            "workers": workers,
+            "orders": sum(processed),
+            "wall_s": round(wall, 3),
+            "orders_per_s": round(sum(processed) / wall, 1) if wall else 0.0,
+            "per_worker": processed,
+        })
+
+    base = results[0]["orders_per_s"] or 1.0
+    print("\nCola de facturación: N=%s órdenes, %s cajas" % (size, configs))
+    print("%-8s %10s %10s %8s" % ("workers", "total (s)", "órdenes/s", "speedup"))
+    for result in results:
+        result["speedup"] = round(result["orders_per_s"] / base, 2)
+        print("%-8s %10.3f %10.1f %8.2f" % (
+            result["workers"], result["wall_s"], result["orders_per_s"], result["speedup"],
+        ))
+
+    return {"orders": size, "lines": lines, "configs": configs, "scaling": results}
+
+
+def run(env, sizes=DEFAULT_SIZES, lines=DEFAULT_LINES, output=None):
+    """Corre todos los tamaños y devuelve (y opcionalmente guarda) el informe."""
+
+    from odoo.addons.lms_pos_fiscal_print.services import invoice_payload, ncf_availability
+
+    cr = env.cr
+    thread = threading.current_thread()
+    was_testing = getattr(thread, "testing", False)
+    # Sin commits intermedios en los CRON: todo se revierte al final
+    thread.testing = True
+
+    report = {
+        "database": cr.dbname,
+        "started_at": fields.Datetime.now().isoformat(),
+        "runs": [],
+    }
+
+    try:
+        for size in sizes:
+            env.flush_all()
+            cr.execute("SAVEPOINT lms_bench")
+            try:
+                report["runs"].append(bench_size(env, size, lines))
+            finally:
+                cr.execute("ROLLBACK TO SAVEPOINT lms_bench")
+                env.invalidate_all()
+                env.registry.clear_cache()
+                with invoice_payload._cache_lock:
+                    invoice_payload._cache.clear()
+                with ncf_availability._cache_lock:
+                    ncf_availability._cache.clear()
+    finally:
+        thread.testing = was_testing
+
+    for run_ in report["runs"]:
+        print("\nN=%(orders)s órdenes × %(lines)s líneas" % run_)
+        print("%-18s %10s %9s %10s %10s %10s" % (
+            "etapa", "total (s)", "consultas", "órdenes/s", "p50 (ms)", "p99 (ms)",
+        ))
+        for name, stage in run_["stages"].items():
+            print("%-18s %10.3f %9s %10s %10.2f %10.2f" % (
+                name,
+                stage["wall_s"],
+                stage["queries"],
+                stage.get("orders_per_s", "-"),
+                stage["latency_ms_p50"],
+                stage["latency_ms_p99"],
+            ))
+
+    if output:
+        with open(output, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+    return report
+
+
+# =========================================================
+# COMPARACIÓN ENTRE CORRIDAS
+# =========================================================
+def compare(before_path, after_path, tolerance=REGRESSION_TOLERANCE):
+    """Lista las etapas que empeoran más de `tolerance` en tiempo o consultas."""
+
+    with open(before_path) as fh:
+        before = {(r["orders"], r["lines"]): r for r in json.load(fh)["runs"]}
+    with open(after_path) as fh:
+        after = {(r["orders"], r["lines"]): r for r in json.load(fh)["runs"]}
+
+    regressions = []
+    for key, run_ in after.items():
+        base = before.get(key)
+        if not base:
+            continue
+        for name, stage in run_["stages"].items():
+            old = base["stages"].get(name)
+            if not old:
+                continue
+            for metric in ("wall_s", "queries", "latency_ms_p99"):
+                if old[metric] and stage[metric] > old[metric] * (1 + tolerance):
+                    regressions.append((key[0], name, metric, old[metric], stage[metric]))
+
+    for size, name, metric, old, new in regressions:
+        print("⚠️  N=%s %s.%s: %s → %s" % (size, name, metric, old, new))
+    if not regressions:
+        print("Sin regresiones (tolerancia %d%%)" % (tolerance * 100))
+
+    return regressions
+
+
+if "env" in globals() and os.environ.get("LMS_BENCH_WORKERS"):
+    report = bench_workers(
+        env,  # noqa: F821 (odoo shell)
+        int(os.environ.get("LMS_BENCH_SIZES", "2000").split(",")[0]),
+        int(os.environ.get("LMS_BENCH_LINES", DEFAULT_LINES)),
+        worker_counts=tuple(int(w) for w in os.environ["LMS_BENCH_WORKERS"].split(",")),
+    )
+    if os.environ.get("LMS_BENCH_OUTPUT"):
+        with open(os.environ["LMS_BENCH_OUTPUT"], "w") as fh:
+            json.dump(report, fh, indent=2)
+elif "env" in globals():
+    run(
+        env,  # noqa: F821 (odoo shell)
+        sizes=tuple(
+            int(size) for size in os.environ.get(
+                "LMS_BENCH_SIZES", ",".join(map(str, DEFAULT_SIZES))
+            ).split(",")
+        ),
+        lines=int(os.environ.get("LMS_BENCH_LINES", DEFAULT_LINES)),
+        output=os.environ.get("LMS_BENCH_OUTPUT"),
+    )
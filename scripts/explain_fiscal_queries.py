@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Planes EXPLAIN de las consultas calientes del módulo, sin y con sus índices.
+
+Siembra `pos_order` y `account_move` duplicando filas existentes, ejecuta
+EXPLAIN ANALYZE sobre el SQL que genera el ORM para los dominios del CRON
+y de los controllers, y compara el plan con los índices del módulo
+eliminados ("antes") y presentes ("después").
+
+Todo ocurre dentro de un SAVEPOINT que se revierte al final: ni la siembra
+ni el DROP INDEX quedan en la base. El DROP INDEX bloquea las tablas
+mientras dura el informe: usar sobre una copia, nunca en producción.
+
+Uso (odoo shell)::
+
+    odoo shell -d <db> < scripts/explain_fiscal_queries.py
+
+    LMS_EXPLAIN_SEED=500000 LMS_EXPLAIN_OUTPUT=/tmp/explain.json \
+        odoo shell -d <db> < scripts/explain_fiscal_queries.py
+"""
+import json
+import os
+
+from odoo import fields
+from odoo.tools import SQL
+
+DEFAULT_SEED = 100000
+
+# Índices creados por `init()` de pos.order y account.move
+MODULE_INDEXES = (
+    "lms_pos_order_to_invoice_idx",
+    "lms_pos_order_user_invoiced_idx",
+    "lms_pos_order_reference_idx",
+    "lms_account_move_pending_print_idx",
+    "lms_account_move_ncf_open_idx",
+    "lms_account_move_reconcile_due_idx",
+    "lms_account_move_reconcile_waiting_idx",
+)
+
+
+# =========================================================
+# SIEMBRA
+# =========================================================
+def _columns(cr, table):
+    cr.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+         WHERE table_name = %s AND column_name != 'id'
+        """,
+        (table,),
+    )
+    return [row[0] for row in cr.fetchall()]
+
+
+def _duplicate(cr, table, template_id, count, overrides):
+    """Inserta `count` copias de una fila, sustituyendo algunas columnas."""
+
+    columns = _columns(cr, table)
+    select = [
+        overrides.get(column, '"%s"' % column)
+        for column in columns
+    ]
+    cr.execute(
+        'INSERT INTO "{table}" ({cols}) SELECT {select} FROM "{table}", '
+        "generate_series(1, %s) AS g WHERE id = %s".format(
+            table=table,
+            cols=", ".join('"%s"' % c for c in columns),
+            select=", ".join(select),
+        ),
+        (count, template_id),
+    )
+
+
+def seed(env, count=DEFAULT_SEED):
+    """
+    Duplica una orden facturada y su factura `count` veces:
+    ~2% de órdenes pendientes de facturar, ~10% de facturas por cobrar
+    y ~1% pendientes de impresión, el resto histórico ya cerrado.
+    Un tercio de los asientos no son fiscales (sin NCF ni estado de
+    conciliación, como los de contabilidad y compras reales).
+    """
+
+    cr = env.cr
+    order = env["pos.order"].sudo().search(
+        [("account_move", "!=", False)], order="id desc", limit=1
+    )
+    if not order:
+        raise ValueError("Se necesita al menos una orden POS facturada como plantilla.")
+
+    move_columns = set(_columns(cr, "account_move"))
+    move_overrides = {
+        "name": "'BENCH/' || g",
+        "move_type": "CASE WHEN g %% 3 = 0 THEN 'entry' ELSE move_type END",
+        "invoice_origin": "CASE WHEN g %% 3 = 0 THEN NULL ELSE 'BENCH/' || g END",
+        "payment_state": "CASE WHEN g %% 10 = 0 THEN 'not_paid' ELSE 'paid' END",
+        "lms_fiscal_pending_print": "g %% 100 = 0",
+    }
+    if "ncf_number" in move_columns:
+        move_overrides["ncf_number"] = (
+            "CASE WHEN g %% 3 = 0 THEN NULL ELSE 'B02' || lpad(g::text, 8, '0') END"
+        )
+    if "lms_reconcile_state" in move_columns:
+        # No fiscales: sin estado (el default real). Por cobrar: ~1%
+        # nuevas, el resto en reintento con fecha futura
+        move_overrides["lms_reconcile_state"] = (
+            "CASE WHEN g %% 3 = 0 THEN NULL "
+            "WHEN g %% 100 = 0 THEN 'pending' "
+            "WHEN g %% 10 = 0 THEN 'retry' ELSE 'done' END"
+        )
+        move_overrides["lms_reconcile_next_try"] = (
+            "CASE WHEN g %% 3 != 0 AND g %% 10 = 0 AND g %% 100 != 0 "
+            "THEN (now() AT TIME ZONE 'UTC') + interval '1 hour' END"
+        )
+    _duplicate(cr, "account_move", order.account_move.id, count, move_overrides)
+
+    order_columns = set(_columns(cr, "pos_order"))
+    order_overrides = {
+        "name": "'BENCH/' || g",
+        "pos_reference": "'Orden BENCH-' || g",
+        "date_order": "now() - g * interval '1 minute'",
+        "state": "CASE WHEN g %% 50 = 0 THEN 'paid' ELSE 'done' END",
+        "account_move": "CASE WHEN g %% 50 = 0 THEN NULL ELSE account_move END",
+    }
+    if "uuid" in order_columns:
+        order_overrides["uuid"] = "md5(random()::text || g)"
+    _duplicate(cr, "pos_order", order.id, count, order_overrides)
+
+    cr.execute("ANALYZE pos_order")
+    cr.execute("ANALYZE account_move")
+
+    return order
+
+
+# =========================================================
+# CONSULTAS (SQL generado por el ORM)
+# =========================================================
+def hot_queries(env, template):
+    """Los dominios del CRON y de los controllers, tal como los usa el módulo."""
+
+    PosOrder = env["pos.order"].sudo()
+    AccountMove = env["account.move"].sudo()
+    company_id = template.company_id.id
+
+    return {
+        "cron_invoice_pending_orders": PosOrder._search(
+            [
+                ("state", "=", "paid"),
+                ("account_move", "=", False),
+                ("company_id", "=", company_id),
+                ("amount_total", ">", 0),
+            ],
+            order="date_order asc",
+            limit=500,
+        ),
+        "last_fiscal_invoice": PosOrder._search(
+            [
+                ("user_id", "=", template.user_id.id),
+                ("account_move", "!=", False),
+            ],
+            order="id desc",
+            limit=1,
+        ),
+        "fiscal_invoice_by_reference": PosOrder._search(
+            [
+                ("pos_reference", "=", "Orden BENCH-4242"),
+                ("account_move", "!=", False),
+            ],
+            order="id desc",
+            limit=1,
+        ),
+        # Barredor de conciliación: nuevas + reintentos vencidos
+        "cron_reconcile_candidates": AccountMove._search(
+            [
+                ("move_type", "=", "out_invoice"),
+                ("state", "=", "posted"),
+                ("payment_state", "in", ("not_paid", "partial")),
+                ("invoice_origin", "!=", False),
+                ("ncf_number", "!=", False),
+                ("company_id", "=", company_id),
+                "|",
+                ("lms_reconcile_state", "=", "pending"),
+                "&",
+                ("lms_reconcile_state", "=", "retry"),
+                ("lms_reconcile_next_try", "<=", fields.Datetime.now()),
+            ],
+            order="id asc",
+            limit=5000,
+        ),
+        "pending_print": AccountMove._search(
+            [
+                ("lms_fiscal_pending_print", "=", True),
+                ("company_id", "=", company_id),
+            ],
+            order="id",
+            limit=100,
+        ),
+    }
+
+
+def _explain(cr, query):
+    cr.execute(SQL("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) %s", query.select()))
+    plan = cr.fetchone()[0][0]
+
+    nodes = []
+
+    def walk(node):
+        nodes.append(node)
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan["Plan"])
+
+    return {
+        "execution_ms": plan["Execution Time"],
+        "seq_scans": sorted({
+            n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"
+        }),
+        "indexes": sorted({n["Index Name"] for n in nodes if n.get("Index Name")}),
+        "plan": plan["Plan"],
+    }
+
+
+# =========================================================
+# INFORME
+# =========================================================
+def report(env, seed_count=DEFAULT_SEED, output=None):
+    cr = env.cr
+    env.flush_all()
+    cr.execute("SAVEPOINT lms_explain")
+    try:
+        template = seed(env, seed_count)
+        queries = hot_queries(env, template)
+
+        after = {name: _explain(cr, query) for name, query in queries.items()}
+
+        cr.execute("SAVEPOINT lms_explain_before")
+        for index in MODULE_INDEXES:
+            cr.execute(SQL("DROP INDEX IF EXISTS %s", SQL.identifier(index)))
+        before = {name: _explain(cr, query) for name, query in queries.items()}
+        cr.execute("ROLLBACK TO SAVEPOINT lms_explain_before")
+    finally:
+        cr.execute("ROLLBACK TO SAVEPOINT lms_explain")
+        env.invalidate_all()
+
+    print("Filas sembradas por tabla: %s\n" % seed_count)
+    print("%-30s %12s %12s  %s" % ("consulta", "antes (ms)", "después (ms)", "plan después"))
+    for name in queries:
+        b, a = before[name], after[name]
+        print("%-30s %12.2f %12.2f  %s" % (
+            name,
+            b["execution_ms"],
+            a["execution_ms"],
+            ", ".join(a["indexes"]) or "Seq Scan: %s" % ", ".join(a["seq_scans"]),
+        ))
+
+    result = {"seed": seed_count, "before": before, "after": after}
+    if output:
+        with open(output, "w") as fh:
+            json.dump(result, fh, indent=2, default=str)
+
+    return result
+
+
+if "env" in globals():
+    report(
+        env,  # noqa: F821 (odoo shell)
+        seed_count=int(os.environ.get("LMS_EXPLAIN_SEED", DEFAULT_SEED)),
+        output=os.environ.get("LMS_EXPLAIN_OUTPUT"),
+    )
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Exporta el 607 DGII de varias compañías y/o meses en paralelo.
+
+Cada par (compañía, período) corre en su propio hilo con su propio
+cursor y escribe ``<dir>/607_<rnc>_<YYYYMM>.<txt|csv>``. Si se corta,
+volver a lanzarlo reanuda cada archivo desde su checkpoint; los ya
+terminados no se repiten.
+
+Uso (odoo shell)::
+
+    LMS_607_PERIODS=202501,202502,202503 LMS_607_DIR=/var/tmp/607 \\
+        odoo shell -d <db> < scripts/export_dgii_607.py
+
+Variables opcionales: ``LMS_607_COMPANIES`` (ids, por defecto todas),
+``LMS_607_FORMAT`` (txt|csv), ``LMS_607_WORKERS`` (4),
+``LMS_607_CHUNK`` (tamaño de bloque).
+"""
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from odoo import api, SUPERUSER_ID
+
+DEFAULT_WORKERS = 4
+
+
+def _export_one(registry, company_id, period, directory, fmt, chunk_size):
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        company = env["res.company"].browse(company_id)
+        rnc = re.sub(r"\D", "", company.vat or "") or str(company.id)
+        path = os.path.join(directory, "607_%s_%s.%s" % (rnc, period, fmt))
+
+        options = {"fmt": fmt}
+        if chunk_size:
+            options["chunk_size"] = chunk_size
+        rows = env["lms.dgii.607.export"]._lms_export_607(company, period, path, **options)
+        return path, rows
+
+
+def export(env, periods, directory, company_ids=None, fmt="txt", workers=DEFAULT_WORKERS, chunk_size=None):
+    """Lanza un trabajo por (compañía, período) en un pool de hilos."""
+
+    os.makedirs(directory, exist_ok=True)
+    company_ids = company_ids or env["res.company"].search([]).ids
+    tasks = [(company_id, period) for company_id in company_ids for period in periods]
+
+    started = time.perf_counter()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_export_one, env.registry, company_id, period, directory, fmt, chunk_size):
+                (company_id, period)
+            for company_id, period in tasks
+        }
+        for future in as_completed(futures):
+            company_id, period = futures[future]
+            try:
+                path, rows = future.result()
+                results.append((company_id, period, path, rows))
+                print("✅ compañía %s %s: %s registros → %s" % (company_id, period, rows, path))
+            except Exception as e:
+                print("❌ compañía %s %s: %s (relanzar para reanudar)" % (company_id, period, e))
+
+    print("%s archivos en %.1fs" % (len(results), time.perf_counter() - started))
+    return results
+
+
+if "env" in globals():
+    export(
+        env,  # noqa: F821 (odoo shell)
+        periods=os.environ["LMS_607_PERIODS"].split(","),
+        directory=os.environ.get("LMS_607_DIR", "."),
+        company_ids=[
+            int(company_id)
+            for company_id in os.environ.get("LMS_607_COMPANIES", "").split(",")
+            if company_id
+        ],
+        fmt=os.environ.get("LMS_607_FORMAT", "txt"),
+        workers=int(os.environ.get("LMS_607_WORKERS", DEFAULT_WORKERS)),
+        chunk_size=int(os.environ.get("LMS_607_CHUNK", 0)) or None,
+    )
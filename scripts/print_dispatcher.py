@@ -0,0 +1,577 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio local de impresión fiscal (sustituto de http://127.0.0.1:5001).
+
+Recibe los tickets que envía `lmsFiscalQZ` (POST /print, JSON con
+`data` en base64 y `printer` opcional) y los despacha a una o varias
+impresoras térmicas con conexiones persistentes:
+
+- TCP RAW (puerto 9100) → ``caja1=tcp://192.168.1.50:9100``
+- Dispositivo/archivo    → ``caja2=file:/dev/usb/lp0``
+
+Cada impresora tiene su propia cola acotada (backpressure: si la cola
+está llena el POST espera y, pasado el tiempo límite, responde 503).
+Con ``job_id`` el envío es idempotente: reenviar el mismo trabajo no lo
+vuelve a encolar, y si la impresora tarda más de ``print_timeout`` se
+responde 202 (aceptado, pendiente): el ticket sigue en cola y se
+imprimirá una sola vez.
+Los trabajos que se acumulan detrás de una impresora lenta se envían
+juntos en una sola escritura; si esa escritura falla, el reintento va
+de a un ticket y solo con lo que la impresora no aceptó. GET /stats
+devuelve throughput y latencia por impresora.
+
+Uso::
+
+    python3 print_dispatcher.py serve --printer caja1=tcp://10.0.0.5:9100
+    python3 print_dispatcher.py fake-printer --port 9100 --delay-ms 40
+    python3 print_dispatcher.py loadtest --printers 3 --jobs 2000
+
+Solo usa la biblioteca estándar; no depende de Odoo.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
+
+_logger = logging.getLogger("lms_print_dispatcher")
+
+# Fin de ticket: corte de papel (GS V 0)
+CUT = b"\x1d\x56\x00"
+
+DEFAULT_QUEUE_SIZE = 200
+DEFAULT_MAX_BATCH = 20
+DEFAULT_ENQUEUE_TIMEOUT = 5.0
+DEFAULT_PRINT_TIMEOUT = 30.0
+RECONNECT_MAX_DELAY = 10.0
+LATENCY_WINDOW = 5000
+# Trabajos recordados por job_id para no imprimir dos veces un reenvío
+DEDUP_WINDOW = 5000
+
+
+# =========================================================
+# TRANSPORTES
+# =========================================================
+class TcpTransport:
+    """Conexión RAW persistente; se reabre sola si la impresora cae."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.writer = None
+
+    async def write(self, data):
+        if self.writer is None or self.writer.is_closing():
+            _, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except (OSError, ConnectionError):
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+            self.writer = None
+
+    def __str__(self):
+        return "tcp://%s:%s" % (self.host, self.port)
+
+
+class FileTransport:
+    """Dispositivo de caracteres (/dev/usb/lp0) o archivo, abierto una vez."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def _write(self, data):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        view = memoryview(data)
+        total = 0
+        while view:
+            try:
+                written = os.write(self.fd, view)
+            except OSError as err:
+                # Bytes ya entregados: el reintento no los repite
+                err.lms_written = total
+                raise
+            total += written
+            view = view[written:]
+
+    async def write(self, data):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write, data)
+        except OSError:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __str__(self):
+        return "file:%s" % self.path
+
+
+def make_transport(uri):
+    parsed = urlparse(uri)
+    if parsed.scheme == "tcp":
+        return TcpTransport(parsed.hostname, parsed.port or 9100)
+    if parsed.scheme == "file":
+        return FileTransport(parsed.path)
+    raise ValueError("URI de impresora no soportada: %s" % uri)
+
+
+# =========================================================
+# IMPRESORA + COLA
+# =========================================================
+class PrinterWorker:
+
+    def __init__(self, name, transport, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_batch=DEFAULT_MAX_BATCH):
+        self.name = name
+        self.transport = transport
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_batch = max_batch
+        self.task = None
+
+        self.started = time.monotonic()
+        self.jobs = 0
+        self.bytes = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run(), name="printer-%s" % self.name)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.transport.close()
+
+    async def submit(self, data, timeout=DEFAULT_ENQUEUE_TIMEOUT):
+        """Encola y devuelve un Future que se resuelve al escribir el ticket."""
+        future = asyncio.get_running_loop().create_future()
+        await asyncio.wait_for(
+            self.queue.put((time.monotonic(), data, future)), timeout
+        )
+        return future
+
+    async def _run(self):
+        delay = 0.5
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # Tras un fallo se sigue de a UN ticket: solo se reenvía lo
+            # que la impresora no aceptó, nunca el lote entero otra vez
+            retrying = False
+            while batch:
+                chunk = batch[:1] if retrying else batch
+                payload = b"".join(data for _, data, _ in chunk)
+                try:
+                    await self.transport.write(payload)
+                except (OSError, ConnectionError) as err:
+                    accepted = self._accepted(chunk, getattr(err, "lms_written", 0))
+                    self._done(accepted)
+                    batch = batch[len(accepted):]
+                    retrying = True
+                    self.errors += 1
+                    _logger.warning(
+                        "Impresora %s (%s) no disponible: %s. Reintento en %.1fs",
+                        self.name, self.transport, err, delay,
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                    continue
+
+                delay = 0.5
+                self.batches += 1
+                self._done(chunk)
+                batch = batch[len(chunk):]
+
+    @staticmethod
+    def _accepted(chunk, written):
+        """Tickets del envío fallido que entraron completos (`written` bytes)."""
+        accepted = []
+        for item in chunk:
+            written -= len(item[1])
+            if written < 0:
+                break
+            accepted.append(item)
+        return accepted
+
+    def _done(self, items):
+        done = time.monotonic()
+        for enqueued, data, future in items:
+            self.jobs += 1
+            self.bytes += len(data)
+            self.latencies.append(done - enqueued)
+            if not future.done():
+                future.set_result(True)
+            self.queue.task_done()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        latencies = sorted(self.latencies)
+        return {
+            "printer": self.name,
+            "transport": str(self.transport),
+            "queued": self.queue.qsize(),
+            "jobs": self.jobs,
+            "batches": self.batches,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "jobs_per_second": round(self.jobs / elapsed, 2),
+            "avg_batch": round(self.jobs / self.batches, 2) if self.batches else 0,
+            "latency_ms_p50": round(percentile(latencies, 50) * 1000, 2),
+            "latency_ms_p99": round(percentile(latencies, 99) * 1000, 2),
+        }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+# =========================================================
+# SERVIDOR HTTP (mínimo, compatible con fetch() del POS)
+# =========================================================
+class Dispatcher:
+
+    def __init__(self, printers, print_timeout=DEFAULT_PRINT_TIMEOUT):
+        self.printers = printers
+        self.default = next(iter(printers))
+        self.print_timeout = print_timeout
+        # (impresora, job_id) → Future del trabajo ya encolado
+        self.submitted = OrderedDict()
+
+    async def start(self, host, port):
+        for worker in self.printers.values():
+            worker.start()
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for worker in self.printers.values():
+            await worker.stop()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, body = request
+                status, payload = await self._route(method, path, body)
+                write_response(writer, status, payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if method == "OPTIONS":
+            return 204, None
+        if method == "GET" and path == "/stats":
+            return 200, [worker.stats() for worker in self.printers.values()]
+        if method == "POST" and path == "/print":
+            return await self._print(body)
+        return 404, {"ok": False, "error": "not found"}
+
+    async def _print(self, body):
+        try:
+            params = json.loads(body or b"{}")
+            data = base64.b64decode(params["data"])
+        except (ValueError, KeyError, TypeError):
+            return 400, {"ok": False, "error": "payload inválido"}
+
+        worker = self.printers.get(params.get("printer") or self.default)
+        if worker is None:
+            return 404, {"ok": False, "error": "impresora desconocida"}
+
+        job_id = params.get("job_id")
+        key = (worker.name, str(job_id)) if job_id else None
+
+        future = self.submitted.get(key) if key else None
+        if future is None:
+            try:
+                future = await worker.submit(data)
+            except asyncio.TimeoutError:
+                return 503, {"ok": False, "error": "cola llena", "printer": worker.name}
+            if key:
+                self.submitted[key] = future
+                while len(self.submitted) > DEDUP_WINDOW:
+                    self.submitted.popitem(last=False)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.print_timeout)
+        except asyncio.TimeoutError:
+            if key:
+                # Sigue en cola y se imprimirá; reenviarlo no lo duplica
+                return 202, {"ok": True, "pending": True, "printer": worker.name, "job_id": job_id}
+            return 504, {"ok": False, "error": "impresora no responde", "printer": worker.name}
+
+        return 200, {"ok": True, "printer": worker.name, "job_id": job_id}
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+
+    length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], body
+
+
+STATUS_TEXT = {
+    200: "OK", 202: "Accepted", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+def write_response(writer, status, payload):
+    body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+    headers = [
+        "HTTP/1.1 %s %s" % (status, STATUS_TEXT.get(status, "")),
+        "Content-Type: application/json",
+        "Content-Length: %s" % len(body),
+        "Access-Control-Allow-Origin: *",
+        "Access-Control-Allow-Methods: POST, GET, OPTIONS",
+        "Access-Control-Allow-Headers: Content-Type",
+        "Access-Control-Allow-Private-Network: true",
+    ]
+    if status == 503:
+        headers.append("Retry-After: 1")
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+
+
+# =========================================================
+# IMPRESORA FALSA (sumidero para pruebas de carga)
+# =========================================================
+class FakePrinter:
+    """
+    Acepta conexiones RAW como una térmica en el puerto 9100 y cuenta
+    tickets por corte de papel. `delay_ms` simula el tiempo de impresión
+    de cada ticket (la lectura se frena y el emisor recibe backpressure).
+    """
+
+    def __init__(self, delay_ms=0.0):
+        self.delay = delay_ms / 1000.0
+        self.tickets = 0
+        self.bytes = 0
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        tail = b""
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                self.bytes += len(chunk)
+                data = tail + chunk
+                cuts = data.count(CUT)
+                tail = data[-(len(CUT) - 1):]
+                if cuts:
+                    self.tickets += cuts
+                    if self.delay:
+                        await asyncio.sleep(self.delay * cuts)
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# =========================================================
+# PRUEBA DE CARGA
+# =========================================================
+def sample_ticket(index):
+    body = ("TICKET %06d\n" % index).encode("ascii") * 30
+    return b"\x1b\x40" + body + b"\n\n\n" + CUT
+
+
+async def post_print(host, port, data, printer):
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps({
+        "data": base64.b64encode(data).decode("ascii"),
+        "printer": printer,
+    }).encode("utf-8")
+    writer.write(
+        (
+            "POST /print HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n"
+            "Content-Length: %s\r\nConnection: close\r\n\r\n" % (host, len(body))
+        ).encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status
+
+
+async def loadtest(args):
+    host = "127.0.0.1"
+    fakes = []
+    printers = {}
+    for i in range(args.printers):
+        fake = FakePrinter(delay_ms=args.delay_ms)
+        server = await fake.start(host, 0)
+        port = server.sockets[0].getsockname()[1]
+        fakes.append(fake)
+        name = "caja%s" % (i + 1)
+        printers[name] = PrinterWorker(
+            name, TcpTransport(host, port),
+            queue_size=args.queue_size, max_batch=args.max_batch,
+        )
+
+    dispatcher = Dispatcher(printers)
+    server = await dispatcher.start(host, 0)
+    port = server.sockets[0].getsockname()[1]
+
+    names = list(printers)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = []
+
+    async def one(index):
+        async with semaphore:
+            statuses.append(
+                await post_print(host, port, sample_ticket(index), names[index % len(names)])
+            )
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(i) for i in range(args.jobs)))
+    elapsed = time.monotonic() - started
+
+    # Esperar a que las impresoras falsas terminen de "imprimir"
+    deadline = time.monotonic() + 10
+    while (sum(fake.tickets for fake in fakes) < statuses.count(200)
+           and time.monotonic() < deadline):
+        await asyncio.sleep(0.05)
+
+    report = {
+        "jobs": args.jobs,
+        "ok": statuses.count(200),
+        "rejected": len(statuses) - statuses.count(200),
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(args.jobs / elapsed, 2) if elapsed else 0,
+        "printers": [worker.stats() for worker in printers.values()],
+        "tickets_received": sum(fake.tickets for fake in fakes),
+    }
+
+    await dispatcher.stop()
+    for fake in fakes:
+        await fake.stop()
+
+    print(json.dumps(report, indent=2))
+    return report
+
+
+# =========================================================
+# CLI
+# =========================================================
+async def serve(args):
+    printers = {}
+    for spec in args.printer or ["default=tcp://127.0.0.1:9100"]:
+        name, _, uri = spec.partition("=")
+        printers[name] = PrinterWorker(
+            name, make_transport(uri),
+            queue_size=args.queue_size, max_batch=args.max_batch,
+        )
+
+    dispatcher = Dispatcher(printers)
+    await dispatcher.start(args.host, args.port)
+    _logger.info(
+        "Servicio de impresión en http://%s:%s → %s",
+        args.host, args.port,
+        ", ".join("%s=%s" % (n, w.transport) for n, w in printers.items()),
+    )
+    await asyncio.Event().wait()
+
+
+async def fake_printer(args):
+    fake = FakePrinter(delay_ms=args.delay_ms)
+    await fake.start(args.host, args.port)
+    _logger.info("Impresora falsa en %s:%s (%.0f ms/ticket)", args.host, args.port, args.delay_ms)
+    while True:
+        await asyncio.sleep(10)
+        _logger.info("Tickets recibidos: %s (%s bytes)", fake.tickets, fake.bytes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Servicio local de impresión")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=5001)
+    p_serve.add_argument("--printer", action="append",
+                         help="nombre=tcp://host:9100 o nombre=file:/dev/usb/lp0 (repetible)")
+    p_serve.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    p_serve.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+
+    p_fake = sub.add_parser("fake-printer", help="Impresora RAW falsa")
+    p_fake.add_argument("--host", default="127.0.0.1")
+    p_fake.add_argument("--port", type=int, default=9100)
+    p_fake.add_argument("--delay-ms", type=float, default=0.0)
+
+    p_load = sub.add_parser("loadtest", help="Prueba de carga con impresoras falsas")
+    p_load.add_argument("--printers", type=int, default=3)
+    p_load.add_argument("--jobs", type=int, default=1000)
+    p_load.add_argument("--concurrency", type=int, default=50)
+    p_load.add_argument("--delay-ms", type=float, default=5.0)
+    p_load.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    p_load.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    command = {"serve": serve, "fake-printer": fake_printer, "loadtest": loadtest}[args.command]
+    try:
+        asyncio.run(command(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
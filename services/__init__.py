@@ -1 +1,4 @@
+from . import dgii_607
 from . import fiscal_printer
+from . import invoice_payload
+from . import ncf_availability
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Exportador DGII 607 (ventas de bienes y servicios) en streaming.
+
+Recorre las facturas NCF publicadas de una compañía y un período por
+bloques con paginación por llave (invoice_date, id), escribe cada bloque
+al archivo y guarda un checkpoint: memoria constante y reanudable.
+Cada (compañía, período) es independiente, así que varios pueden
+correr en paralelo (ver scripts/export_dgii_607.py).
+"""
+import csv
+import json
+import logging
+import os
+import re
+import time
+from datetime import date
+
+from odoo import models, api
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Tipo de ingreso 01: ingresos por operaciones (no financieros)
+INCOME_TYPE = "01"
+
+COLUMNS = (
+    "rnc_cedula",
+    "tipo_identificacion",
+    "ncf",
+    "ncf_modificado",
+    "tipo_ingreso",
+    "fecha_comprobante",
+    "fecha_retencion",
+    "monto_facturado",
+    "itbis_facturado",
+    "itbis_retenido",
+    "itbis_percibido",
+    "retencion_renta",
+    "isr_percibido",
+    "impuesto_selectivo",
+    "otros_impuestos",
+    "propina_legal",
+    "efectivo",
+    "cheque_transferencia",
+    "tarjeta",
+    "venta_credito",
+    "bonos",
+    "permuta",
+    "otras_formas",
+)
+
+
+def period_bounds(period):
+    """'YYYYMM' → (primer día, primer día del mes siguiente)."""
+
+    year, month = int(period[:4]), int(period[4:6])
+    return date(year, month, 1), date(year + (month == 12), month % 12 + 1, 1)
+
+
+def id_type(vat):
+    """1 = RNC (9 dígitos), 2 = cédula (11), 3 = otro documento."""
+
+    if not vat:
+        return ""
+    return {9: "1", 11: "2"}.get(len(vat), "3")
+
+
+def amount(value):
+    return "%.2f" % (value or 0.0)
+
+
+class Dgii607Export(models.AbstractModel):
+    _name = "lms.dgii.607.export"
+    _description = "Exportador DGII 607 (streaming)"
+
+    # =========================================================
+    # LECTURA POR BLOQUES (paginación por llave)
+    # =========================================================
+    @api.model
+    def _lms_count(self, company_id, start, end):
+        self.env.cr.execute(
+            """
+            SELECT count(*) FROM account_move
+             WHERE company_id = %s
+               AND state = 'posted'
+               AND move_type IN ('out_invoice', 'out_refund')
+               AND ncf_number IS NOT NULL
+               AND invoice_date >= %s AND invoice_date < %s
+            """,
+            (company_id, start, end),
+        )
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _lms_fetch_chunk(self, company_id, start, end, after, limit):
+        """
+        Un bloque de facturas tras la llave `after` = (invoice_date, id),
+        con los montos por forma de pago de su orden POS.
+        """
+
+        cr = self.env.cr
+        after_date, after_id = after or (start, 0)
+
+        cr.execute(
+            """
+            SELECT m.id,
+                   m.move_type,
+                   m.invoice_date,
+                   m.ncf_number,
+                   r.ncf_number,
+                   p.vat,
+                   abs(m.amount_untaxed_signed),
+                   abs(m.amount_tax_signed),
+                   abs(m.amount_total_signed)
+              FROM account_move m
+              JOIN res_partner p ON p.id = m.commercial_partner_id
+         LEFT JOIN account_move r ON r.id = m.reversed_entry_id
+             WHERE m.company_id = %s
+               AND m.state = 'posted'
+               AND m.move_type IN ('out_invoice', 'out_refund')
+               AND m.ncf_number IS NOT NULL
+               AND m.invoice_date >= %s AND m.invoice_date < %s
+               AND (m.invoice_date, m.id) > (%s, %s)
+          ORDER BY m.invoice_date, m.id
+             LIMIT %s
+            """,
+            (company_id, start, end, after_date, after_id, limit),
+        )
+        moves = cr.fetchall()
+        if not moves:
+            return [], {}
+
+        # Formas de pago POS según el mapeo 607 de cada método:
+        # efectivo / cheque-transferencia / tarjeta (crédito: el resto)
+        cr.execute(
+            """
+            SELECT o.account_move,
+                   sum(CASE WHEN pm.lms_dgii_607_method = 'cash' THEN pp.amount ELSE 0 END),
+                   sum(CASE WHEN pm.lms_dgii_607_method = 'transfer' THEN pp.amount ELSE 0 END),
+                   sum(CASE WHEN pm.lms_dgii_607_method = 'card' THEN pp.amount ELSE 0 END)
+              FROM pos_order o
+              JOIN pos_payment pp ON pp.pos_order_id = o.id
+              JOIN pos_payment_method pm ON pm.id = pp.payment_method_id
+             WHERE o.account_move IN %s
+          GROUP BY o.account_move
+            """,
+            (tuple(row[0] for row in moves),),
+        )
+        payments = {row[0]: (row[1], row[2], row[3]) for row in cr.fetchall()}
+
+        return moves, payments
+
+    @api.model
+    def _lms_rows(self, moves, payments):
+        for move_id, move_type, invoice_date, ncf, modified_ncf, vat, untaxed, tax, total in moves:
+            vat = re.sub(r"\D", "", vat or "")
+            paid = payments.get(move_id, (0.0, 0.0, 0.0))
+            # Devolución POS: los pagos vienen en negativo, los montos en absoluto
+            sign = -1 if move_type == "out_refund" else 1
+            cash, transfer, card = (max(sign * (value or 0.0), 0.0) for value in paid)
+            credit = max(total - cash - transfer - card, 0.0)
+
+            yield (
+                vat,
+                id_type(vat),
+                ncf,
+                modified_ncf or "",
+                INCOME_TYPE,
+                invoice_date.strftime("%Y%m%d"),
+                "",
+                amount(untaxed),
+                amount(tax),
+                amount(0), amount(0), amount(0), amount(0), amount(0), amount(0), amount(0),
+                amount(cash),
+                amount(transfer),
+                amount(card),
+                amount(credit),
+                amount(0), amount(0), amount(0),
+            )
+
+    # =========================================================
+    # EXPORTACIÓN CON CHECKPOINT
+    # =========================================================
+    @api.model
+    def _lms_export_607(self, company, period, path, fmt="txt", chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Escribe el 607 de `company` para `period` ('YYYYMM') en `path`.
+        `path + '.ckpt'` guarda la última llave y el tamaño del archivo
+        tras cada bloque; si existe, se reanuda desde ahí.
+        Devuelve el número de registros escritos.
+        """
+
+        checkpoint_path = path + ".ckpt"
+        start, end = period_bounds(period)
+
+        checkpoint = None
+        if os.path.exists(checkpoint_path) and os.path.exists(path):
+            with open(checkpoint_path) as fh:
+                checkpoint = json.load(fh)
+            if checkpoint.get("done"):
+                return checkpoint["rows"]
+
+        started = time.perf_counter()
+
+        if checkpoint:
+            after = (date.fromisoformat(checkpoint["after"][0]), checkpoint["after"][1])
+            rows = checkpoint["rows"]
+            fh = open(path, "r+", newline="", encoding="utf-8")
+            # Lo escrito después del último checkpoint se descarta
+            fh.truncate(checkpoint["offset"])
+            fh.seek(checkpoint["offset"])
+            _logger.info("[DGII 607] %s %s: reanudando tras %s registros", company.name, period, rows)
+        else:
+            after = None
+            rows = 0
+            fh = open(path, "w", newline="", encoding="utf-8")
+            rnc = re.sub(r"\D", "", company.vat or "")
+            if fmt == "csv":
+                csv.writer(fh).writerow(COLUMNS)
+            else:
+                total = self._lms_count(company.id, start, end)
+                fh.write("607|%s|%s|%s\n" % (rnc, period, total))
+
+        writer = csv.writer(fh) if fmt == "csv" else None
+
+        try:
+            while True:
+                moves, payments = self._lms_fetch_chunk(company.id, start, end, after, chunk_size)
+                if not moves:
+                    break
+
+                for row in self._lms_rows(moves, payments):
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        fh.write("|".join(row) + "\n")
+
+                rows += len(moves)
+                after = (moves[-1][2], moves[-1][0])
+
+                fh.flush()
+                os.fsync(fh.fileno())
+                self._lms_write_checkpoint(checkpoint_path, {
+                    "after": [after[0].isoformat(), after[1]],
+                    "rows": rows,
+                    "offset": fh.tell(),
+                    "done": False,
+                })
+        finally:
+            fh.close()
+
+        self._lms_write_checkpoint(checkpoint_path, {
+            "after": after and [after[0].isoformat(), after[1]],
+            "rows": rows,
+            "done": True,
+        })
+
+        _logger.info(
+            "[DGII 607] %s %s: %s registros en %.1fs → %s",
+            company.name,
+            period,
+            rows,
+            time.perf_counter() - started,
+            path,
+        )
+
+        return rows
+
+    @api.model
+    def _lms_write_checkpoint(self, checkpoint_path, data):
+        tmp_path = checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, checkpoint_path)
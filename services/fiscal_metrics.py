@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas en memoria del circuito fiscal POS, por etapa.
+
+Tiempo, unidades procesadas, consultas SQL y errores por (base, etapa),
+agregados en el proceso (cada worker de Odoo lleva los suyos) y
+expuestos en texto Prometheus por `/lms/pos/metrics`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites del histograma (segundos)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (db, etapa) → {"count", "items", "seconds", "queries", "errors", "buckets"}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record(dbname, stage, seconds, queries=0, items=1, error=False):
+    with _stats_lock:
+        stat = _stats.get((dbname, stage))
+        if stat is None:
+            stat = _stats[(dbname, stage)] = {
+                "count": 0,
+                "items": 0,
+                "seconds": 0.0,
+                "queries": 0,
+                "errors": 0,
+                "buckets": [0] * len(BUCKETS),
+            }
+        stat["count"] += 1
+        stat["items"] += items
+        stat["seconds"] += seconds
+        stat["queries"] += queries
+        stat["errors"] += int(error)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                stat["buckets"][index] += 1
+
+
+@contextmanager
+def measure(env, stage, items=1):
+    """Mide un bloque: tiempo y consultas SQL del cursor de `env`."""
+
+    cr = env.cr
+    queries = cr.sql_log_count
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(
+            cr.dbname,
+            stage,
+            time.perf_counter() - started,
+            queries=cr.sql_log_count - queries,
+            items=items,
+            error=error,
+        )
+
+
+def snapshot():
+    with _stats_lock:
+        return {
+            key: dict(stat, buckets=list(stat["buckets"]))
+            for key, stat in _stats.items()
+        }
+
+
+def render_prometheus(dbname=None):
+    stats = snapshot()
+    lines = [
+        "# HELP lms_fiscal_stage_seconds Duración de cada etapa del circuito fiscal POS.",
+        "# TYPE lms_fiscal_stage_seconds histogram",
+    ]
+    rows = sorted(
+        (key, stat) for key, stat in stats.items()
+        if dbname is None or key[0] == dbname
+    )
+
+    for (db, stage), stat in rows:
+        labels = 'db="%s",stage="%s"' % (db, stage)
+        for bound, count in zip(BUCKETS, stat["buckets"]):
+            lines.append('lms_fiscal_stage_seconds_bucket{%s,le="%s"} %s' % (labels, bound, count))
+        lines.append('lms_fiscal_stage_seconds_bucket{%s,le="+Inf"} %s' % (labels, stat["count"]))
+        lines.append("lms_fiscal_stage_seconds_sum{%s} %.6f" % (labels, stat["seconds"]))
+        lines.append("lms_fiscal_stage_seconds_count{%s} %s" % (labels, stat["count"]))
+
+    for metric, key, help_text in (
+        ("lms_fiscal_stage_items_total", "items", "Unidades (órdenes/facturas) procesadas por etapa."),
+        ("lms_fiscal_stage_queries_total", "queries", "Consultas SQL ejecutadas por etapa."),
+        ("lms_fiscal_stage_errors_total", "errors", "Ejecuciones de la etapa que terminaron en error."),
+    ):
+        lines.append("# HELP %s %s" % (metric, help_text))
+        lines.append("# TYPE %s counter" % metric)
+        for (db, stage), stat in rows:
+            lines.append('%s{db="%s",stage="%s"} %s' % (metric, db, stage, stat[key]))
+
+    return "\n".join(lines) + "\n"
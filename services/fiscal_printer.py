@@ -1,9 +1,132 @@
 # -*- coding: utf-8 -*-
 import logging
-from odoo import models
+import re
+import unicodedata
+
+from odoo import models, fields, api
 
 _logger = logging.getLogger(__name__)
 
+# Configuración del render (ir.config_parameter)
+ESCPOS_WIDTH_PARAM = "lms_pos_fiscal_print.escpos_width"
+ESCPOS_CODEPAGE_PARAM = "lms_pos_fiscal_print.escpos_codepage"
+DEFAULT_ESCPOS_WIDTH = 44
+
+# =========================================================
+# COMANDOS ESC/POS (precompilados)
+# =========================================================
+ESC_INIT = b"\x1b\x40"
+ALIGN_LEFT = b"\x1b\x61\x00"
+ALIGN_CENTER = b"\x1b\x61\x01"
+SIZE_NORMAL = b"\x1d\x21\x00"
+SIZE_DOUBLE = b"\x1d\x21\x11"
+BOLD_ON = b"\x1b\x45\x01"
+BOLD_OFF = b"\x1b\x45\x00"
+CUT = b"\x1d\x56\x00"
+NL = b"\n"
+
+QR_MODULE_SIZE = b"\x1d\x28\x6b\x03\x00\x31\x43\x06"
+QR_ERROR_LEVEL = b"\x1d\x28\x6b\x03\x00\x31\x45\x30"
+QR_STORE_HEADER = b"\x1d\x28\x6b"
+QR_STORE_FN = b"\x31\x50\x30"
+QR_PRINT = b"\x1d\x28\x6b\x03\x00\x31\x51\x30"
+
+# Código de página → (comando ESC t n, codec Python)
+# "ascii" reproduce el formato del POS (sin acentos).
+CODEPAGES = {
+    "ascii": (b"", "ascii"),
+    "cp437": (b"\x1b\x74\x00", "cp437"),
+    "cp850": (b"\x1b\x74\x02", "cp850"),
+    "cp858": (b"\x1b\x74\x13", "cp858"),
+}
+
+PAD = "  "
+MONEY_WIDTH = 12
+
+_BRACKETS_RE = re.compile(r"\[.*?\]")
+
+
+def normalize(text):
+    """Igual que `lmsFiscalQZ.normalize`: sin acentos ni ñ."""
+    if not text:
+        return ""
+    return "".join(
+        c for c in unicodedata.normalize("NFD", str(text))
+        if unicodedata.category(c) != "Mn"
+    )
+
+
+def clean_product_name(name):
+    if not name:
+        return ""
+    return normalize(_BRACKETS_RE.sub("", name.split("\n")[0])).strip()
+
+
+def format_money(value):
+    return "{:,.2f}".format(float(value or 0))
+
+
+def js_number(value):
+    """Número como lo imprime JS (`118` y no `118.0`)."""
+    value = float(value or 0)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def comprobante_label(ncf):
+    tipo = (ncf or "")[:3]
+    if tipo == "B01":
+        return "Comprobante de Credito Fiscal"
+    if tipo == "B02":
+        return "Comprobante Consumidor Final"
+    return "Comprobante %s" % tipo
+
+
+class EscPosReceipt:
+    """
+    Construye el ticket directamente en un `bytearray`.
+    Mismo diseño que `lmsFiscalQZ.printTicket`, a 44 o 48 columnas.
+    """
+
+    def __init__(self, width=DEFAULT_ESCPOS_WIDTH, codepage="ascii"):
+        self.width = width
+        self.select_codepage, self.codec = CODEPAGES.get(codepage, CODEPAGES["ascii"])
+        self.keep_accents = codepage != "ascii"
+        self.line = (PAD + "-" * width + "\n").encode("ascii")
+        self.buf = bytearray()
+
+    def raw(self, data):
+        self.buf += data
+
+    def text(self, value, normalized=True):
+        if normalized and not self.keep_accents:
+            value = normalize(value)
+        self.buf += value.encode(self.codec, "replace")
+
+    def padded(self, value):
+        self.text(PAD + value + "\n")
+
+    def columns(self, left, right):
+        spaces = self.width - len(left) - len(right)
+        self.padded(left + " " * max(spaces, 1) + right)
+
+    def total_line(self, label, amount, symbol):
+        left = ("%s %s" % (label, symbol)).ljust(self.width - MONEY_WIDTH)
+        self.padded(left + format_money(amount).rjust(MONEY_WIDTH))
+
+    def qr(self, data):
+        payload = data.encode(self.codec, "replace")
+        size = len(payload) + 3
+        self.buf += QR_MODULE_SIZE
+        self.buf += QR_ERROR_LEVEL
+        self.buf += QR_STORE_HEADER
+        self.buf += bytes((size & 0xFF, size >> 8))
+        self.buf += QR_STORE_FN
+        self.buf += payload
+        self.buf += QR_PRINT
+
+    def getvalue(self):
+        return bytes(self.buf)
+
 
 class FiscalPrinter(models.AbstractModel):
     _name = "lms.fiscal.printer"
@@ -28,3 +151,154 @@ class FiscalPrinter(models.AbstractModel):
         _logger.info("==============================================")
 
         return True
+
+    # =========================================================
+    # 🖨️ RENDER ESC/POS (BACKEND)
+    # =========================================================
+    @api.model
+    def _lms_render_options(self):
+        ICP = self.env["ir.config_parameter"].sudo()
+        width = int(ICP.get_param(ESCPOS_WIDTH_PARAM, DEFAULT_ESCPOS_WIDTH))
+        codepage = ICP.get_param(ESCPOS_CODEPAGE_PARAM, "ascii")
+        return width, codepage
+
+    @api.model
+    def render_escpos(self, data, width=None, codepage=None):
+        """
+        Devuelve los bytes ESC/POS listos para enviar a la impresora
+        a partir del payload de `lms.fiscal.invoice.payload`.
+        """
+
+        if width is None or codepage is None:
+            default_width, default_codepage = self._lms_render_options()
+            width = width or default_width
+            codepage = codepage or default_codepage
+
+        r = EscPosReceipt(width=width, codepage=codepage)
+        company = data.get("company") or {}
+        partner = data.get("partner") or {}
+        symbol = (data.get("currency") or {}).get("symbol") or ""
+
+        now = fields.Datetime.context_timestamp(self, fields.Datetime.now())
+
+        # RESET
+        r.raw(ESC_INIT)
+        r.raw(r.select_codepage)
+        r.raw(NL + NL)
+
+        # EMPRESA
+        r.raw(ALIGN_CENTER)
+        r.raw(SIZE_DOUBLE)
+        r.padded(company.get("name") or "")
+        r.raw(SIZE_NORMAL)
+        r.raw(NL)
+        r.padded("RNC: %s" % (company.get("rnc") or ""))
+        if company.get("phone"):
+            r.padded("Tel: %s" % company["phone"])
+        if company.get("email"):
+            r.padded("Email: %s" % company["email"])
+        r.raw(ALIGN_LEFT)
+
+        # NCF
+        r.raw(r.line)
+        r.padded(comprobante_label(data.get("ncf")))
+        r.padded("NCF: %s" % (data.get("ncf") or ""))
+        if data.get("valid_until"):
+            r.padded("Valido hasta: %s" % data["valid_until"])
+        r.padded("FECHA: %s %s" % (data.get("date") or "", now.strftime("%H:%M")))
+        r.padded("FACTURA: %s" % (data.get("invoice_number") or ""))
+        if data.get("cashier"):
+            r.padded("CAJERO: %s" % data["cashier"])
+        r.raw(r.line)
+
+        # CLIENTE
+        r.padded(partner.get("name") or "")
+        if partner.get("rnc"):
+            r.padded("RNC: %s" % partner["rnc"])
+        r.raw(r.line)
+
+        # DETALLE
+        r.padded("Cant     Descripcion".ljust(width - 11) + "Importe " + symbol)
+        r.raw(r.line)
+
+        for line in data.get("lines") or []:
+            qty = "%.2f" % (line.get("qty") or 0)
+            amount = format_money((line.get("qty") or 0) * (line.get("price") or 0))
+            name = clean_product_name(line.get("name"))
+            max_name = width - len(qty.rjust(7)) - 2 - len(amount) - 1
+            r.columns(qty.rjust(7) + "  " + name[:max(max_name, 1)], amount)
+
+        # TOTALES
+        r.raw(r.line)
+        r.total_line("SUBTOTAL", data.get("subtotal"), symbol)
+        r.total_line("ITBIS", data.get("tax"), symbol)
+        r.raw(r.line)
+
+        r.raw(BOLD_ON)
+        r.raw(SIZE_DOUBLE)
+        r.raw(ALIGN_CENTER)
+        r.text("TOTAL %s %s\n" % (symbol, format_money(data.get("total"))))
+        r.raw(SIZE_NORMAL)
+        r.raw(BOLD_OFF)
+        r.raw(ALIGN_LEFT)
+        r.raw(NL)
+
+        # PAGOS
+        payments = data.get("payments") or []
+        if payments:
+            r.raw(r.line)
+            r.padded("Pagos %s" % symbol)
+
+            total_paid = 0.0
+            negative = 0.0
+            for payment in payments:
+                amount = payment.get("amount") or 0
+                if amount > 0:
+                    total_paid += amount
+                    r.columns(normalize(payment.get("method")), format_money(amount))
+                else:
+                    negative += abs(amount)
+
+            change = max(total_paid - (data.get("total") or 0), negative, 0)
+
+            r.raw(r.line)
+            r.total_line("Total Pagado", total_paid, symbol)
+            r.total_line("Devuelta", change, symbol)
+
+        # CIERRE
+        r.raw(NL)
+        r.raw(ALIGN_CENTER)
+        r.padded("DOCUMENTO VALIDO PARA FINES FISCALES")
+        r.padded("GRACIAS POR SU COMPRA")
+
+        r.raw(NL)
+        r.padded("VERIFICACION FISCAL")
+        r.qr("RNC=%s|NCF=%s|TOTAL=%s|FECHA=%s" % (
+            company.get("rnc") or "",
+            data.get("ncf") or "",
+            js_number(data.get("total")),
+            data.get("date") or "",
+        ))
+        r.raw(NL)
+        r.padded("CONSERVE ESTE COMPROBANTE")
+
+        r.raw(NL + NL + NL)
+        r.raw(CUT)
+
+        return r.getvalue()
+
+    @api.model
+    def _lms_render_invoices(self, invoices, width=None, codepage=None):
+        """Pre-render por lote: {invoice_id: bytes ESC/POS}."""
+
+        if width is None or codepage is None:
+            default_width, default_codepage = self._lms_render_options()
+            width = width or default_width
+            codepage = codepage or default_codepage
+
+        payloads = self.env["lms.fiscal.invoice.payload"]._lms_get_payloads(invoices)
+
+        return {
+            invoice_id: self.render_escpos(payload, width=width, codepage=codepage)
+            for invoice_id, payload in payloads.items()
+        }
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+from odoo import models, api
+
+from . import fiscal_metrics
+
+# Caché LRU por proceso: (db, invoice_id) → (write_date, payload)
+_CACHE_MAX_SIZE = 2048
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key, write_date):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None or entry[0] != write_date:
+            return None
+        _cache.move_to_end(key)
+        return entry[1]
+
+
+def _cache_put(key, write_date, payload):
+    with _cache_lock:
+        _cache[key] = (write_date, payload)
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_MAX_SIZE:
+            _cache.popitem(last=False)
+
+
+# Protocolo compacto: datos estáticos por sesión + líneas en columnas
+PROTOCOL_VERSION = 2
+
+
+def format_valid_until(date_end):
+    if not date_end:
+        return ""
+    try:
+        return date_end.strftime("%d/%m/%Y")
+    except Exception:
+        return ""
+
+
+def compact_payload(payload, names):
+    """
+    Payload legacy → forma compacta v2. Compañía, moneda y rango van
+    por id (ver `_lms_static_data`); los nombres de línea, como índices
+    de la tabla `names` compartida por toda la respuesta.
+    """
+
+    lines = payload["lines"]
+    name_ids = []
+    for line in lines:
+        index = names.setdefault(line["name"] or "", len(names))
+        name_ids.append(index)
+
+    return {
+        "id": payload["invoice_id"],
+        "number": payload["invoice_number"],
+        "ncf": payload["ncf"],
+        "date": payload["date"],
+        "company": payload["company_id"],
+        "currency": payload["currency_id"],
+        "range": payload["ncf_range_id"] or False,
+        "cashier": payload["cashier"],
+        "partner": [payload["partner"]["name"], payload["partner"]["rnc"]],
+        "totals": [
+            payload["subtotal"],
+            payload["tax"],
+            payload["total"],
+            payload["amount_paid"],
+            payload["change"],
+        ],
+        "payments": [[p["method"], p["amount"]] for p in payload["payments"]],
+        "lines": [
+            name_ids,
+            [line["qty"] for line in lines],
+            [line["price"] for line in lines],
+        ],
+    }
+
+
+def invalidate(dbname, invoice_ids):
+    with _cache_lock:
+        for invoice_id in invoice_ids:
+            _cache.pop((dbname, invoice_id), None)
+
+
+class FiscalInvoicePayload(models.AbstractModel):
+    _name = "lms.fiscal.invoice.payload"
+    _description = "Serializador de factura fiscal POS"
+
+    @api.model
+    def _lms_get_payloads(self, invoices):
+        """
+        Devuelve {invoice_id: payload} con el formato que consume
+        `lmsFiscalQZ.printTicket`. Lo ya serializado sale de la caché
+        si la factura no ha cambiado (`write_date`); el resto se arma
+        con lecturas por lote, no recorriendo relaciones factura a factura.
+        """
+
+        if not invoices:
+            return {}
+
+        dbname = self.env.cr.dbname
+
+        invoices.flush_recordset(["write_date"])
+        self.env.cr.execute(
+            "SELECT id, write_date FROM account_move WHERE id IN %s",
+            (tuple(invoices.ids),),
+        )
+        write_dates = dict(self.env.cr.fetchall())
+
+        result = {}
+        missing = []
+        for invoice_id, write_date in write_dates.items():
+            payload = _cache_get((dbname, invoice_id), write_date)
+            if payload is None:
+                missing.append(invoice_id)
+            else:
+                result[invoice_id] = dict(payload)
+
+        if missing:
+            with fiscal_metrics.measure(self.env, "payload_build", len(missing)):
+                serialized = self._lms_serialize(missing)
+            for invoice_id, payload in serialized.items():
+                _cache_put((dbname, invoice_id), write_dates[invoice_id], payload)
+                result[invoice_id] = dict(payload)
+
+        return result
+
+    @api.model
+    def _lms_static_data(self, company):
+        """
+        Lo que no cambia entre recibos de una caja: compañía, moneda y
+        vigencia de los rangos NCF activos. El POS lo pide una vez por
+        sesión y los payloads compactos lo referencian por id.
+        """
+
+        currency = company.currency_id
+        ranges = self.env["l10n_do.ncf.range"].sudo().search_read(
+            [("company_id", "=", company.id), ("active", "=", True)],
+            ["date_end"],
+        )
+
+        return {
+            "v": PROTOCOL_VERSION,
+            "companies": {
+                company.id: {
+                    "name": company.name,
+                    "rnc": company.vat,
+                    "phone": company.phone,
+                    "city": company.city,
+                    "address": company.street,
+                },
+            },
+            "currencies": {
+                currency.id: {
+                    "symbol": currency.symbol,
+                    "position": currency.position,
+                },
+            },
+            "ranges": {
+                r["id"]: format_valid_until(r["date_end"]) for r in ranges
+            },
+        }
+
+    @api.model
+    def _lms_serialize(self, invoice_ids):
+
+        env = self.env
+
+        moves = env["account.move"].browse(invoice_ids).read([
+            "name",
+            "ncf_number",
+            "ncf_range_id",
+            "invoice_date",
+            "company_id",
+            "partner_id",
+            "currency_id",
+            "amount_untaxed",
+            "amount_tax",
+            "amount_total",
+        ])
+
+        orders = env["pos.order"].search_read(
+            [("account_move", "in", invoice_ids)],
+            ["account_move", "user_id"],
+            order="id",
+        )
+        order_by_move = {o["account_move"][0]: o for o in orders}
+
+        payments_by_order = {}
+        for payment in env["pos.payment"].search_read(
+            [("pos_order_id", "in", [o["id"] for o in orders])],
+            ["pos_order_id", "payment_method_id", "amount"],
+            order="id",
+        ):
+            payments_by_order.setdefault(payment["pos_order_id"][0], []).append({
+                "method": payment["payment_method_id"][1] if payment["payment_method_id"] else "",
+                "amount": payment["amount"],
+            })
+
+        lines_by_move = {}
+        for line in env["account.move.line"].search_read(
+            [
+                ("move_id", "in", invoice_ids),
+                ("display_type", "in", ("product", "line_section", "line_note")),
+            ],
+            ["move_id", "name", "quantity", "price_unit"],
+            order="move_id, sequence, id",
+        ):
+            lines_by_move.setdefault(line["move_id"][0], []).append({
+                "name": line["name"],
+                "qty": line["quantity"],
+                "price": line["price_unit"],
+            })
+
+        def read_by_id(model, ids, fnames):
+            ids = list({i for i in ids if i})
+            return {r["id"]: r for r in env[model].browse(ids).read(fnames)}
+
+        companies = read_by_id(
+            "res.company",
+            [m["company_id"][0] for m in moves],
+            ["name", "vat", "phone", "city", "street"],
+        )
+        partners = read_by_id(
+            "res.partner",
+            [m["partner_id"] and m["partner_id"][0] for m in moves],
+            ["name", "vat"],
+        )
+        currencies = read_by_id(
+            "res.currency",
+            [m["currency_id"][0] for m in moves],
+            ["symbol", "position"],
+        )
+        ranges = read_by_id(
+            "l10n_do.ncf.range",
+            [m["ncf_range_id"] and m["ncf_range_id"][0] for m in moves],
+            ["date_end"],
+        )
+
+        payloads = {}
+        for move in moves:
+
+            company = companies[move["company_id"][0]]
+            partner = partners.get(move["partner_id"] and move["partner_id"][0], {})
+            currency = currencies[move["currency_id"][0]]
+            ncf_range = ranges.get(move["ncf_range_id"] and move["ncf_range_id"][0], {})
+            order = order_by_move.get(move["id"], {})
+
+            valid_until = format_valid_until(ncf_range.get("date_end"))
+
+            payments = payments_by_order.get(order.get("id"), [])
+            total_paid = sum(p["amount"] for p in payments)
+
+            payloads[move["id"]] = {
+                "company": {
+                    "name": company["name"],
+                    "rnc": company["vat"],
+                    "phone": company["phone"],
+                    "city": company["city"],
+                    "address": company["street"],
+                },
+                "company_id": move["company_id"][0],
+                "currency_id": move["currency_id"][0],
+                "ncf_range_id": move["ncf_range_id"] and move["ncf_range_id"][0],
+                "invoice_id": move["id"],
+                "invoice_number": move["name"],
+                "ncf": move["ncf_number"],
+                "date": move["invoice_date"].strftime("%d/%m/%Y") if move["invoice_date"] else "",
+                "valid_until": valid_until,
+                "currency": {
+                    "symbol": currency["symbol"],
+                    "position": currency["position"],
+                },
+                "cashier": order["user_id"][1] if order.get("user_id") else False,
+                "partner": {
+                    "name": partner.get("name") or "CONSUMIDOR FINAL",
+                    "rnc": partner.get("vat", False),
+                },
+                "subtotal": move["amount_untaxed"],
+                "tax": move["amount_tax"],
+                "total": move["amount_total"],
+                "payments": payments,
+                "amount_paid": total_paid,
+                "change": max(total_paid - move["amount_total"], 0),
+                "lines": lines_by_move.get(move["id"], []),
+            }
+
+        return payloads
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import functools
+import threading
+import time
+
+from odoo import models, api, _
+
+NCF_TYPES = ("01", "02")
+
+# Caché por proceso: (db, company_id) → (expira, {ncf_type: estado})
+# El TTL cubre cambios hechos fuera de este módulo (carga de rangos).
+_CACHE_TTL = 30.0
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Último nivel empujado a las cajas: (db, company_id) → {ncf_type: nivel}
+_levels = {}
+
+
+def invalidate(dbname, company_ids):
+    with _cache_lock:
+        for company_id in company_ids:
+            _cache.pop((dbname, company_id), None)
+
+
+def _remember_levels(dbname, levels):
+    with _cache_lock:
+        for company_id, company_levels in levels.items():
+            _levels[(dbname, company_id)] = company_levels
+
+
+def _level(type_status):
+    """Nivel que cambia lo que ve la caja: agotado / umbral bajo / ok."""
+    if not type_status["ok"]:
+        return "exhausted"
+    return "low" if type_status.get("warning") else "ok"
+
+
+class NcfAvailability(models.AbstractModel):
+    _name = "lms.ncf.availability"
+    _description = "Disponibilidad de NCF por compañía y tipo"
+
+    @api.model
+    def _lms_get_status(self, company):
+        """
+        Estado de todos los tipos de NCF de la compañía:
+        {"01": {"ok", "available", "warning", "threshold", "message"}, "02": ...}
+        """
+
+        key = (self.env.cr.dbname, company.id)
+        now = time.monotonic()
+
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        status = self._lms_compute_status(company)
+
+        with _cache_lock:
+            _cache[key] = (now + _CACHE_TTL, status)
+
+        return status
+
+    @api.model
+    def _lms_compute_status(self, company):
+
+        ranges = self.env["l10n_do.ncf.range"].sudo().search([
+            ("company_id", "=", company.id),
+            ("ncf_type", "in", NCF_TYPES),
+            ("active", "=", True),
+        ])
+
+        blocks = self.env["lms.ncf.block"].sudo().search([
+            ("company_id", "=", company.id),
+            ("state", "=", "open"),
+        ])
+
+        threshold = company.ncf_low_threshold
+
+        status = {}
+        for ncf_type in NCF_TYPES:
+            type_ranges = ranges.filtered(lambda r: r.ncf_type == ncf_type)
+            available = sum(type_ranges.mapped("available_numbers")) + sum(
+                blocks.filtered(lambda b: b.ncf_type == ncf_type).mapped("remaining")
+            )
+
+            if available <= 0:
+                status[ncf_type] = {
+                    "ok": False,
+                    "available": 0,
+                    "message": _(
+                        "No hay NCF disponible para este tipo de cliente.\n"
+                        "(Tipo requerido: B%s)\n"
+                        "Contacte al administrador."
+                    ) % ncf_type,
+                }
+            elif any(type_ranges.mapped("is_low_ncf")):
+                status[ncf_type] = {
+                    "ok": True,
+                    "warning": True,
+                    "available": available,
+                    "threshold": threshold,
+                    "message": _(
+                        "Quedan %(available)s NCF disponibles "
+                        "para este tipo de cliente (B%(type)s). "
+                        "Contacte al administrador."
+                    ) % {"available": available, "type": ncf_type},
+                }
+            else:
+                status[ncf_type] = {"ok": True, "available": available}
+
+        return status
+
+    @api.model
+    def _lms_refresh(self, companies):
+        """
+        Tras asignar o reservar NCF (cada lote de facturación):
+        - la caché se descarta al CONFIRMAR la transacción: un rollback
+          no deja un estado que nunca existió
+        - solo se avisa por bus a las cajas de las compañías cuyo nivel
+          cambió (cruza el umbral o se agota un tipo), no en cada lote
+        """
+
+        cr = self.env.cr
+        dbname = cr.dbname
+        cr.postcommit.add(functools.partial(invalidate, dbname, companies.ids))
+
+        changed = {}
+        for company in companies:
+            status = self._lms_compute_status(company)
+            levels = {ncf_type: _level(value) for ncf_type, value in status.items()}
+            with _cache_lock:
+                previous = _levels.get((dbname, company.id))
+            if levels != previous:
+                changed[company.id] = (status, levels)
+
+        if not changed:
+            return True
+
+        sessions = self.env["pos.session"].sudo().search([
+            ("company_id", "in", list(changed)),
+            ("state", "=", "opened"),
+        ])
+
+        for company_id, (status, _company_levels) in changed.items():
+            for config in sessions.filtered(lambda s: s.company_id.id == company_id).config_id:
+                config._notify("LMS_NCF_AVAILABILITY", status)
+
+        cr.postcommit.add(functools.partial(
+            _remember_levels,
+            dbname,
+            {company_id: levels for company_id, (_status, levels) in changed.items()},
+        ))
+
+        return True
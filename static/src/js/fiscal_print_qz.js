@@ -64,180 +64,246 @@ window.lmsFiscalQZ = {
     },
 
     // ================= IMPRESIÓN =================
-    async printTicket(data) {
-        try {
+    // Arma el ticket ESC/POS (base64) sin enviarlo
+    renderTicket(data) {
+        const cmds = [];
+        const PAD = "  ";
+        const WIDTH = 44;
+        const LINE = PAD + "-".repeat(WIDTH) + "\n";
+
+        // RESET
+        cmds.push('\x1B\x40');
+        cmds.push('\n\n');
+
+        // EMPRESA
+        cmds.push('\x1B\x61\x01');
+        cmds.push('\x1D\x21\x11');
+        cmds.push(PAD + this.normalize(data.company.name) + '\n');
+        cmds.push('\x1D\x21\x00');
+        cmds.push('\n');
+        cmds.push(PAD + this.normalize(`RNC: ${data.company.rnc}`) + '\n');
+
+        if (data.company.phone) {
+            cmds.push(PAD + this.normalize(`Tel: ${data.company.phone}`) + '\n');
+        }
+        if (data.company.email) {
+            cmds.push(PAD + this.normalize(`Email: ${data.company.email}`) + '\n');
+        }
 
-            const cmds = [];
-            const PAD = "  ";
-            const WIDTH = 44;
-            const LINE = PAD + "-".repeat(WIDTH) + "\n";
-
-            // RESET
-            cmds.push('\x1B\x40');
-            cmds.push('\n\n');
-
-            // EMPRESA
-            cmds.push('\x1B\x61\x01');
-            cmds.push('\x1D\x21\x11');
-            cmds.push(PAD + this.normalize(data.company.name) + '\n');
-            cmds.push('\x1D\x21\x00');
-            cmds.push('\n');
-            cmds.push(PAD + this.normalize(`RNC: ${data.company.rnc}`) + '\n');
-
-            if (data.company.phone) {
-                cmds.push(PAD + this.normalize(`Tel: ${data.company.phone}`) + '\n');
-            }
-            if (data.company.email) {
-                cmds.push(PAD + this.normalize(`Email: ${data.company.email}`) + '\n');
-            }
-
-            cmds.push('\x1B\x61\x00');
-
-            // NCF
-            cmds.push(LINE);
-            cmds.push(PAD + this.normalize(this.getComprobanteLabel(data.ncf)) + '\n');
-            cmds.push(PAD + `NCF: ${data.ncf}\n`);
+        cmds.push('\x1B\x61\x00');
 
-            if (data.valid_until) {
-                cmds.push(PAD + this.normalize(`Valido hasta: ${data.valid_until}`) + '\n');
-            }
+        // NCF
+        cmds.push(LINE);
+        cmds.push(PAD + this.normalize(this.getComprobanteLabel(data.ncf)) + '\n');
+        cmds.push(PAD + `NCF: ${data.ncf}\n`);
 
-            cmds.push(PAD + `FECHA: ${this.formatDateTime(data.date)}\n`);
-            cmds.push(PAD + `FACTURA: ${data.invoice_number}\n`);
-            if (data.cashier)
-                cmds.push(PAD + this.normalize(`CAJERO: ${data.cashier}`) + '\n');
+        if (data.valid_until) {
+            cmds.push(PAD + this.normalize(`Valido hasta: ${data.valid_until}`) + '\n');
+        }
 
-            cmds.push(LINE);
+        cmds.push(PAD + `FECHA: ${this.formatDateTime(data.date)}\n`);
+        cmds.push(PAD + `FACTURA: ${data.invoice_number}\n`);
+        if (data.cashier)
+            cmds.push(PAD + this.normalize(`CAJERO: ${data.cashier}`) + '\n');
 
-            // CLIENTE
-            cmds.push(PAD + this.normalize(data.partner.name) + '\n');
-            if (data.partner.rnc)
-                cmds.push(PAD + `RNC: ${data.partner.rnc}\n`);
+        cmds.push(LINE);
 
-            cmds.push(LINE);
+        // CLIENTE
+        cmds.push(PAD + this.normalize(data.partner.name) + '\n');
+        if (data.partner.rnc)
+            cmds.push(PAD + `RNC: ${data.partner.rnc}\n`);
+
+        cmds.push(LINE);
+
+        // DETALLE
+        cmds.push(
+            PAD +
+            `Cant     Descripcion             Importe ${data.currency?.symbol || ""}\n`
+        );
+        cmds.push(LINE);
+
+        data.lines.forEach(l => {
+
+            const qty = l.qty.toFixed(2).padStart(7);
+            const name = this.cleanProductName(l.name);
+            const amount = this.formatMoney(l.qty * l.price);
+
+            const leftText = qty + "  " + name;
+            const spaces = WIDTH - leftText.length - amount.length;
 
-            // DETALLE
             cmds.push(
                 PAD +
-                `Cant     Descripcion             Importe ${data.currency?.symbol || ""}\n`
+                leftText +
+                " ".repeat(Math.max(spaces, 1)) +
+                amount +
+                "\n"
             );
-            cmds.push(LINE);
+        });
 
-            data.lines.forEach(l => {
+        // TOTALES
+        cmds.push(LINE);
+        cmds.push(PAD + this.formatLine("SUBTOTAL", data.subtotal, data.currency));
+        cmds.push(PAD + this.formatLine("ITBIS", data.tax, data.currency));
+        cmds.push(LINE);
 
-                const qty = l.qty.toFixed(2).padStart(7);
-                const name = this.cleanProductName(l.name);
-                const amount = this.formatMoney(l.qty * l.price);
+        // ===== TOTAL GRANDE CENTRADO =====
+        cmds.push('\x1B\x45\x01');  // Bold ON
+        cmds.push('\x1D\x21\x11');  // Doble tamaño
+        cmds.push('\x1B\x61\x01');  // Centrar
 
-                const leftText = qty + "  " + name;
-                const spaces = WIDTH - leftText.length - amount.length;
+        cmds.push(
+            `TOTAL ${data.currency?.symbol || ""} ${this.formatMoney(data.total)}\n`
+        );
 
-                cmds.push(
-                    PAD +
-                    leftText +
-                    " ".repeat(Math.max(spaces, 1)) +
-                    amount +
-                    "\n"
-                );
-            });
+        cmds.push('\x1D\x21\x00');  // Reset tamaño
+        cmds.push('\x1B\x45\x00');  // Bold OFF
+        cmds.push('\x1B\x61\x00');  // Izquierda
 
-            // TOTALES
-            cmds.push(LINE);
-            cmds.push(PAD + this.formatLine("SUBTOTAL", data.subtotal, data.currency));
-            cmds.push(PAD + this.formatLine("ITBIS", data.tax, data.currency));
-            cmds.push(LINE);
+        cmds.push('\n'); // Espacio seguridad
 
-            // ===== TOTAL GRANDE CENTRADO =====
-            cmds.push('\x1B\x45\x01');  // Bold ON
-            cmds.push('\x1D\x21\x11');  // Doble tamaño
-            cmds.push('\x1B\x61\x01');  // Centrar
+        // ================= PAGOS =================
+        if (data.payments && data.payments.length) {
 
-            cmds.push(
-                `TOTAL ${data.currency?.symbol || ""} ${this.formatMoney(data.total)}\n`
-            );
+            cmds.push(LINE);
+            cmds.push(PAD + `Pagos ${data.currency?.symbol || ""}\n`);
 
-            cmds.push('\x1D\x21\x00');  // Reset tamaño
-            cmds.push('\x1B\x45\x00');  // Bold OFF
-            cmds.push('\x1B\x61\x00');  // Izquierda
+            let totalPaid = 0;
+            let negative = 0;
 
-            cmds.push('\n'); // Espacio seguridad
+            data.payments.forEach(p => {
 
-            // ================= PAGOS =================
-            if (data.payments && data.payments.length) {
+                if (p.amount > 0) {
 
-                cmds.push(LINE);
-                cmds.push(PAD + `Pagos ${data.currency?.symbol || ""}\n`);
+                    totalPaid += p.amount;
 
-                let totalPaid = 0;
-                let negative = 0;
+                    const method = this.normalize(p.method);
+                    const amount = this.formatMoney(p.amount);
+                    const spaces = WIDTH - method.length - amount.length;
 
-                data.payments.forEach(p => {
+                    cmds.push(
+                        PAD +
+                        method +
+                        " ".repeat(Math.max(spaces, 1)) +
+                        amount +
+                        "\n"
+                    );
 
-                    if (p.amount > 0) {
+                } else {
+                    negative += Math.abs(p.amount);
+                }
+            });
 
-                        totalPaid += p.amount;
+            const change = Math.max(totalPaid - data.total, negative, 0);
 
-                        const method = this.normalize(p.method);
-                        const amount = this.formatMoney(p.amount);
-                        const spaces = WIDTH - method.length - amount.length;
+            cmds.push(LINE);
+            cmds.push(PAD + this.formatLine("Total Pagado", totalPaid, data.currency));
+            cmds.push(PAD + this.formatLine("Devuelta", change, data.currency));
+        }
+
+        // ================= CIERRE =================
+        cmds.push('\n');
+        cmds.push('\x1B\x61\x01');
 
-                        cmds.push(
-                            PAD +
-                            method +
-                            " ".repeat(Math.max(spaces, 1)) +
-                            amount +
-                            "\n"
-                        );
+        cmds.push(PAD + this.normalize('DOCUMENTO VALIDO PARA FINES FISCALES') + '\n');
+        cmds.push(PAD + this.normalize('GRACIAS POR SU COMPRA') + '\n');
 
-                    } else {
-                        negative += Math.abs(p.amount);
-                    }
-                });
+        const qrData =
+            `RNC=${data.company.rnc}|NCF=${data.ncf}|TOTAL=${data.total}|FECHA=${data.date}`;
 
-                const change = Math.max(totalPaid - data.total, negative, 0);
+        cmds.push('\n');
+        cmds.push(PAD + this.normalize('VERIFICACION FISCAL') + '\n');
+        cmds.push(this.buildQR(qrData));
+        cmds.push('\n');
+        cmds.push(PAD + this.normalize('CONSERVE ESTE COMPROBANTE') + '\n');
 
-                cmds.push(LINE);
-                cmds.push(PAD + this.formatLine("Total Pagado", totalPaid, data.currency));
-                cmds.push(PAD + this.formatLine("Devuelta", change, data.currency));
-            }
+        // Espacio antes del corte
+        cmds.push('\n\n\n');
+        cmds.push('\x1D\x56\x00');  // Corte
 
-            // ================= CIERRE =================
-            cmds.push('\n');
-            cmds.push('\x1B\x61\x01');
+        const fullCommand = cmds.join("");
+        return btoa(unescape(encodeURIComponent(fullCommand)));
+    },
 
-            cmds.push(PAD + this.normalize('DOCUMENTO VALIDO PARA FINES FISCALES') + '\n');
-            cmds.push(PAD + this.normalize('GRACIAS POR SU COMPRA') + '\n');
+    // Si falla, lanza: quien llama NO debe confirmar la impresión
+    async printTicket(data) {
+        try {
+            await this.sendRaw(this.renderTicket(data));
+        } catch (err) {
+            console.error("❌ Error impresión local:", err);
+            throw err;
+        }
+    },
 
-            const qrData =
-                `RNC=${data.company.rnc}|NCF=${data.ncf}|TOTAL=${data.total}|FECHA=${data.date}`;
+    // ================= ENVÍO CRUDO =================
+    // Bytes ESC/POS (base64) tal cual, p.ej. pre-renderizados en el backend.
+    // `jobId` hace el envío idempotente: un reintento no imprime dos veces
+    async sendRaw(base64Data, jobId = null) {
+        const body = { data: base64Data };
+        if (jobId) {
+            body.job_id = String(jobId);
+        }
+        const response = await fetch("http://127.0.0.1:5001/print", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify(body),
+        });
 
-            cmds.push('\n');
-            cmds.push(PAD + this.normalize('VERIFICACION FISCAL') + '\n');
-            cmds.push(this.buildQR(qrData));
-            cmds.push('\n');
-            cmds.push(PAD + this.normalize('CONSERVE ESTE COMPROBANTE') + '\n');
+        if (!response.ok) {
+            throw new Error("Error en servicio de impresión local");
+        }
 
-            // Espacio antes del corte
-            cmds.push('\n\n\n');
-            cmds.push('\x1D\x56\x00');  // Corte
+        console.log("🟢 Ticket fiscal enviado al servicio local");
+    },
 
-            const fullCommand = cmds.join("");
-            const base64Data = btoa(unescape(encodeURIComponent(fullCommand)));
+    async printRaw(base64Data, jobId = null) {
+        try {
+            await this.sendRaw(base64Data, jobId);
+        } catch (err) {
+            console.error("❌ Error impresión local:", err);
+            throw err;
+        }
+    },
 
-            const response = await fetch("http://127.0.0.1:5001/print", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ data: base64Data }),
-            });
+    bytesToBase64(bytes) {
+        let binary = "";
+        for (let start = 0; start < bytes.length; start += 0x8000) {
+            binary += String.fromCharCode.apply(null, bytes.subarray(start, start + 0x8000));
+        }
+        return btoa(binary);
+    },
 
-            if (!response.ok) {
-                throw new Error("Error en servicio de impresión local");
-            }
+    /**
+     * Reimpresión por lote: pide los tickets ESC/POS concatenados
+     * (`references`, `id_from`/`id_to` o `session_id`) y los envía a
+     * la impresora como UN solo trabajo. Devuelve cuántos se enviaron.
+     */
+    async printBatch(params) {
+        const response = await fetch("/lms/pos/reprint_fiscal_batch", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ ...params, format: "escpos" }),
+        });
 
-            console.log("🟢 Ticket fiscal enviado al servicio local");
+        if (!response.ok) {
+            throw new Error("Error obteniendo la reimpresión por lote");
+        }
 
-        } catch (err) {
-            console.error("❌ Error impresión local:", err);
+        const bytes = new Uint8Array(await response.arrayBuffer());
+        if (!bytes.length) {
+            return 0;
         }
+
+        await this.sendRaw(this.bytesToBase64(bytes));
+
+        return Number(response.headers.get("X-LMS-Invoice-Count") || 0);
+    },
+
+    // Ticket pre-renderizado si existe; si no, se arma en el navegador
+    renderJob(data) {
+        return data.escpos || this.renderTicket(data);
+    },
+
+    async printJob(data) {
+        return this.printRaw(this.renderJob(data), data.job_id);
     }
 };
\ No newline at end of file
@@ -0,0 +1,244 @@
+console.log("🟢 fiscal_print_spool.js CARGADO (INDEXEDDB)");
+
+/* =========================================================
+   SPOOL DE IMPRESIÓN EN EL NAVEGADOR (IndexedDB)
+
+   Cada trabajo reclamado se guarda YA renderizado (bytes ESC/POS
+   en base64) junto con su factura antes de enviarlo a la impresora:
+   - "print": falta imprimir; si el servicio local no responde se
+     reintenta con backoff, en orden de trabajo.
+   - "ack": impreso; falta confirmarlo al backend, en bloque.
+   Un corte de red o de impresora no pierde ni duplica recibos: al
+   volver la conexión se vacía todo sin esperas.
+   ========================================================= */
+
+window.lmsFiscalSpool = {
+
+    DB_NAME: "lms_fiscal_spool",
+    STORE: "jobs",
+
+    BACKOFF_BASE_MS: 1000,
+    BACKOFF_MAX_MS: 60000,
+    ACK_BATCH_SIZE: 100,
+
+    _db: null,
+    _memory: null,
+    _retryTimer: null,
+
+    // ================= ALMACENAMIENTO =================
+    open() {
+        if (!this._db) {
+            this._db = new Promise((resolve) => {
+                if (!window.indexedDB) {
+                    resolve(null);
+                    return;
+                }
+                const request = window.indexedDB.open(this.DB_NAME, 1);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore(this.STORE, { keyPath: "job_id" });
+                };
+                request.onsuccess = () => resolve(request.result);
+                // Modo privado / cuota: spool en memoria (mejor que nada)
+                request.onerror = () => {
+                    console.warn("⚠️ IndexedDB no disponible, spool en memoria");
+                    resolve(null);
+                };
+            });
+        }
+        return this._db;
+    },
+
+    async _tx(mode, fn) {
+        const db = await this.open();
+        if (!db) {
+            this._memory = this._memory || new Map();
+            return fn(null);
+        }
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(this.STORE, mode);
+            const result = fn(tx.objectStore(this.STORE));
+            tx.oncomplete = () => resolve(result?.result ?? result);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    },
+
+    async _all(configId) {
+        const entries = await this._tx("readonly", (store) =>
+            store ? store.getAll() : [...this._memory.values()]
+        );
+        return entries
+            .filter((entry) => entry.config_id === configId)
+            .sort((a, b) => a.job_id - b.job_id);
+    },
+
+    async _put(entries) {
+        if (!entries.length) {
+            return;
+        }
+        await this._tx("readwrite", (store) => {
+            for (const entry of entries) {
+                if (store) {
+                    store.put(entry);
+                } else {
+                    this._memory.set(entry.job_id, entry);
+                }
+            }
+        });
+    },
+
+    async _delete(jobIds) {
+        if (!jobIds.length) {
+            return;
+        }
+        await this._tx("readwrite", (store) => {
+            for (const jobId of jobIds) {
+                if (store) {
+                    store.delete(jobId);
+                } else {
+                    this._memory.delete(jobId);
+                }
+            }
+        });
+    },
+
+    // ================= ENTRADA =================
+    /**
+     * Guarda los trabajos reclamados (payload legacy + job_id).
+     * Un trabajo que ya está en el spool (reclamado de nuevo tras
+     * expirar el reclamo) solo actualiza su token: no se reimprime.
+     * Devuelve los que no se pudieron renderizar.
+     */
+    async add(configId, jobs, claimToken) {
+        const known = new Map((await this._all(configId)).map((e) => [e.job_id, e]));
+        const entries = [];
+        const failed = [];
+
+        for (const job of jobs) {
+            const entry = known.get(job.job_id);
+            if (entry) {
+                entry.claim_token = claimToken;
+                entries.push(entry);
+                continue;
+            }
+
+            let escpos;
+            try {
+                escpos = window.lmsFiscalQZ.renderJob(job);
+            } catch (err) {
+                console.error("❌ Error armando ticket fiscal:", err);
+                failed.push({ job_id: job.job_id, error: String(err?.message || err) });
+                continue;
+            }
+
+            entries.push({
+                job_id: job.job_id,
+                invoice_id: job.invoice_id,
+                config_id: configId,
+                claim_token: claimToken,
+                trace_id: job.trace_id || false,
+                escpos,
+                state: "print",
+                attempts: 0,
+                next_try: 0,
+                print_ms: null,
+                spooled_at: Date.now(),
+            });
+        }
+
+        await this._put(entries);
+
+        // No se pudieron armar → el backend los reintenta con backoff
+        return failed;
+    },
+
+    // ================= IMPRESIÓN =================
+    /**
+     * Imprime lo pendiente EN ORDEN y se detiene en el primer fallo
+     * (ningún recibo se adelanta a otro). `force` ignora el backoff:
+     * al volver la conexión se vacía todo de una vez.
+     * Devuelve cuántos se imprimieron.
+     */
+    async print(configId, { force = false } = {}) {
+        const pending = (await this._all(configId)).filter((e) => e.state === "print");
+        let printed = 0;
+
+        for (const entry of pending) {
+            if (!force && entry.next_try > Date.now()) {
+                this._scheduleRetry(configId, entry.next_try - Date.now());
+                break;
+            }
+
+            const started = performance.now();
+            try {
+                await window.lmsFiscalQZ.sendRaw(entry.escpos, entry.job_id);
+            } catch (err) {
+                console.error("❌ Error impresión fiscal (en spool):", err);
+                entry.attempts += 1;
+                const delay = Math.min(
+                    this.BACKOFF_BASE_MS * 2 ** entry.attempts,
+                    this.BACKOFF_MAX_MS
+                );
+                entry.next_try = Date.now() + delay;
+                await this._put([entry]);
+                this._scheduleRetry(configId, delay);
+                break;
+            }
+
+            entry.state = "ack";
+            entry.print_ms = Math.round(performance.now() - started);
+            await this._put([entry]);
+            printed += 1;
+        }
+
+        return printed;
+    },
+
+    _scheduleRetry(configId, delay) {
+        clearTimeout(this._retryTimer);
+        this._retryTimer = setTimeout(() => {
+            this._retryTimer = null;
+            window.dispatchEvent(new CustomEvent("lms-fiscal-spool-retry", {
+                detail: { configId },
+            }));
+        }, delay);
+    },
+
+    // ================= CONFIRMACIÓN EN BLOQUE =================
+    /**
+     * Confirma al backend lo impreso, en bloques. Si el backend no
+     * responde, las confirmaciones quedan en el spool para la próxima.
+     * Solo se borra lo que el backend confirmó (o ya cerró): un trabajo
+     * reclamado de nuevo con otro token espera a que `add` lo actualice.
+     */
+    async flushAcks(configId, send) {
+        const done = (await this._all(configId)).filter((e) => e.state === "ack");
+
+        for (let start = 0; start < done.length; start += this.ACK_BATCH_SIZE) {
+            const batch = done.slice(start, start + this.ACK_BATCH_SIZE);
+            const result = await send(batch.map((e) => ({
+                job_id: e.job_id,
+                claim_token: e.claim_token,
+                print_ms: e.print_ms,
+            })));
+            if (!result?.ok) {
+                return false;
+            }
+            // Confirmados, cerrados o rechazados (mal formados): fuera
+            const settled = new Set([
+                ...(result.job_ids || []),
+                ...(result.closed_ids || []),
+                ...(result.rejected || []),
+            ]);
+            await this._delete(
+                batch.map((e) => e.job_id).filter((jobId) => settled.has(jobId))
+            );
+        }
+
+        return true;
+    },
+
+    async pendingCount(configId) {
+        return (await this._all(configId)).filter((e) => e.state === "print").length;
+    },
+};
@@ -1,6 +1,7 @@
 /** @odoo-module **/
 
 import { PaymentScreen } from "@point_of_sale/app/screens/payment_screen/payment_screen";
+import { PosStore } from "@point_of_sale/app/store/pos_store";
 import { patch } from "@web/core/utils/patch";
 
 /* =========================================================
@@ -8,7 +9,70 @@ import { patch } from "@web/core/utils/patch";
    ========================================================= */
 
 let fiscalPrintInProgress = false;
-let lastPrintedInvoiceId = null;
+let drainRequested = false;
+let drainForced = false;
+let posConfigId = null;
+
+// Trabajos reclamados por vuelta a la cola de impresión
+const CLAIM_BATCH_SIZE = 10;
+
+// Polling lento SOLO mientras el bus está desconectado
+const FALLBACK_POLL_INTERVAL = 15000;
+let fallbackPollTimer = null;
+
+/* =========================================================
+   DISPONIBILIDAD NCF LOCAL (cargada al abrir, actualizada por bus)
+   ========================================================= */
+
+// Cliente con RNC → B01 | Consumidor final → B02
+function ncfTypeFor(partner) {
+    return partner && partner.vat ? "01" : "02";
+}
+
+function localNcfStatus(pos, partner) {
+    return pos.lmsNcfAvailability?.[ncfTypeFor(partner)] || null;
+}
+
+/* =========================================================
+   CUPO NCF DE LA SESIÓN (VALIDACIÓN OPTIMISTA)
+   El servidor pre-asigna NCF a la sesión; la caja descuenta
+   localmente y solo espera al servidor si el cupo llega a 0.
+   ========================================================= */
+
+let quotaRefresh = null;
+
+function localNcfQuota(pos, partner) {
+    const quota = pos.lmsNcfQuota?.[ncfTypeFor(partner)];
+    return quota === undefined || quota === null ? null : quota;
+}
+
+/* =========================================================
+   TRAZA POR VENTA (validateOrder → mark_fiscal_printed)
+   ========================================================= */
+
+function newTraceId() {
+    if (window.crypto?.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}`;
+}
+
+function refreshNcfQuota(pos) {
+    if (!quotaRefresh) {
+        quotaRefresh = rpc("/lms/pos/ncf_quota", { session_id: pos.session.id })
+            .then((result) => {
+                if (result?.quota) {
+                    pos.lmsNcfQuota = result.quota;
+                    pos.lmsNcfQuotaWatermark = result.watermark;
+                }
+            })
+            .catch(() => {})
+            .finally(() => {
+                quotaRefresh = null;
+            });
+    }
+    return quotaRefresh;
+}
 
 /* =========================================================
    PATCH PAYMENT SCREEN
@@ -27,10 +91,17 @@ patch(PaymentScreen.prototype, {
        ===================================================== */
 
     get ncfWarningMessage() {
-        const order = this.env.services.pos.get_order();
+        const pos = this.env.services.pos;
+        const order = pos.get_order();
         const partner = order?.get_partner();
         const partnerId = partner ? partner.id : "CF";
 
+        // ⚡ Estado local → sin RPC al cambiar de cliente
+        const status = localNcfStatus(pos, partner);
+        if (status) {
+            return status.ok && !status.warning ? null : status.message;
+        }
+
         // 🔁 Si cambió el cliente → recalcular
         if (this._ncfWarningPartnerId !== partnerId) {
             this._ncfWarningPartnerId = partnerId;
@@ -77,48 +148,83 @@ patch(PaymentScreen.prototype, {
 
     async validateOrder(isForceValidate) {
 
-        const order = this.env.services.pos.get_order();
+        const pos = this.env.services.pos;
+        const order = pos.get_order();
         const partner = order?.get_partner();
+        const status = localNcfStatus(pos, partner);
+        const ncfType = ncfTypeFor(partner);
 
-        try {
-            const response = await fetch("/lms/pos/check_ncf_available", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
-                    jsonrpc: "2.0",
-                    method: "call",
-                    params: {
-                        partner_id: partner ? partner.id : false,
-                    },
-                    id: Date.now(),
-                }),
-            });
-
-            const data = await response.json();
-
-            // 🔴 BLOQUEO TOTAL
-            if (!data?.result?.ok) {
-                this._ncfWarningCache = data.result.message;
+        if (localNcfQuota(pos, partner) !== null) {
+            // ⚡ Cupo local: solo se espera al servidor si se agotó
+            if (localNcfQuota(pos, partner) <= 0) {
+                await refreshNcfQuota(pos);
+            }
+            if (!(localNcfQuota(pos, partner) > 0)) {
+                this._ncfWarningCache =
+                    status?.message ||
+                    `No hay NCF disponible para este tipo de cliente.\n(Tipo requerido: B${ncfType})\nContacte al administrador.`;
+                this.render();
+                return false;
+            }
+        } else if (status) {
+            // 🔴 BLOQUEO TOTAL (sin esperar al servidor)
+            if (!status.ok) {
+                this._ncfWarningCache = status.message;
+                this.render();
+                return false;
+            }
+        } else {
+            try {
+                const response = await fetch("/lms/pos/check_ncf_available", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({
+                        jsonrpc: "2.0",
+                        method: "call",
+                        params: {
+                            partner_id: partner ? partner.id : false,
+                        },
+                        id: Date.now(),
+                    }),
+                });
+
+                const data = await response.json();
+
+                // 🔴 BLOQUEO TOTAL
+                if (!data?.result?.ok) {
+                    this._ncfWarningCache = data.result.message;
+                    this.render();
+                    return false;
+                }
+
+            } catch {
+                this._ncfWarningCache = "Error verificando disponibilidad de NCF";
                 this.render();
                 return false;
             }
-
-        } catch {
-            this._ncfWarningCache = "Error verificando disponibilidad de NCF";
-            this.render();
-            return false;
         }
 
         const result = await super.validateOrder(isForceValidate);
 
+        if (result !== false && localNcfQuota(pos, partner) !== null) {
+            pos.lmsNcfQuota[ncfType] -= 1;
+            if (pos.lmsNcfQuota[ncfType] <= (pos.lmsNcfQuotaWatermark || 0)) {
+                refreshNcfQuota(pos);
+            }
+        }
+
         if (order && order.pos_reference) {
+            const traceId = newTraceId();
             fetch("/lms/pos/trigger_fiscal_invoice", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify({
                     jsonrpc: "2.0",
                     method: "call",
-                    params: { pos_reference: order.pos_reference },
+                    params: {
+                        pos_reference: order.pos_reference,
+                        trace_id: traceId,
+                    },
                     id: Date.now(),
                 }),
             }).catch(() => {});
@@ -129,47 +235,190 @@ patch(PaymentScreen.prototype, {
 });
 
 /* =========================================================
-   POLLING IMPRESIÓN (SIN CAMBIOS)
+   IMPRESIÓN POR EVENTO (BUS) + POLLING DE RESPALDO
    ========================================================= */
 
-async function pollFiscalBackend() {
+async function rpc(url, params) {
+    const response = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+            jsonrpc: "2.0",
+            method: "call",
+            params: params || {},
+            id: Date.now(),
+        }),
+    });
+    const data = await response.json();
+    return data?.result;
+}
 
-    if (fiscalPrintInProgress) return;
+/* =========================================================
+   PROTOCOLO COMPACTO v2
+   Compañía, moneda y rangos NCF se piden una vez por sesión;
+   cada trabajo llega con ids y líneas en columnas, y aquí se
+   reconstruye el payload legacy que espera printTicket.
+   ========================================================= */
 
-    try {
-        const response = await fetch("/lms/pos/next_fiscal_invoice", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-                jsonrpc: "2.0",
-                method: "call",
-                params: {},
-                id: Date.now(),
-            }),
-        });
+const COMPACT_PROTOCOL_VERSION = 2;
+let fiscalStatic = null;
+let compactUnsupported = false;
 
-        const data = await response.json();
-        if (!data?.result?.ready) return;
+async function loadFiscalStatic() {
+    const data = await rpc("/lms/pos/v2/fiscal_static", { config_id: posConfigId });
+    if (data?.v === COMPACT_PROTOCOL_VERSION) {
+        fiscalStatic = data;
+    }
+    return fiscalStatic;
+}
 
-        const invoiceId = data.result.invoice_id;
-        if (lastPrintedInvoiceId === invoiceId) return;
+function knowsStatic(job) {
+    return Boolean(
+        fiscalStatic &&
+        fiscalStatic.companies[job.company] &&
+        fiscalStatic.currencies[job.currency] &&
+        (!job.range || job.range in fiscalStatic.ranges)
+    );
+}
 
-        fiscalPrintInProgress = true;
+function expandCompactJob(job, names, claimToken) {
+    const [subtotal, tax, total, amountPaid, change] = job.totals;
+    const [nameIds, qtys, prices] = job.lines;
+
+    return {
+        company: fiscalStatic.companies[job.company],
+        invoice_id: job.id,
+        invoice_number: job.number,
+        ncf: job.ncf,
+        date: job.date,
+        valid_until: job.range ? fiscalStatic.ranges[job.range] : "",
+        currency: fiscalStatic.currencies[job.currency],
+        cashier: job.cashier,
+        partner: { name: job.partner[0], rnc: job.partner[1] },
+        subtotal,
+        tax,
+        total,
+        payments: job.payments.map(([method, amount]) => ({ method, amount })),
+        amount_paid: amountPaid,
+        change,
+        lines: nameIds.map((nameId, i) => ({
+            name: names[nameId],
+            qty: qtys[i],
+            price: prices[i],
+        })),
+        ready: true,
+        job_id: job.job_id,
+        trace_id: job.trace_id,
+        claim_token: claimToken,
+        escpos: job.escpos,
+    };
+}
 
-        await window.lmsFiscalQZ.printTicket(data.result);
+async function claimCompact() {
+    const response = await fetch("/lms/pos/v2/claim_fiscal_print_jobs", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ config_id: posConfigId, limit: CLAIM_BATCH_SIZE }),
+    });
+    if (response.status === 404) {
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
 
-        await fetch("/lms/pos/mark_fiscal_printed", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-                jsonrpc: "2.0",
-                method: "call",
-                params: { invoice_id: invoiceId },
-                id: Date.now(),
-            }),
-        });
+    const data = await response.json();
+    if (data?.v !== COMPACT_PROTOCOL_VERSION) {
+        return null;
+    }
+
+    // Rango nuevo (o caché de otra sesión) → recargar estáticos una vez
+    if (data.jobs.some((job) => !knowsStatic(job))) {
+        await loadFiscalStatic();
+    }
+
+    return {
+        claim_token: data.claim_token,
+        jobs: data.jobs.map((job) => expandCompactJob(job, data.names, data.claim_token)),
+    };
+}
+
+/**
+ * Reclama trabajos: protocolo compacto si el servidor lo ofrece,
+ * si no, el endpoint JSON-RPC de siempre (payload completo).
+ */
+async function claimPrintJobs() {
+    if (!compactUnsupported) {
+        const result = await claimCompact();
+        if (result) {
+            return result;
+        }
+        compactUnsupported = true;
+    }
+    return rpc("/lms/pos/claim_fiscal_print_jobs", {
+        config_id: posConfigId,
+        limit: CLAIM_BATCH_SIZE,
+    });
+}
+
+function sendAcks(acks) {
+    return rpc("/lms/pos/ack_fiscal_print_jobs", { acks });
+}
+
+/**
+ * Vacía la cola de impresión de la caja EN ORDEN, a través del spool
+ * local (IndexedDB): reclamar → guardar renderizado → imprimir →
+ * confirmar en bloque. Si el backend no responde se sigue imprimiendo
+ * lo del spool; si la impresora no responde, el spool reintenta con
+ * backoff. `force`: al volver la conexión, vaciar sin esperar backoff.
+ */
+async function drainPrintQueue({ force = false } = {}) {
+
+    const spool = window.lmsFiscalSpool;
+
+    if (fiscalPrintInProgress) {
+        drainRequested = true;
+        drainForced = drainForced || force;
+        return;
+    }
+    fiscalPrintInProgress = true;
+
+    try {
+        do {
+            drainRequested = false;
+            force = force || drainForced;
+            drainForced = false;
+
+            // Confirmaciones que quedaron de un corte anterior
+            await spool.flushAcks(posConfigId, sendAcks).catch(() => false);
+
+            let claimed = 0;
+            try {
+                const result = await claimPrintJobs();
+                const jobs = result?.jobs || [];
+                claimed = jobs.length;
+
+                const failed = await spool.add(posConfigId, jobs, result?.claim_token);
+                for (const { job_id, error } of failed) {
+                    await rpc("/lms/pos/fail_fiscal_print_jobs", {
+                        job_ids: [job_id],
+                        claim_token: result.claim_token,
+                        error,
+                    });
+                }
+            } catch (err) {
+                console.error("⚠️ Backend fiscal inaccesible, imprimiendo desde el spool:", err);
+            }
 
-        lastPrintedInvoiceId = invoiceId;
+            await spool.print(posConfigId, { force });
+            await spool.flushAcks(posConfigId, sendAcks).catch(() => false);
+
+            // Más trabajos en el backend y la impresora al día → otra vuelta
+            if (claimed === CLAIM_BATCH_SIZE && !(await spool.pendingCount(posConfigId))) {
+                drainRequested = true;
+            }
+            force = false;
+        } while (drainRequested);
 
     } catch (err) {
         console.error("❌ Error impresión fiscal:", err);
@@ -178,4 +427,66 @@ async function pollFiscalBackend() {
     }
 }
 
-setInterval(pollFiscalBackend, 2000);
+const pollFiscalBackend = () => drainPrintQueue();
+
+function startFallbackPolling() {
+    if (!fallbackPollTimer) {
+        fallbackPollTimer = setInterval(pollFiscalBackend, FALLBACK_POLL_INTERVAL);
+    }
+}
+
+function stopFallbackPolling() {
+    if (fallbackPollTimer) {
+        clearInterval(fallbackPollTimer);
+        fallbackPollTimer = null;
+    }
+}
+
+patch(PosStore.prototype, {
+
+    async setup() {
+        await super.setup(...arguments);
+
+        posConfigId = this.config.id;
+
+        // 📦 Disponibilidad NCF: una carga al abrir, luego push por bus
+        this.lmsNcfAvailability = null;
+        rpc("/lms/pos/ncf_availability")
+            .then((status) => {
+                this.lmsNcfAvailability = status || null;
+            })
+            .catch(() => {});
+        this.onNotified("LMS_NCF_AVAILABILITY", (status) => {
+            this.lmsNcfAvailability = status;
+        });
+
+        // 🎟️ Cupo NCF pre-asignado a la sesión
+        this.lmsNcfQuota = null;
+        this.lmsNcfQuotaWatermark = 0;
+        refreshNcfQuota(this);
+
+        // 🗜️ Datos estáticos del protocolo compacto (una vez por sesión)
+        fiscalStatic = null;
+        compactUnsupported = false;
+        loadFiscalStatic().catch(() => {});
+
+        // 🔔 El backend avisa por bus cuando hay trabajos en cola
+        this.onNotified("LMS_FISCAL_PRINT_READY", pollFiscalBackend);
+
+        // 🖨️ Reintento del spool (impresora local caída → backoff)
+        window.addEventListener("lms-fiscal-spool-retry", pollFiscalBackend);
+
+        // 🔌 Volvió la conexión → vaciar spool y cola a toda velocidad
+        const drainNow = () => drainPrintQueue({ force: true });
+        window.addEventListener("online", drainNow);
+
+        this.bus.addEventListener("disconnect", startFallbackPolling);
+        this.bus.addEventListener("reconnect", () => {
+            stopFallbackPolling();
+            drainNow();
+        });
+
+        // Recuperar lo que quedó pendiente antes de abrir la caja
+        pollFiscalBackend();
+    },
+});
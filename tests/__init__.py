@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from . import test_bench_fiscal
+from . import test_dgii_607
+from . import test_ncf_block
+from . import test_fiscal_print_job
+from . import test_pos_invoice_queue
+from . import test_reconcile_state
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import fields
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+from ..models import ncf_block
+
+
+class LmsFiscalCommon(AccountTestInvoicingCommon):
+    """
+    Compañía con plan contable, rangos NCF B01/B02 vigentes y un
+    método de pago en efectivo; cada prueba abre las cajas que necesite.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.company = cls.company_data["company"]
+
+        Range = cls.env["l10n_do.ncf.range"].sudo()
+        cls.ncf_ranges = {
+            ncf_type: Range.create(cls._lms_range_vals(ncf_type, 1, 1000))
+            for ncf_type in ("01", "02")
+        }
+
+        cls.pos_journal = cls.env["account.journal"].create({
+            "name": "POS LMS",
+            "code": "LPOS",
+            "type": "general",
+            "company_id": cls.company.id,
+        })
+        cls.cash_method = cls.env["pos.payment.method"].create({
+            "name": "Efectivo LMS",
+            "journal_id": cls.company_data["default_journal_cash"].id,
+            "company_id": cls.company.id,
+        })
+        cls.product = cls.env["product.product"].create({
+            "name": "Artículo LMS",
+            "list_price": 100.0,
+            "available_in_pos": True,
+            "taxes_id": [(5, 0, 0)],
+        })
+
+    @classmethod
+    def _lms_range_vals(cls, ncf_type, first, last, **extra):
+        vals = {
+            "company_id": cls.company.id,
+            "ncf_type": ncf_type,
+            "active": True,
+            ncf_block.RANGE_COUNTER_FIELD: first,
+            ncf_block.RANGE_END_FIELD: last,
+            "date_end": fields.Date.today() + timedelta(days=365),
+        }
+        vals.update(extra)
+        return vals
+
+    @classmethod
+    def _lms_open_session(cls, name="Caja LMS"):
+        config = cls.env["pos.config"].create({
+            "name": name,
+            "company_id": cls.company.id,
+            "journal_id": cls.pos_journal.id,
+            "invoice_journal_id": cls.company_data["default_journal_sale"].id,
+            "payment_method_ids": [(6, 0, cls.cash_method.ids)],
+        })
+        session = cls.env["pos.session"].create({
+            "config_id": config.id,
+            "user_id": cls.env.uid,
+        })
+        session.action_pos_session_open()
+        return session
+
+    @classmethod
+    def _lms_orders(cls, session, count=1, price=100.0, qty=1, partner=False):
+        """Órdenes ya cobradas (`paid`); `qty` negativa → devolución."""
+
+        total = price * qty
+        return cls.env["pos.order"].create([
+            {
+                "session_id": session.id,
+                "company_id": cls.company.id,
+                "partner_id": partner and partner.id,
+                "state": "paid",
+                "amount_tax": 0.0,
+                "amount_total": total,
+                "amount_paid": total,
+                "amount_return": 0.0,
+                "lines": [(0, 0, {
+                    "product_id": cls.product.id,
+                    "qty": qty,
+                    "price_unit": price,
+                    "price_subtotal": total,
+                    "price_subtotal_incl": total,
+                })],
+                "payment_ids": [(0, 0, {
+                    "payment_method_id": cls.cash_method.id,
+                    "amount": total,
+                    "payment_date": fields.Datetime.now(),
+                })],
+            }
+            for _number in range(count)
+        ])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import os
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models import ncf_block
+
+
+def _load_script(name):
+    """Los scripts no son paquete: se cargan por ruta, como en odoo shell."""
+
+    path = os.path.join(os.path.dirname(__file__), os.pardir, "scripts", name + ".py")
+    spec = importlib.util.spec_from_file_location("lms_%s" % name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@tagged("post_install", "-at_install")
+class TestBenchFiscalSeed(TransactionCase):
+    """Que un cambio de modelos no rompa en silencio el benchmark."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bench = _load_script("bench_fiscal")
+
+    def test_range_vals_match_block_sequence(self):
+        vals = self.bench._range_vals(self.env, self.env.company, "02", 10)
+        Range = self.env["l10n_do.ncf.range"]
+        for name in vals:
+            self.assertIn(name, Range._fields)
+        self.assertEqual(vals[ncf_block.RANGE_COUNTER_FIELD], 1)
+        self.assertEqual(vals[ncf_block.RANGE_END_FIELD], 20)
+
+    def test_seed_reserves_from_seeded_ranges(self):
+        env, company, session, orders = self.bench.seed(self.env, 3, 1)
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(set(orders.mapped("state")), {"paid"})
+
+        taken = env["lms.ncf.block"].sudo()._lms_take_numbers(session, company, "02", 2)
+        self.assertEqual([ncf for _range, ncf in taken], ["B0200000001", "B0200000002"])
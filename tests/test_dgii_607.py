@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from odoo.tests import TransactionCase, tagged
+
+from ..services.dgii_607 import COLUMNS
+
+
+@tagged("post_install", "-at_install")
+class TestDgii607Rows(TransactionCase):
+
+    def _row(self, move_type, total, cash, card, transfer=0.0):
+        Export = self.env["lms.dgii.607.export"]
+        moves = [(
+            1, move_type, date(2025, 1, 15), "B0100000001", False,
+            "131000001", total / 1.18, total - total / 1.18, total,
+        )]
+        row = next(Export._lms_rows(moves, {1: (cash, transfer, card)}))
+        return dict(zip(COLUMNS, row))
+
+    def test_invoice_payment_split(self):
+        row = self._row("out_invoice", 118.0, 100.0, 18.0)
+        self.assertEqual(row["efectivo"], "100.00")
+        self.assertEqual(row["tarjeta"], "18.00")
+        self.assertEqual(row["venta_credito"], "0.00")
+
+    def test_refund_payments_are_not_credit(self):
+        # Devolución POS: pagos negativos, montos en absoluto
+        row = self._row("out_refund", 118.0, -100.0, -18.0)
+        self.assertEqual(row["efectivo"], "100.00")
+        self.assertEqual(row["tarjeta"], "18.00")
+        self.assertEqual(row["venta_credito"], "0.00")
+
+    def test_refund_without_pos_payment_is_credit(self):
+        row = self._row("out_refund", 118.0, 0.0, 0.0)
+        self.assertEqual(row["efectivo"], "0.00")
+        self.assertEqual(row["venta_credito"], "118.00")
+
+    def test_transfer_column(self):
+        row = self._row("out_invoice", 118.0, 18.0, 0.0, transfer=100.0)
+        self.assertEqual(row["efectivo"], "18.00")
+        self.assertEqual(row["cheque_transferencia"], "100.00")
+        self.assertEqual(row["tarjeta"], "0.00")
+        self.assertEqual(row["venta_credito"], "0.00")
+
+    def test_refund_transfer_is_positive(self):
+        row = self._row("out_refund", 118.0, 0.0, 0.0, transfer=-118.0)
+        self.assertEqual(row["cheque_transferencia"], "118.00")
+        self.assertEqual(row["venta_credito"], "0.00")
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from odoo import fields
+from odoo.tests import tagged
+
+from ..models.fiscal_print_job import CLAIM_TIMEOUT, MAX_ATTEMPTS
+from .common import LmsFiscalCommon
+
+
+@tagged("post_install", "-at_install")
+class TestFiscalPrintJob(LmsFiscalCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Job = cls.env["lms.fiscal.print.job"].sudo()
+        cls.config = cls._lms_open_session().config_id
+
+    def _jobs(self, count):
+        invoices = self.env["account.move"].concat(*(
+            self.init_invoice("out_invoice", amounts=[100.0]) for _number in range(count)
+        ))
+        return self.Job.create([
+            {
+                "invoice_id": invoice.id,
+                "config_id": self.config.id,
+                "company_id": self.company.id,
+                "idempotency_key": self.Job._lms_idempotency_key(invoice),
+            }
+            for invoice in invoices
+        ])
+
+    def test_claims_are_disjoint_and_in_order(self):
+        jobs = self._jobs(4)
+
+        first, token_1 = self.Job._lms_claim(self.config.id, limit=2)
+        second, token_2 = self.Job._lms_claim(self.config.id, limit=10)
+
+        self.assertEqual(first, jobs[:2])
+        self.assertEqual(second, jobs[2:])
+        self.assertNotEqual(token_1, token_2)
+        self.assertFalse(self.Job._lms_claim(self.config.id)[0])
+
+    def test_stale_token_ack_is_rejected(self):
+        job = self._jobs(1)
+        _jobs, stale = self.Job._lms_claim(self.config.id)
+
+        # Reclamo abandonado → vuelve a la cola y otra pestaña lo toma
+        job.claimed_at = fields.Datetime.now() - CLAIM_TIMEOUT * 2
+        _jobs, fresh = self.Job._lms_claim(self.config.id)
+
+        self.assertFalse(job._lms_ack(stale))
+        self.assertEqual((job.state, job.claim_token), ("claimed", fresh))
+        self.assertFalse(job.invoice_id.lms_fiscal_printed)
+
+        self.assertEqual(job._lms_ack(fresh), job)
+        self.assertEqual(job.state, "done")
+        self.assertTrue(job.invoice_id.lms_fiscal_printed)
+        self.assertFalse(job.invoice_id.lms_fiscal_pending_print)
+
+    def test_ack_requires_token(self):
+        job = self._jobs(1)
+        self.Job._lms_claim(self.config.id)
+
+        self.assertFalse(job._lms_ack(None))
+        self.assertFalse(job._lms_ack(""))
+        self.assertEqual(job.state, "claimed")
+
+    def test_fail_backs_off_then_gives_up(self):
+        job = self._jobs(1)
+        self.Job._lms_claim(self.config.id)
+
+        job._lms_fail("sin papel")
+        self.assertEqual((job.state, job.attempts, job.claim_token), ("pending", 1, False))
+        self.assertGreater(job.next_attempt_at, fields.Datetime.now())
+        # En backoff: no se vuelve a entregar todavía
+        self.assertFalse(self.Job._lms_claim(self.config.id)[0])
+
+        job.attempts = MAX_ATTEMPTS - 1
+        job._lms_fail("sin papel")
+        self.assertEqual(job.state, "failed")
+
+        job.action_retry()
+        self.assertEqual((job.state, job.attempts), ("pending", 0))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from ..models.ncf_block import NCF_BLOCK_SIZE_PARAM, RANGE_COUNTER_FIELD
+from .common import LmsFiscalCommon
+
+
+@tagged("post_install", "-at_install")
+class TestNcfBlock(LmsFiscalCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env["ir.config_parameter"].sudo().set_param(NCF_BLOCK_SIZE_PARAM, 3)
+        cls.Block = cls.env["lms.ncf.block"].sudo()
+        cls.session_a = cls._lms_open_session("Caja A")
+        cls.session_b = cls._lms_open_session("Caja B")
+
+    def _take(self, session, count, ncf_type="02"):
+        return [
+            ncf for _range, ncf in
+            self.Block._lms_take_numbers(session, self.company, ncf_type, count)
+        ]
+
+    def test_no_duplicate_ncf_across_sessions(self):
+        # Intercaladas y cruzando bloques: cada caja con su bloque propio
+        taken = []
+        for _round in range(3):
+            taken += self._take(self.session_a, 2)
+            taken += self._take(self.session_b, 2)
+
+        self.assertEqual(len(taken), 12)
+        self.assertEqual(len(set(taken)), 12)
+        self.assertEqual(self.ncf_ranges["02"][RANGE_COUNTER_FIELD], 13)
+
+        blocks = self.Block.search([("company_id", "=", self.company.id)])
+        self.assertEqual(set(blocks.session_id.ids), {self.session_a.id, self.session_b.id})
+
+    def test_released_gap_is_reused_once(self):
+        first = self._take(self.session_a, 1)
+        self.Block._lms_release_session_blocks(self.session_a)
+
+        gap = self.env["lms.ncf.gap"].search([("company_id", "=", self.company.id)])
+        self.assertEqual((gap.number_start, gap.number_end, gap.state), (2, 3, "open"))
+
+        # El hueco se usa antes que el rango y no repite lo ya emitido
+        second = self._take(self.session_b, 2)
+        self.assertEqual(second, ["B0200000002", "B0200000003"])
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(gap.state, "reused")
+        self.assertEqual(self.ncf_ranges["02"][RANGE_COUNTER_FIELD], 4)
+
+    def test_gap_of_expired_range_is_not_reused(self):
+        self._take(self.session_a, 1)
+        self.Block._lms_release_session_blocks(self.session_a)
+        self.ncf_ranges["02"].date_end = fields.Date.today() - timedelta(days=1)
+
+        self.assertFalse(self.env["lms.ncf.gap"]._lms_claim(self.company, "02"))
+        self.assertEqual(self._take(self.session_b, 1), [])
+
+    def test_block_of_inactive_range_is_voided(self):
+        self._take(self.session_a, 1)
+        block = self.Block.search([("session_id", "=", self.session_a.id)])
+        self.ncf_ranges["02"].active = False
+
+        self.assertEqual(self._take(self.session_a, 1), [])
+        self.assertEqual(block.state, "released")
+        gap = self.env["lms.ncf.gap"].search([("block_id", "=", block.id)])
+        self.assertEqual((gap.state, gap.reason), ("void", "void"))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from contextlib import closing, contextmanager
+from unittest.mock import patch
+
+from odoo import sql_db
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from ..models.pos_invoice_queue import INVOICE_QUEUE_MAX_ATTEMPTS
+from .common import LmsFiscalCommon
+
+
+@tagged("post_install", "-at_install")
+class TestPosInvoiceQueue(LmsFiscalCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Queue = cls.env["lms.pos.invoice.queue"].sudo()
+        cls.session = cls._lms_open_session()
+        cls.invoice = cls.init_invoice("out_invoice", amounts=[100.0])
+
+    @contextmanager
+    def _invoicing(self, failing=None, stalled=False):
+        """
+        Motor por lotes simulado: las órdenes de `failing` levantan
+        (p. ej. B01 agotado); `stalled` no factura ni falla (bloqueo).
+        """
+
+        calls = []
+        invoice = self.invoice
+
+        def _lms_invoice_batch(orders):
+            calls.append(orders.ids)
+            if failing and orders & failing:
+                raise UserError("No hay NCF disponible (B01)")
+            if not stalled:
+                orders.write({"account_move": invoice.id})
+            return invoice
+
+        with patch.object(type(self.env["pos.order"]), "_lms_invoice_batch", _lms_invoice_batch):
+            yield calls
+
+    def _rows(self, orders):
+        return self.Queue.search([("order_id", "in", orders.ids)])
+
+    def test_refunds_and_zero_amount_are_never_enqueued(self):
+        refund = self._lms_orders(self.session, qty=-1)
+        zero = self._lms_orders(self.session, price=0.0)
+
+        self.assertFalse(self.Queue._lms_enqueue(refund | zero))
+        self.Queue._cron_lms_enqueue_pending_orders()
+        self.assertFalse(self._rows(refund | zero))
+
+    def test_refund_row_is_skipped_not_invoiced(self):
+        # Fila que llegó por otra vía (p. ej. anterior al filtro)
+        refund = self._lms_orders(self.session, qty=-1)
+        row = self.Queue.create({
+            "order_id": refund.id,
+            "company_id": self.company.id,
+            "config_id": refund.config_id.id,
+        })
+
+        with self._invoicing() as calls:
+            row._lms_process()
+
+        self.assertEqual(calls, [])
+        self.assertEqual(row.state, "skipped")
+        self.assertFalse(refund.account_move)
+
+    def test_failing_order_is_isolated(self):
+        good = self._lms_orders(self.session, count=3)
+        bad = self._lms_orders(self.session)
+        self.Queue._lms_enqueue(good | bad)
+        rows = self._rows(good | bad)
+
+        with self._invoicing(failing=bad):
+            self.assertFalse(rows._lms_process())
+
+        self.assertEqual(set(self._rows(good).mapped("state")), {"done"})
+        bad_row = self._rows(bad)
+        self.assertEqual((bad_row.state, bad_row.attempts), ("pending", 1))
+        self.assertIn("B01", bad_row.last_error)
+
+        bad_row.attempts = INVOICE_QUEUE_MAX_ATTEMPTS - 1
+        with self._invoicing(failing=bad):
+            bad_row._lms_process()
+        self.assertEqual(bad_row.state, "failed")
+
+    def test_failed_rows_are_requeued(self):
+        orders = self._lms_orders(self.session, count=2)
+        self.Queue._lms_enqueue(orders)
+        rows = self._rows(orders)
+        rows.write({"state": "failed", "attempts": INVOICE_QUEUE_MAX_ATTEMPTS})
+        # Una ya facturada por otra vía: no se reencola
+        orders[1].account_move = self.invoice
+
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE lms_pos_invoice_queue SET write_date = write_date - interval '2 hours' "
+            "WHERE id IN %s",
+            (tuple(rows.ids),),
+        )
+        rows.invalidate_recordset()
+
+        self.Queue._lms_requeue_failed()
+
+        requeued, invoiced = self._rows(orders[0]), self._rows(orders[1])
+        self.assertEqual((requeued.state, requeued.attempts), ("pending", 0))
+        self.assertEqual(invoiced.state, "failed")
+
+    def test_contended_rows_return_without_attempt(self):
+        orders = self._lms_orders(self.session, count=2)
+        self.Queue._lms_enqueue(orders)
+        rows = self._rows(orders)
+
+        with self._invoicing(stalled=True):
+            rows._lms_process()
+
+        self.assertEqual(set(rows.mapped("state")), {"pending"})
+        self.assertEqual(set(rows.mapped("attempts")), {0})
+        self.assertIn("bloqueada", rows[0].last_error)
+
+    def test_claim_skips_partition_locked_elsewhere(self):
+        other = self._lms_open_session("Caja B")
+        self.Queue._lms_enqueue(self._lms_orders(self.session, count=2))
+        self.Queue._lms_enqueue(self._lms_orders(other, count=2))
+        self.env.flush_all()
+
+        # Otro worker (conexión real aparte) tiene la partición de la caja A
+        with closing(sql_db.db_connect(self.env.cr.dbname).cursor()) as worker_cr:
+            worker_cr.execute(
+                "SELECT pg_try_advisory_xact_lock(hashtext(%s), hashtext(%s))",
+                (self.Queue._table, "%s:%s" % (self.company.id, self.session.config_id.id)),
+            )
+            self.assertTrue(worker_cr.fetchone()[0])
+
+            claimed = self.Queue._lms_claim(10)
+
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(claimed.config_id, other.config_id)
+
+    def test_claim_honors_exclude_ids(self):
+        self.Queue._lms_enqueue(self._lms_orders(self.session, count=3))
+        first = self.Queue._lms_claim(2)
+
+        rest = self.Queue._lms_claim(10, exclude_ids=first.ids)
+
+        self.assertEqual(len(rest), 1)
+        self.assertFalse(rest & first)
+        self.assertFalse(self.Queue._lms_claim(10, exclude_ids=(first | rest).ids))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from ..models.pos_reconcile_cron import RECONCILE_RETRY_BASE, RECONCILE_RETRY_MAX
+from .common import LmsFiscalCommon
+
+
+@tagged("post_install", "-at_install")
+class TestReconcileState(LmsFiscalCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Move = cls.env["account.move"].sudo()
+
+    def _pending_invoice(self, state="pending"):
+        invoice = self.init_invoice("out_invoice", amounts=[100.0])
+        invoice.write({"lms_reconcile_state": state, "invoice_origin": "Caja LMS/0001"})
+        self.env.flush_all()
+        return invoice
+
+    def _assert_retry_in(self, invoice, delay):
+        self.assertEqual(invoice.lms_reconcile_state, "retry")
+        self.assertAlmostEqual(
+            (invoice.lms_reconcile_next_try - fields.Datetime.now()).total_seconds(),
+            delay.total_seconds(),
+            delta=5,
+        )
+
+    def test_retry_backoff_progression(self):
+        invoice = self._pending_invoice()
+
+        for attempt in range(1, 4):
+            self.Move._lms_mark_reconcile_result(invoice, self.Move, {invoice.id: "no_payment"})
+            self.assertEqual(invoice.lms_reconcile_attempts, attempt)
+            self.assertEqual(invoice.lms_reconcile_reason, "no_payment")
+            # 5, 10, 20 minutos
+            self._assert_retry_in(invoice, RECONCILE_RETRY_BASE * 2 ** (attempt - 1))
+
+        invoice.lms_reconcile_attempts = 20
+        self.env.flush_all()
+        self.Move._lms_mark_reconcile_result(invoice, self.Move, {})
+        self._assert_retry_in(invoice, RECONCILE_RETRY_MAX)
+
+        self.Move._lms_mark_reconcile_result(invoice, invoice, {})
+        self.assertEqual(invoice.lms_reconcile_state, "done")
+        self.assertFalse(invoice.lms_reconcile_next_try)
+        self.assertFalse(invoice.lms_reconcile_reason)
+
+    def test_waiting_invoice_wakes_only_after_close_reconcile(self):
+        session = self._lms_open_session()
+        order = self._lms_orders(session)
+        invoice = self._pending_invoice("waiting")
+        order.account_move = invoice
+
+        # Sesión abierta: sigue en espera
+        self.Move._lms_wake_late_invoices()
+        self.assertEqual(invoice.lms_reconcile_state, "waiting")
+
+        # Cerrada pero su conciliación de cierre aún no corrió
+        session.write({"state": "closed", "lms_reconcile_pending": True})
+        self.assertFalse(self.Move._lms_wake_late_invoices())
+        self.assertEqual(invoice.lms_reconcile_state, "waiting")
+
+        session.lms_reconcile_pending = False
+        self.assertEqual(self.Move._lms_wake_late_invoices(), 1)
+        self.assertEqual(invoice.lms_reconcile_state, "pending")
+        self.assertTrue(invoice.lms_reconcile_next_try)
+
+    def test_non_pos_moves_stay_out_of_sweeper(self):
+        bill = self.init_invoice("in_invoice", amounts=[100.0], post=True)
+        manual = self.init_invoice("out_invoice", amounts=[100.0], post=True)
+
+        self.assertFalse(bill.lms_reconcile_state)
+        self.assertFalse(manual.lms_reconcile_state)
+        self.assertFalse(self.Move.search([
+            ("id", "in", (bill | manual).ids),
+            ("lms_reconcile_state", "in", ("pending", "retry")),
+        ]))